@@ -0,0 +1,237 @@
+"""
+Benchmark each stage of the analysis on synthetic FATES history files (see rfh_synthetic.py), so
+performance can be measured on any machine without real CTSM output. Run with --help for options.
+"""
+# pylint: disable=invalid-name
+# pylint: disable=fixme
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import rfh_compare
+from rfh_context import Rfh_Config, Rfh_Context
+from rfh_git import run_git_cmd
+import rfh_synthetic
+import rfh_utils
+
+TEST_NAME = "SMS_Lm49.f10_f10_mg37.I2000Clm60Fates.synthetic.clm-FatesColdAllVarsMonthly"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-lat", type=int, default=46, help="Number of latitudes")
+    parser.add_argument("--n-lon", type=int, default=72, help="Number of longitudes")
+    parser.add_argument(
+        "--n-vars", type=int, default=40, help="Number of per-age variables per file"
+    )
+    parser.add_argument(
+        "--n-bad-vars", type=int, default=4, help="How many of those should fail the check"
+    )
+    parser.add_argument(
+        "--n-mean-vars",
+        type=int,
+        default=0,
+        help="How many more should be saved as each age class's own value, so they fail the check"
+        + " of the sum but pass the check of the weighted mean",
+    )
+    parser.add_argument("--n-testsets", type=int, default=2, help="Number of testsets to compare")
+    parser.add_argument("--n-files", type=int, default=1, help="History files per testset")
+    parser.add_argument("--n-times", type=int, default=1, help="Timesteps per history file")
+    parser.add_argument("--repeat", type=int, default=3, help="Times to run each stage")
+    parser.add_argument(
+        "--n-plot-workers",
+        type=int,
+        default=None,
+        help="Processes for rendering plots (default: all available cores)",
+    )
+    parser.add_argument("--plot-format", default="png", help="png, svg, or webp")
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="Where to put the testsets and publish repo (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=rfh_compare.CHUNK_SIZE,
+        help="Points per variable reduced at a time when comparing; 0 for all at once"
+        + f" (default: {rfh_compare.CHUNK_SIZE})",
+    )
+    parser.add_argument("--keep", action="store_true", help="Don't delete workdir when done")
+    parser.add_argument("--json", default=None, help="Also save the timings to this JSON file")
+    return parser.parse_args()
+
+
+def make_testsets(args, workdir):
+    testset_dir_list = []
+    for i in range(args.n_testsets):
+        top_testset_dir = os.path.join(workdir, f"tests_{i:04d}-synthetic")
+        rfh_synthetic.make_testset(
+            top_testset_dir,
+            TEST_NAME,
+            n_lat=args.n_lat,
+            n_lon=args.n_lon,
+            n_vars=args.n_vars,
+            n_files=args.n_files,
+            n_times=args.n_times,
+            n_bad_vars=args.n_bad_vars if i > 0 else 0,
+            n_mean_vars=args.n_mean_vars,
+            ctsm_sha=f"{i:09x}",
+            fates_sha=f"{i:08x}",
+            seed=i,
+        )
+        testset_dir_list.append(top_testset_dir)
+    return testset_dir_list
+
+
+def make_publish_repo(workdir):
+    """
+    Make a git repo to publish to, with a bare repo as its remote so that pushing works offline
+    """
+    remote_dir = os.path.join(workdir, "remote.git")
+    publish_dir = os.path.join(workdir, "publish")
+    run_git_cmd(["git", "init", "-q", "--bare", remote_dir])
+    run_git_cmd(["git", "clone", "-q", remote_dir, publish_dir])
+    for key, value in [("user.name", "benchmark"), ("user.email", "benchmark@localhost")]:
+        run_git_cmd(["git", "-C", publish_dir, "config", key, value])
+    with open(os.path.join(publish_dir, "README.md"), "w") as f:
+        f.write("Benchmark outputs\n")
+    run_git_cmd(["git", "-C", publish_dir, "add", "README.md"])
+    run_git_cmd(["git", "-C", publish_dir, "commit", "-q", "-m", "Initial commit"])
+    run_git_cmd(["git", "-C", publish_dir, "push", "-q", "-u", "origin", "HEAD"])
+    return publish_dir
+
+
+class Timer:
+    def __init__(self):
+        self.times = {}
+
+    def time(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.times.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+
+def load(ctx):
+    datasets = rfh_utils.get_datasets(ctx)
+    for ds in datasets:
+        ds.load()
+    return datasets
+
+
+def deduplex_all(ctx, datasets, dict_perage_to_non_equiv):
+    """
+    Group the variables and unfold their duplexed dimensions into stacks, batch by batch, as the
+    compare stage does before comparing (see rfh_utils.iter_batch_results()). The datasets are
+    already loaded, so this doesn't include reading.
+    """
+    for ds in datasets:
+        groups, _ = rfh_utils.get_comparison_groups(ds, dict_perage_to_non_equiv, [])
+        for (_, ap_shape, _), members in groups.items():
+            batch_size = ctx.config.batch_max_vars or len(members)
+            for b in range(0, len(members), batch_size):
+                rfh_utils.stack_batch(members[b : b + batch_size], ap_shape)
+
+
+def plot_all(ctx, datasets, dict_perage_to_non_equiv):
+    futures = []
+    for perage_var, this_dict in dict_perage_to_non_equiv.items():
+        if this_dict["non_perage_equiv"] is None or all(this_dict["all_nan"]):
+            continue
+        if all(boxstats["n"] == 0 for boxstats in this_dict["boxstats"]):
+            continue
+        futures.append(
+            rfh_utils.make_boxplots(ctx, datasets, perage_var, this_dict, perage_var)
+        )
+    for future in futures:
+        future.result()
+    ctx.close()
+
+
+def write_report(ctx, datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing):
+    rfh_utils.write_report(
+        ctx, datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing
+    )
+    ctx.close()
+    ctx.write.flush()
+
+
+def publish(ctx):
+    ctx.git.stage_report(ctx.logfile)
+    rfh_utils.publish(ctx)
+
+
+def run_once(timer, config, testset_dir_list):
+    ctx = Rfh_Context(config)
+    ctx.start_comparison(TEST_NAME, testset_dir_list)
+
+    datasets = timer.time("load", load, ctx)
+    dict_perage_to_non_equiv, missing_var_lists = timer.time(
+        "map",
+        rfh_utils.get_dict_perage_to_non_equiv,
+        [ds.attrs["manifest"] for ds in datasets],
+    )
+    timer.time("deduplex", deduplex_all, ctx, datasets, dict_perage_to_non_equiv)
+    dict_perage_to_non_equiv, nonperage_missing = timer.time(
+        "compare", rfh_utils.compare_all, ctx, datasets, dict_perage_to_non_equiv, []
+    )
+    timer.time("plot", plot_all, ctx, datasets, dict_perage_to_non_equiv)
+    timer.time(
+        "report",
+        write_report,
+        ctx,
+        datasets,
+        dict_perage_to_non_equiv,
+        missing_var_lists,
+        nonperage_missing,
+    )
+    timer.time("publish", publish, ctx)
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rfh_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"Working in {workdir}")
+
+    rfh_compare.CHUNK_SIZE = args.chunk_size or None
+    timer = Timer()
+    try:
+        testset_dir_list = timer.time("generate", make_testsets, args, workdir)
+        publish_dir = make_publish_repo(workdir)
+        config = Rfh_Config(
+            publish_dir=publish_dir,
+            publish_url="file://" + publish_dir + "/",
+            n_plot_workers=args.n_plot_workers,
+            plot_format=args.plot_format,
+        )
+        for _ in range(args.repeat):
+            run_once(timer, config, testset_dir_list)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir)
+
+    print(f"\n{'stage':<10} {'median (s)':>12} {'min (s)':>12}")
+    summary = {}
+    for stage, times in timer.times.items():
+        summary[stage] = {
+            "median": statistics.median(times),
+            "min": min(times),
+            "all": times,
+        }
+        print(f"{stage:<10} {summary[stage]['median']:>12.4f} {summary[stage]['min']:>12.4f}")
+    print("(report includes rendering the plots again)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "stages": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
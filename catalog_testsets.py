@@ -0,0 +1,51 @@
+"""
+Catalog every testset in one or more campaign directories (e.g., the fates-refactor-history
+directory on /glade/campaign): the CTSM and FATES versions of each testset and the history files of
+each test in it. Testsets are scanned in parallel, and the catalog is saved to CATALOG_FILE (set in
+options.py, or given with --output), where the analysis scripts look things up instead of
+searching the testsets. Run with --help for options.
+"""
+# pylint: disable=invalid-name
+# pylint: disable=fixme
+
+import argparse
+import time
+
+from rfh_catalog import Rfh_Catalog
+from rfh_context import Rfh_Config
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("campaign_dirs", nargs="+", help="Directories containing testsets")
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Catalog file to create or update (default: CATALOG_FILE from options.py)",
+    )
+    parser.add_argument(
+        "--n-workers", type=int, default=32, help="Testsets to scan at once (default: 32)"
+    )
+    return parser.parse_args()
+
+
+args = parse_args()
+catalog_file = args.output
+if catalog_file is None:
+    catalog_file = Rfh_Config.from_options().catalog_file
+if catalog_file is None:
+    raise RuntimeError("Give --output or set CATALOG_FILE in options.py")
+
+start = time.perf_counter()
+catalog = Rfh_Catalog(catalog_file)
+n_testsets = catalog.scan(args.campaign_dirs, n_workers=args.n_workers)
+catalog.save()
+n_files = sum(
+    len(test["history_files"])
+    for entry in catalog.testsets.values()
+    for test in entry["tests"].values()
+)
+print(
+    f"Scanned {n_testsets} testsets in {time.perf_counter() - start:.1f} s; {catalog_file} now"
+    f" lists {len(catalog.testsets)} testsets with {n_files} history files"
+)
@@ -0,0 +1,79 @@
+"""
+Like check_AP_variables_NONwtd.py, but for every combination of a test in BATCH_TEST_NAMES and a
+list of testsets in BATCH_TESTSET_DIR_LISTS (both set in options.py). Each test in each testset
+is loaded and analyzed only once, in a pool of worker processes, no matter how many comparisons it
+appears in; reports are written as soon as the analyses they need are done. All reports are
+published in one commit.
+"""
+# pylint: disable=invalid-name
+# pylint: disable=fixme
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from options import BATCH_TEST_NAMES, BATCH_TESTSET_DIR_LISTS
+from rfh_context import Rfh_Config, Rfh_Context
+import rfh_utils
+
+ctx = Rfh_Context(Rfh_Config.from_options())
+
+# Every comparison to make, and how many of them need each test in each testset
+comparisons = []
+n_uses = {}
+for test_name in BATCH_TEST_NAMES:
+    for testset_dir_list in BATCH_TESTSET_DIR_LISTS:
+        comparisons.append((test_name, testset_dir_list))
+        for testset_dir in testset_dir_list:
+            key = (test_name, testset_dir)
+            n_uses[key] = n_uses.get(key, 0) + 1
+
+###############
+### Process ###
+###############
+
+# Fork rather than spawn: This script isn't import-safe
+with ProcessPoolExecutor(
+    max_workers=ctx.config.n_batch_workers, mp_context=multiprocessing.get_context("fork")
+) as executor:
+    # Submit in the order they'll be needed, so reports can start while later testsets load
+    futures = {}
+    for test_name, testset_dir_list in comparisons:
+        for testset_dir in testset_dir_list:
+            key = (test_name, testset_dir)
+            if key not in futures:
+                futures[key] = executor.submit(
+                    rfh_utils.analyze_testset, ctx, testset_dir, test_name
+                )
+
+    for test_name, testset_dir_list in comparisons:
+        ctx.start_comparison(test_name, testset_dir_list)
+        analyses = []
+        for testset_dir in testset_dir_list:
+            key = (test_name, testset_dir)
+            analyses.append(futures[key].result())
+
+            # Free the results once no more comparisons need them
+            n_uses[key] -= 1
+            if n_uses[key] == 0:
+                del futures[key]
+
+        (
+            datasets,
+            dict_perage_to_non_equiv,
+            missing_var_lists,
+            nonperage_missing,
+        ) = rfh_utils.combine_analyses(ctx, analyses)
+        rfh_utils.write_report(
+            ctx, datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing
+        )
+        rfh_utils.finish_report(ctx)
+        del analyses, datasets, dict_perage_to_non_equiv
+
+#################
+### Finish up ###
+#################
+
+rfh_utils.publish(ctx, background=ctx.config.push_in_background)
+
+# Don't exit while a background push is still running, so that if it fails, we hear about it
+ctx.git.wait_for_push()
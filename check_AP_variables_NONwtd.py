@@ -6,88 +6,43 @@ non-per-ageclass version.
 # pylint: disable=invalid-name
 # pylint: disable=fixme
 
-import numpy as np
+from options import TEST_NAME, TESTSET_DIR_LIST
+from rfh_context import Rfh_Config, Rfh_Context
 import rfh_utils
 
 ###############
 ### Process ###
 ###############
 
+ctx = Rfh_Context(Rfh_Config.from_options())
+ctx.start_comparison(TEST_NAME, TESTSET_DIR_LIST)
+
 # Get datasets
-datasets = rfh_utils.get_datasets()
+datasets = rfh_utils.get_datasets(ctx)
 
 # Get per-ageclass variables and their equivalents
 dict_perage_to_non_equiv, missing_var_lists = rfh_utils.get_dict_perage_to_non_equiv(
-    datasets
+    [ds.attrs["manifest"] for ds in datasets]
 )
 
 # Analyze
 nonperage_missing = []
-too_many_duplexed = []
-all_nan = []
-no_boxdata = []
-
-for perage_var in dict_perage_to_non_equiv:
-    (
-        non_perage_equiv,
-        suffix,
-        this_dict,
-        do_deduplex,
-        var_to_print,
-    ) = rfh_utils.get_variable_info(dict_perage_to_non_equiv, perage_var)
-
-    if non_perage_equiv is None:
-        nonperage_missing.append(var_to_print)
-        continue
-
-    for i, ds in enumerate(datasets):
-        # Get DataArrays to work with
-        da = ds[non_perage_equiv]
-
-        # Deduplex, if needed and possible
-        if do_deduplex:
-            da_ap, too_many_duplexed = rfh_utils.deduplex(
-                ds, suffix, too_many_duplexed, perage_var, var_to_print
-            )
-            if var_to_print in too_many_duplexed:
-                break
-        else:
-            da_ap = ds[perage_var].copy()
-
-        # Get unweighted sum
-        da_ap_sum = rfh_utils.get_unweighted_sum(suffix, da, da_ap)
-
-        # Test
-        this_dict = rfh_utils.compare_results(this_dict, da, da_ap_sum)
-
-    if too_many_duplexed and too_many_duplexed[-1] == var_to_print:
-        continue
-
-    # Check for data that won't be plotted
-    if all(np.all(np.isnan(da_diff)) for da_diff in this_dict["da_diffs"]):
-        all_nan.append(var_to_print)
-        continue
-    if all(len(boxdata) == 0 for boxdata in this_dict["boxdata"]):
-        no_boxdata.append(var_to_print)
-        continue
-
-    rfh_utils.add_result_text(
-        non_perage_equiv,
-        perage_var,
-        this_dict,
-        var_to_print,
+dict_perage_to_non_equiv, nonperage_missing = rfh_utils.compare_all(
+    ctx, datasets, dict_perage_to_non_equiv, nonperage_missing
+)
+if ctx.config.all_timesteps:
+    dict_perage_to_non_equiv, nonperage_missing = rfh_utils.stream_all_timesteps(
+        ctx, datasets, dict_perage_to_non_equiv, nonperage_missing
     )
 
-    # Make boxplots
-    rfh_utils.make_boxplots(datasets, perage_var, this_dict, var_to_print)
-
-    dict_perage_to_non_equiv[perage_var] = this_dict
+# Report
+rfh_utils.write_report(
+    ctx, datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing
+)
 
 #################
 ### Finish up ###
 #################
 
-rfh_utils.add_end_text(
-    nonperage_missing, too_many_duplexed, missing_var_lists, all_nan, no_boxdata
-)
-rfh_utils.publish()
+rfh_utils.finish_report(ctx)
+rfh_utils.publish(ctx)
@@ -0,0 +1,107 @@
+"""
+Query the results recorded in METRICS_DB (set in options.py, or given with --db) without rerunning
+any comparisons:
+    trend VARIABLE: the variable's results in every testset, in the order the tests ran
+    failing: every variable that failed the check
+    testsets: each testset recorded, with how many of its variables failed
+Run with --help for options.
+"""
+# pylint: disable=invalid-name
+# pylint: disable=fixme
+
+import argparse
+import time
+
+from rfh_context import Rfh_Config
+from rfh_metrics import Rfh_Metrics
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--db", default=None, help="Metrics database (default: METRICS_DB from options.py)"
+    )
+    parser.add_argument("--test", default=None, help="Only show results for this test")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    trend = subparsers.add_parser("trend", help="A variable's results across testsets")
+    trend.add_argument("variable", help="Per-age variable, e.g., FATES_BURNFRAC_AP")
+    failing = subparsers.add_parser("failing", help="Variables that failed the check")
+    failing.add_argument("--label", default=None, help="Only this FATES (or CTSM) version")
+    subparsers.add_parser("testsets", help="Testsets recorded, with counts of failing variables")
+    return parser.parse_args()
+
+
+def fmt(x, spec):
+    return "NaN" if x is None else format(x, spec)
+
+
+def fmt_run_time(run_time):
+    if run_time is None:
+        return "unknown"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(run_time))
+
+
+def print_table(header, rows):
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(x).ljust(w) for x, w in zip(row, widths)).rstrip())
+
+
+def print_results(results, show_variable):
+    header = ["test", "run", "testset", "label", "ctsm"]
+    if show_variable:
+        header.append("variable")
+    header += ["ok", "max abs diff", "max rel diff", "wtd ok"]
+    rows = []
+    for r in results:
+        row = [r["test_name"], fmt_run_time(r["run_time"]), r["testset"], r["label"], r["ctsm_sha"]]
+        if show_variable:
+            row.append(r["variable"])
+        if r["all_nan"]:
+            row += ["all NaN", "", "", ""]
+        else:
+            row += [
+                "✓" if r["isclose"] else "X",
+                fmt(r["max_abs_diff"], ".3g"),
+                fmt(r["max_pct_diff"], ".1f") + "%",
+                "" if r["wtd_max_abs_diff"] is None else "✓" if r["wtd_isclose"] else "X",
+            ]
+        rows.append(row)
+    print_table(header, rows)
+
+
+args = parse_args()
+db = args.db
+if db is None:
+    db = Rfh_Config.from_options().metrics_db
+if db is None:
+    raise RuntimeError("Give --db or set METRICS_DB in options.py")
+
+metrics = Rfh_Metrics(db)
+if args.command == "trend":
+    results = metrics.trend(args.variable, test_name=args.test)
+    if results:
+        print_results(results, show_variable=False)
+    else:
+        print(f"No results for {args.variable}")
+elif args.command == "failing":
+    print_results(metrics.failing(test_name=args.test, label=args.label), show_variable=True)
+else:
+    print_table(
+        ["test", "run", "testset", "label", "ctsm", "variables", "failing"],
+        [
+            [
+                r["test_name"],
+                fmt_run_time(r["run_time"]),
+                r["testset"],
+                r["label"],
+                r["ctsm_sha"],
+                r["n_variables"],
+                r["n_failing"],
+            ]
+            for r in metrics.testsets(test_name=args.test)
+        ],
+    )
+metrics.close()
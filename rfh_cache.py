@@ -0,0 +1,199 @@
+"""
+Class for caching each history file's comparison results on disk
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+import hashlib
+import os
+
+import numpy as np
+
+from rfh_compare import BOXSTATS_KEYS
+from rfh_files import get_file_key, open_atomic
+
+# Arrays saved for a variable's worst discrepancies, besides their coordinates
+WORST_KEYS = ("diff", "sum", "ref", "index")
+
+
+def get_code_version(modules, settings=()):
+    """
+    Hash the source of the modules that produce the results, so that changing the analysis
+    invalidates everything cached by the old version. Modules can also be given as paths to their
+    source, so they needn't be imported. Any settings that change the results (e.g., how many
+    outliers are kept) are hashed too, so results made with other settings aren't reused.
+    """
+    h = hashlib.sha256()
+    for module in modules:
+        with open(getattr(module, "__file__", module), "rb") as f:
+            h.update(f.read())
+    h.update(repr(list(settings)).encode("utf8"))
+    return h.hexdigest()[:16]
+
+
+def get_worst(npz, this_var):
+    """
+    Get a variable's worst discrepancies (see rfh_utils.locate_worst_points()) back from how
+    Rfh_Cache.put() saves them: an array for each of WORST_KEYS and for each dimension's
+    coordinates, each with its original dtype (so that fingerprints of the results don't change)
+    """
+    dims = npz[this_var + ".worst_dims"].tolist()
+    worst = {key: npz[f"{this_var}.worst_{key}"] for key in WORST_KEYS}
+    worst["dims"] = dims
+    worst["coords"] = {dim: npz[f"{this_var}.worst_coord{i}"] for i, dim in enumerate(dims)}
+    return worst
+
+
+class Rfh_Cache:
+    def __init__(self, cache_dir, max_bytes, code_version):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.code_version = code_version
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_path(self, history_file):
+        key = get_file_key(history_file, self.code_version)
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, history_file):
+        """
+        Get the cached results for a history file, as a dict of variable name: (all_nan,
+        max_abs_diff, max_pct_diff, isclose, boxstats, wtd_max_abs_diff, wtd_max_pct_diff,
+        wtd_isclose, worst). Empty if nothing is cached.
+        """
+        path = self.get_path(history_file)
+        results = {}
+        try:
+            with np.load(path) as npz:
+                for key in npz.files:
+                    this_var, member = key.rsplit(".", 1)
+                    if member != "stats":
+                        continue
+                    (
+                        all_nan,
+                        max_abs_diff,
+                        max_pct_diff,
+                        isclose,
+                        wtd_max_abs_diff,
+                        wtd_max_pct_diff,
+                        wtd_isclose,
+                    ) = npz[key]
+                    boxstats = dict(zip(BOXSTATS_KEYS, npz[this_var + ".boxstats"].tolist()))
+                    for key in ["n", "n_nan", "n_fliers"]:
+                        boxstats[key] = int(boxstats[key])
+                    boxstats["fliers"] = npz[this_var + ".fliers"]
+                    worst = None
+                    if this_var + ".worst_dims" in npz.files:
+                        worst = get_worst(npz, this_var)
+                    results[this_var] = (
+                        bool(all_nan),
+                        max_abs_diff,
+                        max_pct_diff,
+                        bool(isclose),
+                        boxstats,
+                        wtd_max_abs_diff,
+                        wtd_max_pct_diff,
+                        bool(wtd_isclose),
+                        worst,
+                    )
+        except FileNotFoundError:
+            return results
+
+        # Mark as recently used
+        os.utime(path)
+        return results
+
+    def get_diffs_at(self, history_file, lookups):
+        """
+        Get variables' cached discrepancies at some points, without reading the history file
+        again. lookups is a list of (variable name, flat indices into its deduplexed non-per-age
+        equivalent). Returns a list of the discrepancies at each lookup's indices, or None where
+        they aren't cached (or the indices are out of range).
+        """
+        diffs_at = [None] * len(lookups)
+        try:
+            with np.load(self.get_path(history_file)) as npz:
+                for k, (this_var, index) in enumerate(lookups):
+                    if this_var + ".diffs" not in npz.files:
+                        continue
+                    diffs = npz[this_var + ".diffs"]
+                    if not index.size or index.max() < diffs.size:
+                        diffs_at[k] = diffs[index]
+        except FileNotFoundError:
+            pass
+        return diffs_at
+
+    def put(self, history_file, results, diffs=None):
+        """
+        Save results (in the format returned by get()) for a history file, replacing whatever was
+        cached for it before, along with each variable's discrepancies at every point (a dict of
+        variable name: flat array; see get_diffs_at()). Variables missing from diffs keep any
+        discrepancies cached for them before. Then evict least-recently-used entries until the
+        cache fits in max_bytes.
+        """
+        path = self.get_path(history_file)
+        arrays = {}
+        diffs = diffs or {}
+        try:
+            with np.load(path) as npz:
+                for this_var in results:
+                    if this_var not in diffs and this_var + ".diffs" in npz.files:
+                        arrays[this_var + ".diffs"] = npz[this_var + ".diffs"]
+        except FileNotFoundError:
+            pass
+        for this_var, var_diffs in diffs.items():
+            arrays[this_var + ".diffs"] = var_diffs
+        for this_var, var_results in results.items():
+            (
+                all_nan,
+                max_abs_diff,
+                max_pct_diff,
+                isclose,
+                boxstats,
+                *wtd_results,
+                worst,
+            ) = var_results
+            arrays[this_var + ".stats"] = np.array(
+                [all_nan, max_abs_diff, max_pct_diff, isclose] + wtd_results, dtype=np.float64
+            )
+            arrays[this_var + ".boxstats"] = np.array(
+                [boxstats[key] for key in BOXSTATS_KEYS], dtype=np.float64
+            )
+            arrays[this_var + ".fliers"] = boxstats["fliers"]
+            if worst is not None:
+                for key in WORST_KEYS:
+                    arrays[f"{this_var}.worst_{key}"] = worst[key]
+                for i, dim in enumerate(worst["dims"]):
+                    arrays[f"{this_var}.worst_coord{i}"] = worst["coords"][dim]
+                arrays[this_var + ".worst_dims"] = np.array(worst["dims"], dtype=str)
+
+        # Write atomically, so an interrupted run can't leave a corrupt entry
+        with open_atomic(path, "wb") as f:
+            np.savez(f, **arrays)
+
+        self.evict()
+
+    def evict(self):
+        # Other processes may be evicting at the same time, so tolerate files disappearing
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        entries.sort()
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
@@ -0,0 +1,203 @@
+"""
+Functions and class for cataloging testsets: their CTSM and FATES versions and the history files
+of each test, so analyses can look them up instead of searching the testset filesystem
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import os
+import re
+
+from rfh_files import write_json
+
+# FATES versions of CTSM commits whose SRCROOT_GIT_STATUS doesn't give them usably
+CTSM_SHA_TO_FATES = {
+    "8e7a1d85f": "fates-ff87ce15",
+    "a6ccdf3ec": "fates-66cc4f81",
+    "7680fc6e8": "fates-1ec6d6eb",
+    "41a4cb47b": "fates-103fdc96",
+    "fe9ed7376": "fates-a0881c536",
+    "a807670c1": "fates-f21fa95b",
+}
+
+# History files of a test, relative to its directory in a testset
+HISTORY_GLOB = os.path.join("run", "*.clm2.h0.*nc")
+
+# Directories of a test in a testset, relative to the testset: named after the test, optionally
+# followed by a test ID. Not just any name starting with the test's, which would also match e.g.
+# clm-FatesColdAllVarsMonthly for clm-FatesColdAllVars.
+TEST_DIR_GLOBS = ["{}", "{}.*"]
+
+CTSM_PATTERN = re.compile("^Current hash:.*$")
+FATES_PATTERN = re.compile(".*    fates .*")
+
+
+def is_test_dir(dir_name, test_name):
+    """
+    Whether a directory in a testset (given by its name) is one of test_name's (see TEST_DIR_GLOBS)
+    """
+    return dir_name == test_name or dir_name.startswith(test_name + ".")
+
+
+def glob_history_files(top_testset_dir, test_name):
+    """
+    Search a testset for the history files of a test, in every one of its directories. Sorted.
+    """
+    file_list = []
+    for test_dir_glob in TEST_DIR_GLOBS:
+        test_dir_glob = test_dir_glob.format(glob.escape(test_name))
+        file_list += glob.glob(os.path.join(top_testset_dir, test_dir_glob, HISTORY_GLOB))
+    return sorted(file_list)
+
+
+def get_fates_label(fates_line):
+    if "is out of sync with .gitmodules" in fates_line:
+        x = 3
+    else:
+        x = -1
+    sha = re.split(r"\s+", fates_line)[x]
+    if len(sha) > 8:
+        sha = sha[:8]
+    return "fates-" + sha
+
+
+def read_git_status(srcroot_git_status_file):
+    """
+    Read a testset's SRCROOT_GIT_STATUS in one pass. Returns its "Current hash" line (relabeled as
+    the CTSM hash) and the testset's label: its FATES version, or if that can't be determined, its
+    CTSM version. Both are "unknown" if the file doesn't exist.
+    """
+    this_commit = None
+    ctsm_sha = None
+    fates_line = None
+    try:
+        with open(srcroot_git_status_file) as f:
+            for line in f:
+                if this_commit is None and CTSM_PATTERN.match(line):
+                    this_commit = line.rstrip("\n")
+                    ctsm_sha = this_commit.split(" ")[2]
+                elif fates_line is None and FATES_PATTERN.match(line):
+                    fates_line = FATES_PATTERN.match(line)[0]
+    except FileNotFoundError:
+        return "unknown", "unknown"
+    if this_commit is None:
+        return "unknown", "unknown"
+    this_commit = this_commit.replace("Current hash", "Current CTSM hash")
+
+    if ctsm_sha in CTSM_SHA_TO_FATES:
+        label = CTSM_SHA_TO_FATES[ctsm_sha]
+    elif fates_line is not None:
+        label = get_fates_label(fates_line)
+    else:
+        print(f"Unable to get FATES SHA for CTSM SHA {ctsm_sha}")
+        label = "ctsm-" + ctsm_sha
+    return this_commit, label
+
+
+def scan_testset(top_testset_dir):
+    """
+    Catalog one testset: its versions (see read_git_status()), and for each test directory in it,
+    the sorted list of history files and the directory's modification time (for noticing new ones)
+    """
+    this_commit, label = read_git_status(os.path.join(top_testset_dir, "SRCROOT_GIT_STATUS"))
+    tests = {}
+    with os.scandir(top_testset_dir) as entries:
+        for entry in entries:
+            run_dir = os.path.join(entry.path, "run")
+            if not entry.is_dir() or not os.path.isdir(run_dir):
+                continue
+            tests[entry.name] = {
+                "run_dir_mtime_ns": os.stat(run_dir).st_mtime_ns,
+                "history_files": sorted(glob.glob(os.path.join(entry.path, HISTORY_GLOB))),
+            }
+    return {
+        "this_commit": this_commit,
+        "label": label,
+        "mtime_ns": os.stat(top_testset_dir).st_mtime_ns,
+        "tests": tests,
+    }
+
+
+class Rfh_Catalog:
+    """
+    Persistent index of testsets, made by scan() (e.g., with catalog_testsets.py) and saved as
+    JSON. Lookups check (with a stat per directory) that nothing has been added since, and return
+    None if it has, so callers can fall back to searching the testset themselves.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Real path of testset directory: output of scan_testset()
+        self.testsets = {}
+        try:
+            with open(path) as f:
+                self.testsets = json.load(f)["testsets"]
+        except FileNotFoundError:
+            pass
+
+    def scan(self, campaign_dirs, n_workers=32):
+        """
+        Catalog every testset (subdirectory with tests in it) in some campaign directories, several
+        at a time. Scanning is mostly waiting on the filesystem, so this uses threads. Returns the
+        number of testsets found.
+        """
+        testset_dirs = []
+        for campaign_dir in campaign_dirs:
+            with os.scandir(campaign_dir) as entries:
+                testset_dirs += [os.path.realpath(e.path) for e in entries if e.is_dir()]
+        n_testsets = 0
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for top_testset_dir, entry in zip(
+                testset_dirs, executor.map(scan_testset, testset_dirs)
+            ):
+                if entry["tests"]:
+                    self.testsets[top_testset_dir] = entry
+                    n_testsets += 1
+        return n_testsets
+
+    def get_testset(self, top_testset_dir):
+        """
+        Get a testset's entry, if it's cataloged and no tests have been added since
+        """
+        top_testset_dir = os.path.realpath(top_testset_dir)
+        entry = self.testsets.get(top_testset_dir)
+        if entry is None:
+            return None
+        try:
+            if os.stat(top_testset_dir).st_mtime_ns != entry["mtime_ns"]:
+                return None
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def get_history_files(self, top_testset_dir, test_name):
+        """
+        Get the sorted history files of a test (in every one of its directories, like
+        glob_history_files()), if cataloged and up to date. Returns None if not, or if there are
+        none.
+        """
+        entry = self.get_testset(top_testset_dir)
+        if entry is None:
+            return None
+        file_list = []
+        for test_dir, test in entry["tests"].items():
+            if not is_test_dir(test_dir, test_name):
+                continue
+            run_dir = os.path.join(os.path.realpath(top_testset_dir), test_dir, "run")
+            try:
+                if os.stat(run_dir).st_mtime_ns != test["run_dir_mtime_ns"]:
+                    return None
+            except FileNotFoundError:
+                return None
+            file_list += test["history_files"]
+        return sorted(file_list) or None
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.realpath(self.path)), exist_ok=True)
+        write_json(self.path, {"testsets": self.testsets})
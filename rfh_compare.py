@@ -0,0 +1,262 @@
+"""
+Vectorized comparison of per-age variables with their non-per-age equivalents
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=fixme
+
+import numpy as np
+
+# Tolerances for a variable to count as matching its non-per-age equivalent
+MAX_ABS_DIFF_TOL = 1e-9
+MAX_PCT_DIFF_TOL = 1e-6
+
+# Whiskers extend to the most extreme data within this many interquartile ranges of the box, as in
+# matplotlib's boxplot()
+WHISKER_IQRS = 1.5
+
+# Number of points of a variable that get_diff_stats() works on at a time. Bounds the size of its
+# temporaries, while being big enough that the per-chunk overhead doesn't matter. None means all of
+# them at once.
+CHUNK_SIZE = 65536
+
+# Order of the numbers in a boxplot summary, when saved as an array (see rfh_cache.py)
+BOXSTATS_KEYS = ("q1", "med", "q3", "whislo", "whishi", "mean", "n", "n_nan", "n_fliers")
+
+
+def is_close(max_abs_diff, max_pct_diff):
+    return (max_abs_diff < MAX_ABS_DIFF_TOL) & (
+        (max_pct_diff < MAX_PCT_DIFF_TOL) | np.isnan(max_pct_diff)
+    )
+
+
+def get_boxstats(values, n_nan=0, max_fliers=None):
+    """
+    Summarize some (non-NaN) values as everything a boxplot needs, computed the same way as in
+    matplotlib's boxplot(), so the values themselves can be discarded. The result can be passed to
+    matplotlib's bxp(). NOTE: values is sorted in place, which lets the whiskers and outliers be
+    found by bisection instead of by making masked copies.
+
+    n_nan: How many NaNs were left out of values, for the record
+    max_fliers: If there are more outliers than this, only keep this many: half from each end
+    """
+    stats = {"n": values.size, "n_nan": int(n_nan)}
+    if values.size == 0:
+        for key in ["q1", "med", "q3", "whislo", "whishi", "mean"]:
+            stats[key] = np.nan
+        stats["fliers"] = np.array([], dtype=values.dtype)
+        stats["n_fliers"] = 0
+        return stats
+
+    # Before sorting, so the mean is exactly what it would be for the values as given. Finding the
+    # percentiles partially sorts values in place (rather than a copy of it), which is fine since
+    # it's about to be sorted anyway.
+    mean = values.mean()
+    q1, med, q3 = np.percentile(values, [25, 50, 75], overwrite_input=True)
+    values.sort()
+    iqr = q3 - q1
+    i_hi = np.searchsorted(values, q3 + WHISKER_IQRS * iqr, side="right")
+    whishi = q3 if i_hi == 0 or values[i_hi - 1] < q3 else values[i_hi - 1]
+    i_lo = np.searchsorted(values, q1 - WHISKER_IQRS * iqr, side="left")
+    whislo = q1 if i_lo == values.size or values[i_lo] > q1 else values[i_lo]
+
+    # Outliers are at the ends. Copy them, since values may be reused.
+    n_low = np.searchsorted(values, whislo, side="left")
+    n_high = values.size - np.searchsorted(values, whishi, side="right")
+    fliers = np.concatenate([values[:n_low], values[values.size - n_high :]])
+    stats["n_fliers"] = fliers.size
+    if max_fliers is not None and fliers.size > max_fliers:
+        n_low = max_fliers // 2
+        fliers = np.concatenate([fliers[:n_low], fliers[fliers.size - (max_fliers - n_low) :]])
+
+    stats.update(
+        q1=float(q1),
+        med=float(med),
+        q3=float(q3),
+        whislo=float(whislo),
+        whishi=float(whishi),
+        mean=float(mean),
+        fliers=fliers,
+    )
+    return stats
+
+
+def get_worst_points(abs_diffs, k):
+    """
+    Get the indices of the (at most) k largest values in a 1-d array of non-NaN absolute
+    discrepancies, largest first. Uses partial selection, so this is linear in the number of
+    points rather than n log n.
+    """
+    k = min(k, abs_diffs.size)
+    if k == 0:
+        return np.array([], dtype=np.intp)
+    top = np.argpartition(abs_diffs, abs_diffs.size - k)[abs_diffs.size - k :]
+    return top[np.argsort(-abs_diffs[top], kind="stable")]
+
+
+def get_diff_stats(diffs_flat, ref_flat, max_fliers=None, top_k=None, boxstats=True):
+    """
+    Reduce each variable's (row's) discrepancies in one pass, CHUNK_SIZE points at a time, using
+    buffers allocated once for all variables. Nothing else as big as diffs_flat is made.
+
+    diffs_flat, ref_flat: Discrepancies and non-per-age values, with shape (n_vars, n_points)
+    max_fliers: Passed to get_boxstats()
+    top_k: If given, also find each variable's top_k largest discrepancies (see compare_group())
+    boxstats: Whether to summarize the non-NaN discrepancies for a boxplot (see get_boxstats())
+
+    Returns a dict with each variable's max_abs_diff, max_pct_diff, and n_included (number of
+    non-NaN discrepancies), plus lists of their boxstats and worst points if requested (else None).
+    """
+    n_vars, n_points = diffs_flat.shape
+    n_chunk = max(1, min(CHUNK_SIZE or n_points, n_points))
+    abs_buf = np.empty(n_chunk, dtype=diffs_flat.dtype)
+    rel_buf = np.empty(n_chunk, dtype=np.result_type(diffs_flat, ref_flat))
+    mask_buf = np.empty(n_chunk, dtype=bool)
+    values = np.empty(n_points if boxstats else 0, dtype=diffs_flat.dtype)
+
+    max_abs_diff = np.full(n_vars, np.nan)
+    max_pct_diff = np.full(n_vars, np.nan)
+    n_included = np.zeros(n_vars, dtype=np.int64)
+    all_boxstats = [] if boxstats else None
+    worst = [] if top_k else None
+    for i in range(n_vars):
+        # The worst points so far, and the smallest discrepancy that could join them
+        worst_index = np.array([], dtype=np.intp)
+        worst_abs = np.array([], dtype=abs_buf.dtype)
+        threshold = -np.inf
+        for start in range(0, n_points, n_chunk):
+            d = diffs_flat[i, start : start + n_chunk]
+            n = d.size
+            a = np.abs(d, out=abs_buf[:n])
+            r = np.abs(ref_flat[i, start : start + n_chunk], out=rel_buf[:n])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                np.divide(a, r, out=r)
+
+            # fmax ignores NaN, unless everything is NaN
+            max_abs_diff[i] = np.fmax(max_abs_diff[i], np.fmax.reduce(a))
+            max_pct_diff[i] = np.fmax(max_pct_diff[i], np.fmax.reduce(r))
+
+            # Everything but NaN goes into the boxplot
+            m = np.greater_equal(a, 0, out=mask_buf[:n])
+            k = np.count_nonzero(m)
+            if boxstats:
+                np.compress(m, d, out=values[n_included[i] : n_included[i] + k])
+            n_included[i] += k
+
+            # Only points worse than the current top_k'th worst (and not NaN) can be among the
+            # worst, which after the first chunk is usually few or none
+            if top_k:
+                candidates = np.flatnonzero(np.greater(a, threshold, out=mask_buf[:n]))
+                if candidates.size:
+                    worst_index = np.concatenate([worst_index, candidates + start])
+                    worst_abs = np.concatenate([worst_abs, a[candidates]])
+                    keep = get_worst_points(worst_abs, top_k)
+                    worst_index = worst_index[keep]
+                    worst_abs = worst_abs[keep]
+                    if worst_abs.size == top_k:
+                        threshold = worst_abs[-1]
+
+        if boxstats:
+            all_boxstats.append(
+                get_boxstats(
+                    values[: n_included[i]],
+                    n_nan=n_points - n_included[i],
+                    max_fliers=max_fliers,
+                )
+            )
+        if top_k:
+            diff = diffs_flat[i, worst_index]
+            ref = ref_flat[i, worst_index]
+            worst.append({"index": worst_index, "diff": diff, "sum": ref + diff, "ref": ref})
+
+    return {
+        "max_abs_diff": max_abs_diff,
+        "max_pct_diff": 100 * max_pct_diff,
+        "n_included": n_included,
+        "boxstats": all_boxstats,
+        "worst": worst,
+    }
+
+
+def compare_group(ap_stack, ref_stack, age_axis, max_fliers=None, weights=None, top_k=None):
+    """
+    Compare a group of variables that share a dimension signature, all at once.
+
+    ap_stack: The per-age variables, stacked along a new leading axis
+    ref_stack: Their non-per-age equivalents, stacked the same way
+    age_axis: Index of fates_levage in ap_stack (counting the leading axis)
+    max_fliers: Passed to get_boxstats()
+    weights: If given, also check the weighted mean across age classes. Must broadcast against
+             ap_stack. NOTE: ap_stack is then overwritten.
+    top_k: If given, also find where each variable's top_k largest discrepancies are (see
+           get_worst_points()). The "worst" member then has, for each variable, a dict of their
+           flat indices into one variable's diffs ("index"), the discrepancies ("diff"), the sums
+           across age classes ("sum"), and the non-per-age values ("ref").
+
+    Returns a dict whose "diffs" member has the same shape as ref_stack; every other member is
+    indexed by position in the stack. The wtd_* members are NaN (or False) if weights is None, and
+    "worst" is None if top_k isn't given.
+    """
+    n_vars = ref_stack.shape[0]
+    ref_flat = ref_stack.reshape(n_vars, -1)
+
+    # Sum across age classes, then subtract in place to get the discrepancies. Reduce each
+    # variable's discrepancies to statistics and a boxplot summary right away (see
+    # get_diff_stats()), so nothing else grid-sized outlives the batch.
+    diffs = ap_stack.sum(axis=age_axis)
+    np.subtract(diffs, ref_stack, out=diffs)
+    stats = get_diff_stats(diffs.reshape(n_vars, -1), ref_flat, max_fliers, top_k)
+
+    # Same for the weighted mean across age classes, from the same data. Weight ap_stack in place
+    # (it's no longer needed as is), so this doesn't need another array as big as it.
+    if weights is None:
+        wtd_max_abs_diff = np.full(n_vars, np.nan)
+        wtd_max_pct_diff = np.full(n_vars, np.nan)
+    else:
+        np.multiply(ap_stack, weights, out=ap_stack)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            wtd_diffs = ap_stack.sum(axis=age_axis) / weights.sum(axis=age_axis)
+        np.subtract(wtd_diffs, ref_stack, out=wtd_diffs)
+        wtd_stats = get_diff_stats(wtd_diffs.reshape(n_vars, -1), ref_flat, boxstats=False)
+        wtd_max_abs_diff = wtd_stats["max_abs_diff"]
+        wtd_max_pct_diff = wtd_stats["max_pct_diff"]
+        del wtd_diffs
+
+    return {
+        "diffs": diffs,
+        "all_nan": stats["n_included"] == 0,
+        "max_abs_diff": stats["max_abs_diff"],
+        "max_pct_diff": stats["max_pct_diff"],
+        "isclose": is_close(stats["max_abs_diff"], stats["max_pct_diff"]),
+        "boxstats": stats["boxstats"],
+        "wtd_max_abs_diff": wtd_max_abs_diff,
+        "wtd_max_pct_diff": wtd_max_pct_diff,
+        "wtd_isclose": is_close(wtd_max_abs_diff, wtd_max_pct_diff),
+        "worst": stats["worst"],
+    }
+
+
+def new_running_stats():
+    return {
+        "max_abs_diff": np.nan,
+        "max_pct_diff": np.nan,
+        "n_timesteps": 0,
+        "n_over_tol": 0,
+        "first_over_tol": None,
+        "max_abs_diff_series": [],
+    }
+
+
+def update_running_stats(stats, max_abs_diff, max_pct_diff, isclose, timestep):
+    """
+    Fold one timestep's results into a variable's running statistics (from new_running_stats())
+    """
+    stats["max_abs_diff"] = np.fmax(stats["max_abs_diff"], max_abs_diff)
+    stats["max_pct_diff"] = np.fmax(stats["max_pct_diff"], max_pct_diff)
+    if not isclose:
+        stats["n_over_tol"] += 1
+        if stats["first_over_tol"] is None:
+            stats["first_over_tol"] = timestep
+    stats["n_timesteps"] += 1
+    stats["max_abs_diff_series"].append(float(max_abs_diff))
+    return stats
@@ -0,0 +1,293 @@
+"""
+Classes holding the configuration and state of an analysis
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=fixme
+
+import importlib.util
+import os
+
+THISREPO_URL = "https://github.com/samsrabin/fates-refactor-history"
+
+# Settings that can be given in options.py (in uppercase) or to Rfh_Config() (in lowercase), and
+# their defaults. See README.md for descriptions.
+DEFAULTS = {
+    "publish_dir": None,
+    "publish_url": None,
+    "load_only_needed_vars": True,
+    "open_dataset_chunks": None,
+    "n_plot_workers": None,
+    "plot_format": "png",
+    "plot_assets_subdir": None,
+    "batch_max_vars": 64,
+    "all_timesteps": False,
+    "cache_dir": None,
+    "cache_max_bytes": 2 * 1024**3,
+    "n_batch_workers": None,
+    "push_in_background": False,
+    "profile": False,
+    "max_boxplot_fliers": 1000,
+    "incremental": False,
+    "extract_dir": None,
+    "catalog_file": None,
+    "top_k_worst": 5,
+    "watch_poll_seconds": 60,
+    "watch_settle_seconds": 120,
+    "report_format": "html",
+    "metrics_db": None,
+}
+
+
+class Rfh_Config:
+    def __init__(self, **kwargs):
+        unknown = [k for k in kwargs if k not in DEFAULTS]
+        if unknown:
+            raise TypeError(f"Unknown setting(s): {', '.join(unknown)}")
+        for name, default in DEFAULTS.items():
+            setattr(self, name, kwargs.get(name, default))
+
+        # Default to all the cores this process may use
+        n_cpus = len(os.sched_getaffinity(0))
+        if self.n_plot_workers is None:
+            self.n_plot_workers = n_cpus
+        if self.n_batch_workers is None:
+            self.n_batch_workers = n_cpus
+
+        if self.publish_dir is not None:
+            self.publish_dir = os.path.realpath(self.publish_dir)
+        self.manifest_cache_dir = None
+        self.report_cache_dir = None
+        if self.cache_dir:
+            self.manifest_cache_dir = os.path.join(self.cache_dir, "manifests")
+            self.report_cache_dir = os.path.join(self.cache_dir, "reports")
+        if self.report_format not in ("html", "json"):
+            raise ValueError(f"Unknown report_format: {self.report_format}")
+        if self.incremental and not self.cache_dir:
+            raise RuntimeError("Incremental reports need a cache_dir (CACHE_DIR in options.py)")
+
+    @classmethod
+    def from_options(cls, options=None):
+        """
+        Read settings from a module (by default, options.py), using defaults for any not given
+        """
+        if options is None:
+            import options  # pylint: disable=import-outside-toplevel,redefined-outer-name
+        kwargs = {}
+        for name in DEFAULTS:
+            if hasattr(options, name.upper()):
+                kwargs[name] = getattr(options, name.upper())
+        return cls(**kwargs)
+
+
+class Rfh_Context:
+    """
+    Everything an analysis needs besides its data: the configuration and the comparison being
+    made. The git publisher, HTML writer, plotter, and cache are only created (and their modules
+    imported) on first use, so making a context is cheap, and it can be sent to worker processes.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        # Set by start_comparison()
+        self.test_name = None
+        self.testset_dir_list = None
+        self.testset_dir_basename_list = None
+        self.logfile = None
+        self.n_tests = None
+        self.comparing = None
+
+        # An Rfh_Profile if config.profile, else None
+        self.profile = None
+
+        self._git = None
+        self._write = None
+        self._plot = None
+        self._cache = None
+        self._report_manifest = None
+        self._extract_store = None
+        self._catalog = None
+        self._metrics = None
+
+    def __getstate__(self):
+        # Workers create their own, if needed
+        state = self.__dict__.copy()
+        for name in [
+            "_git",
+            "_write",
+            "_plot",
+            "_cache",
+            "_report_manifest",
+            "_extract_store",
+            "_catalog",
+            "_metrics",
+        ]:
+            state[name] = None
+        return state
+
+    def start_comparison(self, test_name, testset_dir_list):
+        """
+        Set up to compare a test across some testsets. Can be called again for another comparison;
+        reports for all comparisons are published together by rfh_utils.publish().
+        """
+        if not isinstance(testset_dir_list, list):
+            testset_dir_list = [testset_dir_list]
+        self.test_name = test_name
+        self.testset_dir_list = testset_dir_list
+        self.testset_dir_basename_list = [os.path.basename(x) for x in testset_dir_list]
+        self.n_tests = len(testset_dir_list)
+        self.comparing = self.n_tests > 1
+
+        self.logfile = os.path.join(
+            self.config.publish_dir,
+            ".".join(
+                ["NONwtd"] + self.testset_dir_basename_list + [test_name, "html.tmp"]
+            ),
+        )
+        print(f"Log file: {self.logfile}")
+
+        self.profile = None
+        if self.config.profile:
+            # pylint: disable=import-outside-toplevel
+            from rfh_profile import Rfh_Profile
+
+            self.profile = Rfh_Profile()
+
+        # The writer, plotter, and report manifest are specific to one report
+        self._write = None
+        self._report_manifest = None
+        if self._plot is not None:
+            self._plot.shutdown()
+            self._plot = None
+
+    @property
+    def profile_file(self):
+        return self.logfile.replace("html.tmp", "profile.json")
+
+    @property
+    def summary_file(self):
+        return self.logfile.replace("html.tmp", "json")
+
+    @property
+    def git(self):
+        if self._git is None:
+            # pylint: disable=import-outside-toplevel
+            from rfh_git import Rfh_Git
+
+            self._git = Rfh_Git(
+                self.config.publish_dir,
+                publish_url=self.config.publish_url,
+                asset_subdirs=[self.config.plot_assets_subdir],
+            )
+        return self._git
+
+    @property
+    def write(self):
+        if self._write is None:
+            # pylint: disable=import-outside-toplevel
+            from rfh_write import Rfh_Write
+
+            self._write = Rfh_Write(
+                self.logfile,
+                self.testset_dir_basename_list,
+                THISREPO_URL,
+                plot_format=self.config.plot_format,
+                plot_assets_subdir=self.config.plot_assets_subdir,
+            )
+            self._write.write_front_matter(self.test_name, self.comparing)
+        return self._write
+
+    @property
+    def plot(self):
+        if self._plot is None:
+            # Importing matplotlib is slow, so only do it if something gets plotted
+            # pylint: disable=import-outside-toplevel
+            from rfh_plot import Rfh_Plot
+
+            self._plot = Rfh_Plot(self.config.n_plot_workers, self.config.plot_format)
+        return self._plot
+
+    @property
+    def cache(self):
+        if self._cache is None and self.config.cache_dir:
+            # pylint: disable=import-outside-toplevel
+            import rfh_cache
+            import rfh_compare
+            import rfh_utils
+
+            self._cache = rfh_cache.Rfh_Cache(
+                self.config.cache_dir,
+                self.config.cache_max_bytes,
+                rfh_cache.get_code_version(
+                    [rfh_cache, rfh_compare, rfh_utils],
+                    settings=[self.config.max_boxplot_fliers, self.config.top_k_worst],
+                ),
+            )
+        return self._cache
+
+    @property
+    def report_manifest(self):
+        """
+        If config.incremental, the Rfh_Report_Manifest of the current report; otherwise None
+        """
+        if self._report_manifest is None and self.config.incremental:
+            # pylint: disable=import-outside-toplevel
+            import rfh_cache
+            from rfh_incremental import Rfh_Report_Manifest
+
+            # Anything that affects how sections look. Found by path, so that matplotlib (imported
+            # by rfh_plot) isn't imported if nothing needs plotting.
+            module_names = ["rfh_incremental", "rfh_plot", "rfh_utils", "rfh_write"]
+            code_version = rfh_cache.get_code_version(
+                [importlib.util.find_spec(name).origin for name in module_names]
+            )
+            path = os.path.join(
+                self.config.report_cache_dir,
+                os.path.basename(self.logfile).replace("html.tmp", "json"),
+            )
+            self._report_manifest = Rfh_Report_Manifest(path, code_version)
+        return self._report_manifest
+
+    @property
+    def extract_store(self):
+        """
+        If config.extract_dir is set, an Rfh_Extract_Store there; otherwise None
+        """
+        if self._extract_store is None and self.config.extract_dir:
+            # pylint: disable=import-outside-toplevel
+            from rfh_extract import Rfh_Extract_Store
+
+            self._extract_store = Rfh_Extract_Store(self.config.extract_dir)
+        return self._extract_store
+
+    @property
+    def catalog(self):
+        """
+        If config.catalog_file is set, the Rfh_Catalog saved there; otherwise None
+        """
+        if self._catalog is None and self.config.catalog_file:
+            # pylint: disable=import-outside-toplevel
+            from rfh_catalog import Rfh_Catalog
+
+            self._catalog = Rfh_Catalog(self.config.catalog_file)
+        return self._catalog
+
+    @property
+    def metrics(self):
+        """
+        If config.metrics_db is set, the Rfh_Metrics database there; otherwise None
+        """
+        if self._metrics is None and self.config.metrics_db:
+            # pylint: disable=import-outside-toplevel
+            from rfh_metrics import Rfh_Metrics
+
+            self._metrics = Rfh_Metrics(self.config.metrics_db)
+        return self._metrics
+
+    def close(self):
+        if self._plot is not None:
+            self._plot.shutdown()
+            self._plot = None
@@ -0,0 +1,46 @@
+"""
+Functions for unfolding FATES's duplexed (combined) dimensions into their component dimensions
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=fixme
+
+# Each duplexed dimension and the dimensions it combines, slowest-varying first. E.g., in FATES,
+# the index along fates_levscag is (age_class - 1) * nlevsclass + size_class.
+DUPLEXED_DIMS = {
+    "fates_levagefuel": ("fates_levfuel", "fates_levage"),
+    "fates_levagepft": ("fates_levpft", "fates_levage"),
+    "fates_levscag": ("fates_levage", "fates_levscls"),
+    "fates_levscagpf": ("fates_levpft", "fates_levage", "fates_levscls"),
+    "fates_levscpf": ("fates_levpft", "fates_levscls"),
+}
+
+
+def get_deduplexed_dims(da, sizes):
+    """
+    Get the dimensions and shape a DataArray will have once every duplexed dimension is unfolded,
+    without reading any data
+
+    sizes: Mapping of dimension name to length (e.g., ds.sizes), for the component dimensions
+    """
+    new_dims = []
+    new_shape = []
+    for dim, length in zip(da.dims, da.shape):
+        if dim not in DUPLEXED_DIMS:
+            new_dims.append(dim)
+            new_shape.append(length)
+            continue
+        component_dims = DUPLEXED_DIMS[dim]
+        component_shape = [sizes[d] for d in component_dims]
+        n_combined = 1
+        for n in component_shape:
+            n_combined *= n
+        if n_combined != length:
+            raise RuntimeError(
+                f"{da.name}: Length of {dim} ({length}) doesn't match product of its component"
+                + f" dimensions {component_dims} ({component_shape})"
+            )
+        new_dims += component_dims
+        new_shape += component_shape
+    return tuple(new_dims), tuple(new_shape)
+
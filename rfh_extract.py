@@ -0,0 +1,136 @@
+"""
+Class for keeping local, memory-mappable extracts of history files, so that analyses needn't read
+them (or even search for them) on a slow shared filesystem again
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+import json
+import os
+import shutil
+
+import numpy as np
+import xarray as xr
+
+from rfh_catalog import is_test_dir
+from rfh_files import TMP_SUFFIX, get_file_key, get_key, open_atomic, write_json
+from rfh_manifest import Rfh_Manifest
+
+
+class Rfh_Extract_Store:
+    """
+    Each extract is a directory of uncompressed .npy files, one per variable, plus meta.json with
+    the source file's manifest and each variable's dimensions. Extracts are keyed by the source
+    file's path, size, and modification time, so a changed source file is extracted afresh (and
+    its old extract deleted).
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.extracts_dir = os.path.join(store_dir, "extracts")
+        self.sources_dir = os.path.join(store_dir, "sources")
+        self.file_lists_dir = os.path.join(store_dir, "file_lists")
+        for d in [self.extracts_dir, self.sources_dir, self.file_lists_dir]:
+            os.makedirs(d, exist_ok=True)
+
+    def get_file_list(self, top_testset_dir, test_name):
+        """
+        Get the history files of a test found by the last put_file_list(), if no directories they
+        could be in have changed since. Checking that takes a stat per directory rather than a
+        glob. Returns None if unknown or out of date, or if saved by a version that also found
+        other tests' files (see rfh_catalog.TEST_DIR_GLOBS).
+        """
+        path = os.path.join(self.file_lists_dir, get_key(top_testset_dir, test_name) + ".json")
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            for d, mtime_ns in saved["dir_mtimes"].items():
+                if os.stat(d).st_mtime_ns != mtime_ns:
+                    return None
+        except FileNotFoundError:
+            return None
+        for history_file in saved["file_list"]:
+            test_dir = os.path.dirname(os.path.dirname(history_file))
+            if not is_test_dir(os.path.basename(test_dir), test_name):
+                return None
+        return saved["file_list"]
+
+    def put_file_list(self, top_testset_dir, test_name, file_list):
+        # A new test directory would change the mtime of the testset directory; new history files
+        # would change the mtime of their run directory
+        dirs = {top_testset_dir} | {os.path.dirname(f) for f in file_list}
+        saved = {
+            "dir_mtimes": {d: os.stat(d).st_mtime_ns for d in dirs},
+            "file_list": file_list,
+        }
+        path = os.path.join(self.file_lists_dir, get_key(top_testset_dir, test_name) + ".json")
+        write_json(path, saved)
+
+    def get_extract_dir(self, history_file):
+        return os.path.join(self.extracts_dir, get_file_key(history_file))
+
+    def open(self, history_file):
+        """
+        Open the extract of a history file as a Dataset whose variables are memory-mapped, with
+        the file's manifest in ds.attrs["manifest"]. Returns None if there's no up-to-date extract.
+        """
+        extract_dir = self.get_extract_dir(history_file)
+        try:
+            with open(os.path.join(extract_dir, "meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        data_vars = {}
+        coords = {}
+        for name, dims in meta["dims"].items():
+            values = np.load(os.path.join(extract_dir, name + ".npy"), mmap_mode="r")
+            target = coords if name in meta["coords"] else data_vars
+            target[name] = (dims, values, meta["attrs"][name])
+        ds = xr.Dataset(data_vars, coords=coords)
+        ds.attrs["manifest"] = Rfh_Manifest(history_file, meta["variables"])
+        return ds
+
+    def put(self, history_file, ds):
+        """
+        Extract every numeric variable of an opened history file (e.g., its last timestep, from
+        rfh_utils.open_last_timestep()). Replaces any older extract of the same file.
+        """
+        extract_dir = self.get_extract_dir(history_file)
+        tmp_dir = extract_dir + TMP_SUFFIX
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        meta = {
+            "source": os.path.realpath(history_file),
+            "variables": ds.attrs["manifest"].variables,
+            "dims": {},
+            "attrs": {},
+            "coords": [],
+        }
+        for name, da in ds.variables.items():
+            # Skip what can't be memory-mapped (e.g., decoded times and strings)
+            if da.dtype.kind not in "biuf":
+                continue
+            np.save(os.path.join(tmp_dir, name + ".npy"), np.ascontiguousarray(da.values))
+            meta["dims"][name] = list(da.dims)
+            meta["attrs"][name] = {k: v for k, v in da.attrs.items() if isinstance(v, str)}
+            if name in ds.coords:
+                meta["coords"].append(name)
+        write_json(os.path.join(tmp_dir, "meta.json"), meta)
+
+        # Swap in the new extract, then delete the source's previous one, if any
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        os.rename(tmp_dir, extract_dir)
+        source_path = os.path.join(self.sources_dir, get_key(meta["source"]))
+        try:
+            with open(source_path) as f:
+                old_extract_dir = f.read()
+            if old_extract_dir != extract_dir:
+                shutil.rmtree(old_extract_dir, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+        with open_atomic(source_path) as f:
+            f.write(extract_dir)
@@ -0,0 +1,57 @@
+"""
+Functions for keying saved data on the files it came from, and for writing files atomically
+"""
+# pylint: disable=invalid-name
+# pylint: disable=fixme
+
+import contextlib
+import hashlib
+import json
+import os
+
+# Added to a file's path while it's being written
+TMP_SUFFIX = ".part"
+
+
+def get_key(*items):
+    """
+    Hash any number of items (e.g., paths and settings) into a short string for naming saved files
+    """
+    key = "|".join(str(x) for x in items)
+    return hashlib.sha256(key.encode("utf8")).hexdigest()[:32]
+
+
+def get_file_key(path, *items):
+    """
+    Key for data derived from a file (plus any other items it depends on), which changes if the
+    file is modified or replaced
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return get_key(path, stat.st_size, stat.st_mtime_ns, *items)
+
+
+@contextlib.contextmanager
+def open_atomic(path, mode="w"):
+    """
+    Open a file for writing such that path either has everything written or is unchanged: Writes
+    go to a temporary file, which replaces path once closed. If writing fails, the temporary file
+    is deleted and path is left as it was.
+    """
+    tmp_path = path + TMP_SUFFIX
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json(path, obj, **kwargs):
+    """
+    Atomically save obj to path as JSON. kwargs are passed to json.dump().
+    """
+    with open_atomic(path) as f:
+        json.dump(obj, f, **kwargs)
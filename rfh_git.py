@@ -12,17 +12,20 @@ import shutil
 import subprocess
 import re
 
-import options as other_options
 
-
-def run_git_cmd(git_cmd, cwd=os.getcwd()):
+def run_git_cmd(git_cmd, cwd=os.getcwd(), split_lines=True):
+    """
+    Run a git command, given as a string (split on spaces) or a list of arguments
+    """
+    if isinstance(git_cmd, str):
+        git_cmd = git_cmd.split(" ")
     try:
         git_result = subprocess.check_output(
-            git_cmd.split(" "),
+            git_cmd,
             stderr=subprocess.STDOUT,
             universal_newlines=True,
             cwd=cwd,
-        ).splitlines()
+        )
     except subprocess.CalledProcessError as e:
         print("Command: " + " ".join(e.cmd))
         print("Working directory: " + cwd)
@@ -30,114 +33,208 @@ def run_git_cmd(git_cmd, cwd=os.getcwd()):
         raise e
     except:  # pylint: disable=try-except-raise
         raise
+    if split_lines:
+        git_result = git_result.splitlines()
     return git_result
 
 
+def parse_status_porcelain_z(status):
+    """
+    Parse the output of git status --porcelain -z into lists of modified (including deleted and
+    renamed) and new files, relative to the top of the repo
+    """
+    modified_files = []
+    new_files = []
+    entries = status.split("\0")
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if not entry:
+            continue
+        xy, path = entry[:2], entry[3:]
+        if "R" in xy or "C" in xy:
+            # Renames and copies are followed by the original path
+            i += 1
+        if xy == "??":
+            new_files.append(path)
+        else:
+            modified_files.append(path)
+    return modified_files, new_files
+
+
 class Rfh_Git:
-    def __init__(self, publish_dir, logfile):
+    def __init__(self, publish_dir, logfile=None, asset_subdirs=None, publish_url=None):
         self.publish_dir = publish_dir
-        self.check_pub_dir_clean()
-
         self.logfile = logfile
-        self.publish_url = self.get_publish_url()
 
-    def check_pub_dir_clean(self):
-        status = run_git_cmd(f"git -C {self.publish_dir} status")
-        if status[-1] != "nothing to commit, working tree clean":
-            raise RuntimeError(f"self.publish_dir not clean: {self.publish_dir}")
+        # Subdirectories of publish_dir whose contents may be committed along with the reports
+        self.asset_subdirs = [d for d in (asset_subdirs or []) if d]
+
+        # Reports moved into publish_dir but not yet committed
+        self.staged_reports = []
 
-    def commit(self, modified_files, new_files):
-        status = run_git_cmd(f"git -C {self.publish_dir} status")
-        if status[-1] != "nothing to commit, working tree clean":
+        # Unless given, only look these up (with git calls) when needed
+        self._publish_url = publish_url
+        self._repo_top = None
+
+        self.push_process = None
+
+    @property
+    def publish_url(self):
+        if self._publish_url is None:
+            self._publish_url = self.get_publish_url()
+        return self._publish_url
+
+    @property
+    def repo_top(self):
+        if self._repo_top is None:
+            cmd = "git rev-parse --show-toplevel"
+            self._repo_top = run_git_cmd(cmd, cwd=self.publish_dir)[0]
+        return self._repo_top
+
+    def get_changed_files(self):
+        """
+        Get modified and new files in the publish repo (as absolute paths) from a single git status
+        call
+        """
+        status = run_git_cmd(
+            [
+                "git",
+                "-C",
+                self.publish_dir,
+                "status",
+                "--porcelain",
+                "-z",
+                "--untracked-files=all",
+            ],
+            split_lines=False,
+        )
+        modified_files, new_files = parse_status_porcelain_z(status)
+        modified_files = [os.path.join(self.repo_top, f) for f in modified_files]
+        new_files = [os.path.join(self.repo_top, f) for f in new_files]
+        return modified_files, new_files
+
+    def is_expected_change(self, path):
+        if path in self.staged_reports:
+            return True
+        for asset_subdir in self.asset_subdirs:
+            asset_dir = os.path.join(os.path.realpath(self.publish_dir), asset_subdir)
+            if os.path.realpath(path).startswith(asset_dir + os.sep):
+                return True
+        return False
+
+    def commit(self, modified_files, new_files, push=True, background=False):
+        if modified_files or new_files:
             # Stage
             print("Staging...")
-            git_cmd = (
-                f"git -C {self.publish_dir} add {os.path.join(self.publish_dir, '*')}"
+            run_git_cmd(
+                ["git", "-C", self.publish_dir, "add", "-A", "--"]
+                + modified_files
+                + new_files
             )
-            status = run_git_cmd(git_cmd)
 
             # Commit
             print("Committing...")
             git_cmd = f"git -C {self.publish_dir} commit -m Update"
-            status = run_git_cmd(git_cmd)
+            run_git_cmd(git_cmd)
 
-            # Push
-            print("Pushing...")
-            git_cmd = f"git -C {self.publish_dir} push"
-            status = run_git_cmd(git_cmd)
+            if push:
+                self.push(background)
 
-            print("Done! Published to:")
+            print("Published to:")
             for f in modified_files + new_files:
+                if f not in self.staged_reports:
+                    continue
                 file_url = self.publish_url + os.path.basename(f)
                 print("   " + file_url)
         else:
             print("Nothing to commit")
 
+    def push(self, background=False):
+        git_cmd = ["git", "-C", self.publish_dir, "push"]
+        if background:
+            print("Pushing in background...")
+            self.wait_for_push()
+            # pylint: disable=consider-using-with
+            self.push_process = subprocess.Popen(git_cmd)
+        else:
+            print("Pushing...")
+            run_git_cmd(git_cmd)
+            print("Done!")
+
+    def wait_for_push(self):
+        if self.push_process is None:
+            return
+        if self.push_process.wait() != 0:
+            raise RuntimeError(f"Background push failed in {self.publish_dir}")
+        self.push_process = None
+
     def get_publish_url(self):
-        try:
-            PUBLISH_URL = other_options.PUBLISH_URL
-        except AttributeError:
-            cmd = "git config --get remote.origin.url"
-            publish_repo_url = run_git_cmd(cmd, cwd=self.publish_dir)[0]
+        cmd = "git config --get remote.origin.url"
+        publish_repo_url = run_git_cmd(cmd, cwd=self.publish_dir)[0]
 
-            cmd = "git rev-parse --show-toplevel"
-            publish_dir_repo_top = run_git_cmd(cmd, cwd=self.publish_dir)[0]
-            subdirs = str(os.path.realpath(self.publish_dir)).replace(
-                publish_dir_repo_top, ""
-            )
+        subdirs = str(os.path.realpath(self.publish_dir)).replace(self.repo_top, "")
 
-            if "git@github.com:" in publish_repo_url:
-                gh_user = re.compile(r"git@github.com:(\w+)").findall(publish_repo_url)[
-                    0
-                ]
-                repo_name = re.compile(r"/(.+).git").findall(publish_repo_url)[0]
-                PUBLISH_URL = (
-                    f"https://{gh_user}.github.io/{repo_name}" + subdirs + "/"
-                )
-            else:
-                raise NotImplementedError(  # pylint: disable=raise-missing-from
-                    " ".join(
-                        [
-                            f"Not sure how to handle publish_repo_url {publish_repo_url}.",
-                            "Provide PUBLISH_URL in options.py.",
-                        ]
-                    )
+        if "git@github.com:" in publish_repo_url:
+            gh_user = re.compile(r"git@github.com:(\w+)").findall(publish_repo_url)[0]
+            repo_name = re.compile(r"/(.+).git").findall(publish_repo_url)[0]
+            PUBLISH_URL = f"https://{gh_user}.github.io/{repo_name}" + subdirs + "/"
+        else:
+            raise NotImplementedError(
+                " ".join(
+                    [
+                        f"Not sure how to handle publish_repo_url {publish_repo_url}.",
+                        "Provide PUBLISH_URL in options.py.",
+                    ]
                 )
-        except:  # pylint: disable=try-except-raise
-            raise
+            )
         return PUBLISH_URL
 
-    def publish(self):
-        # Ensure publishing dir is clean
-        self.check_pub_dir_clean()
-
-        # Rename log file
+    def stage_report(self, logfile=None):
+        """
+        Move a finished report into place in publish_dir, to be committed by publish_staged()
+        """
+        if logfile is None:
+            logfile = self.logfile
         destfile = os.path.join(
-            self.publish_dir, os.path.basename(self.logfile).replace("html.tmp", "html")
+            self.publish_dir, os.path.basename(logfile).replace("html.tmp", "html")
         )
-        shutil.move(self.logfile, destfile)
-
-        status = run_git_cmd(f"git -C {self.publish_dir} status")
-        modified_files = []
-        new_files = []
-        in_untracked_files = False
-        for l in status:
-            if not in_untracked_files:
-                if re.compile("^\tmodified:").match(l):
-                    modified_files.append(l.split(" ")[-1])
-                elif l == "Untracked files:":
-                    in_untracked_files = True
-            else:
-                if l == "":
-                    break
-                if (
-                    l
-                    != '  (use "git add <file>..." to include in what will be committed)'
-                ):
-                    new_files.append(l.replace("\t", ""))
+        shutil.move(logfile, destfile)
+        self.stage_file(destfile)
+
+    def stage_file(self, path):
+        """
+        Include a file already in publish_dir (e.g., a report's profile) in the next
+        publish_staged()
+        """
+        self.staged_reports.append(os.path.realpath(path))
+
+    def publish_staged(self, push=True, background=False):
+        """
+        Commit all staged reports (and any new plot assets) in one commit, then push. Fails if
+        anything else in the publish repo has changed.
+        """
+        modified_files, new_files = self.get_changed_files()
+        modified_files = [os.path.realpath(f) for f in modified_files]
+        new_files = [os.path.realpath(f) for f in new_files]
+        unexpected = [
+            f for f in modified_files + new_files if not self.is_expected_change(f)
+        ]
+        if unexpected:
+            raise RuntimeError(
+                f"self.publish_dir not clean: {self.publish_dir}\n   "
+                + "\n   ".join(unexpected)
+            )
+
         if modified_files:
             print("Updating files:\n   " + "\n   ".join(modified_files))
         if new_files:
             print("Adding files:\n   " + "\n   ".join(new_files))
 
-        self.commit(modified_files, new_files)
+        self.commit(modified_files, new_files, push=push, background=background)
+        self.staged_reports = []
+
+    def publish(self):
+        self.stage_report()
+        self.publish_staged()
@@ -0,0 +1,87 @@
+"""
+Class remembering each section of a report, so a rerun only has to redo the sections whose inputs
+changed
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from rfh_files import write_json
+
+
+def get_fingerprint(*items):
+    """
+    Hash some items: strings, numbers, numpy arrays, and lists/tuples/dicts of those
+    """
+    h = hashlib.sha256()
+
+    def update(item):
+        if isinstance(item, np.ndarray):
+            h.update(f"array{item.dtype}{item.shape}".encode("utf8"))
+            h.update(np.ascontiguousarray(item).tobytes())
+        elif isinstance(item, np.generic):
+            # So that, e.g., a float32 hashes the same as the float64 it's saved as in the cache
+            update(item.item())
+            return
+        elif isinstance(item, dict):
+            h.update(b"{")
+            for key in sorted(item):
+                update(key)
+                update(item[key])
+            h.update(b"}")
+        elif isinstance(item, (list, tuple)):
+            h.update(b"[")
+            for x in item:
+                update(x)
+            h.update(b"]")
+        else:
+            h.update(repr(item).encode("utf8"))
+        h.update(b"|")
+
+    for item in items:
+        update(item)
+    return h.hexdigest()
+
+
+class Rfh_Report_Manifest:
+    def __init__(self, path, code_version):
+        self.path = path
+        self.code_version = code_version
+
+        # Variable: {"fingerprint": ..., "html": ...} as of the last run, and for this run
+        self.old_sections = {}
+        self.sections = {}
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved["code_version"] == code_version:
+                self.old_sections = saved["sections"]
+        except FileNotFoundError:
+            pass
+
+    def get(self, var, fingerprint):
+        """
+        Get a variable's section HTML from the last run, if its fingerprint hasn't changed since
+        """
+        section = self.old_sections.get(var)
+        if section is None or section["fingerprint"] != fingerprint:
+            return None
+        self.sections[var] = section
+        return section["html"]
+
+    def put(self, var, fingerprint, html):
+        self.sections[var] = {"fingerprint": fingerprint, "html": html}
+
+    def save(self):
+        """
+        Save the sections used in this run (only), replacing the last run's
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_json(self.path, {"code_version": self.code_version, "sections": self.sections})
@@ -0,0 +1,98 @@
+"""
+Class describing the variables in a history file, read from its netCDF header alone
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+import json
+import os
+import re
+
+import netCDF4
+
+from rfh_files import get_file_key, write_json
+
+PERAGE_PATTERN = re.compile("FATES_[A-Z_]+_[A-Z]*AP[A-Z]*")
+
+
+def get_non_perage_equiv(perage_var):
+    if perage_var == "FATES_NPATCH_AP":
+        return "FATES_NPATCHES"
+    suffix = perage_var.split("_")[-1]
+    suffix2 = suffix.replace("AP", "")
+    non_perage_equiv = "_".join(perage_var.split("_")[:-1])
+    if suffix2:
+        non_perage_equiv += "_" + suffix2
+    return non_perage_equiv
+
+
+def get_weights_var(perage_var):
+    if perage_var in ["FATES_STOMATAL_COND_AP", "FATES_LBLAYER_COND_AP"]:
+        return "FATES_CANOPYAREA_AP"
+    return "FATES_PATCHAREA_AP"
+
+
+def read_header(history_file):
+    """
+    Get the name, dimensions, shape, dtype, and units of every variable in a netCDF file, without
+    reading any data
+    """
+    variables = {}
+    with netCDF4.Dataset(history_file) as nc:
+        for name, var in nc.variables.items():
+            variables[name] = {
+                "dims": list(var.dimensions),
+                "shape": list(var.shape),
+                "dtype": str(var.dtype),
+                "units": getattr(var, "units", None),
+            }
+    return variables
+
+
+class Rfh_Manifest:
+    def __init__(self, history_file, variables):
+        self.history_file = history_file
+        self.variables = variables
+
+        # Per-age variables: their non-per-age equivalents and weights variables. Included even if
+        # the non-per-age equivalent or weights variable isn't in the file.
+        self.perage_to_non_equiv = {}
+        self.perage_to_weights = {}
+        for this_var in self.variables:
+            if PERAGE_PATTERN.match(this_var):
+                self.perage_to_non_equiv[this_var] = get_non_perage_equiv(this_var)
+                self.perage_to_weights[this_var] = get_weights_var(this_var)
+
+    @classmethod
+    def from_file(cls, history_file, cache_dir=None):
+        """
+        Read the manifest of a history file. If cache_dir is given, reuse the manifest saved there
+        unless the file has changed since.
+        """
+        if cache_dir is None:
+            return cls(history_file, read_header(history_file))
+
+        history_file = os.path.realpath(history_file)
+        cache_file = os.path.join(cache_dir, get_file_key(history_file) + ".json")
+        try:
+            with open(cache_file) as f:
+                variables = json.load(f)
+        except FileNotFoundError:
+            variables = read_header(history_file)
+            os.makedirs(cache_dir, exist_ok=True)
+            write_json(cache_file, variables)
+        return cls(history_file, variables)
+
+    def get_needed_vars(self):
+        """
+        Return the set of variables the analysis needs: per-age variables, their non-per-age
+        equivalents, and weights variables. Lowercase variables (coordinates and FATES dimension
+        maps like fates_levage) are small and are always kept.
+        """
+        needed_vars = {v for v in self.variables if v.lower() == v}
+        needed_vars.update(self.perage_to_non_equiv.keys())
+        needed_vars.update(self.perage_to_non_equiv.values())
+        needed_vars.update(self.perage_to_weights.values())
+        return needed_vars.intersection(self.variables)
@@ -0,0 +1,224 @@
+"""
+Class for recording each variable's results in a SQLite database, keyed by testset, FATES and CTSM
+version, test, and variable, so trends across the refactor history can be queried without
+rerunning any comparisons or opening any history files
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+import math
+import os
+import sqlite3
+import time
+
+# Bump when the schema changes; older databases are then recreated
+SCHEMA_VERSION = 1
+
+COLUMNS = [
+    "testset",
+    "label",
+    "ctsm_sha",
+    "test_name",
+    "variable",
+    "run_time",
+    "all_nan",
+    "isclose",
+    "max_abs_diff",
+    "max_pct_diff",
+    "wtd_isclose",
+    "wtd_max_abs_diff",
+    "wtd_max_pct_diff",
+    "n",
+    "n_nan",
+    "median",
+    "q1",
+    "q3",
+    "recorded_at",
+]
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS results (
+        testset TEXT NOT NULL,
+        label TEXT NOT NULL,
+        ctsm_sha TEXT,
+        test_name TEXT NOT NULL,
+        variable TEXT NOT NULL,
+        run_time REAL,
+        all_nan INTEGER NOT NULL,
+        isclose INTEGER NOT NULL,
+        max_abs_diff REAL,
+        max_pct_diff REAL,
+        wtd_isclose INTEGER,
+        wtd_max_abs_diff REAL,
+        wtd_max_pct_diff REAL,
+        n INTEGER,
+        n_nan INTEGER,
+        median REAL,
+        q1 REAL,
+        q3 REAL,
+        recorded_at REAL NOT NULL,
+        PRIMARY KEY (testset, test_name, variable)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS results_variable ON results (variable, test_name, run_time)",
+    "CREATE INDEX IF NOT EXISTS results_test ON results (test_name, run_time)",
+    "CREATE INDEX IF NOT EXISTS results_label ON results (label)",
+    "CREATE INDEX IF NOT EXISTS results_ctsm_sha ON results (ctsm_sha)",
+]
+
+
+def to_sql_value(x):
+    """
+    Convert numpy scalars to plain Python. NaN becomes NULL, which SQLite would store anyway.
+    """
+    if x is None:
+        return None
+    if hasattr(x, "item"):
+        x = x.item()
+    if isinstance(x, float) and not math.isfinite(x):
+        return None
+    return x
+
+
+def get_ctsm_sha(this_commit):
+    """
+    The CTSM SHA from a testset's "Current CTSM hash: <sha> ..." line (see
+    rfh_catalog.read_git_status()), or None if it's unknown
+    """
+    words = this_commit.split()
+    if len(words) < 4:
+        return None
+    return words[3]
+
+
+def get_run_time(history_files):
+    """
+    When a test ran, going by its last history file, for putting testsets in order
+    """
+    try:
+        return os.stat(history_files[-1]).st_mtime
+    except (FileNotFoundError, IndexError):
+        return None
+
+
+def get_rows(test_name, ds_attrs, dict_perage_to_non_equiv, index):
+    """
+    One row per variable for the testset at position index in a comparison, given its Dataset's
+    attrs and the results collected by rfh_utils.save_results()
+    """
+    testset = {
+        "testset": ds_attrs["testset_dir"],
+        "label": ds_attrs["label"],
+        "ctsm_sha": get_ctsm_sha(ds_attrs["this_commit"]),
+        "test_name": test_name,
+        "run_time": get_run_time(ds_attrs["history_files"]),
+    }
+    recorded_at = time.time()
+    rows = []
+    for perage_var, this_dict in dict_perage_to_non_equiv.items():
+        if this_dict["non_perage_equiv"] is None or len(this_dict["isclose"]) <= index:
+            continue
+        boxstats = this_dict["boxstats"][index]
+        row = dict(testset)
+        row.update(
+            {
+                "variable": perage_var,
+                "all_nan": bool(this_dict["all_nan"][index]),
+                "isclose": bool(this_dict["isclose"][index]),
+                "max_abs_diff": this_dict["max_abs_diff"][index],
+                "max_pct_diff": this_dict["max_pct_diff"][index],
+                "wtd_isclose": bool(this_dict["wtd_isclose"][index]),
+                "wtd_max_abs_diff": this_dict["wtd_max_abs_diff"][index],
+                "wtd_max_pct_diff": this_dict["wtd_max_pct_diff"][index],
+                "n": boxstats["n"],
+                "n_nan": boxstats["n_nan"],
+                "median": boxstats.get("med"),
+                "q1": boxstats.get("q1"),
+                "q3": boxstats.get("q3"),
+                "recorded_at": recorded_at,
+            }
+        )
+        rows.append(tuple(to_sql_value(row[c]) for c in COLUMNS))
+    return rows
+
+
+class Rfh_Metrics:
+    """
+    SQLite database of per-variable results, one row per testset, test, and variable. Recording a
+    testset again (e.g., because it's in several comparisons, or its history files changed)
+    replaces its rows.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # The default rollback journal, not WAL, which needs shared memory that network
+        # filesystems (e.g., /glade) don't provide. Setting it explicitly converts databases made
+        # with WAL by older versions.
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS results")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def record(self, rows):
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO results ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+
+    def trend(self, variable, test_name=None):
+        """
+        A variable's results in every testset, in the order the tests ran
+        """
+        query = "SELECT * FROM results WHERE variable = ?"
+        params = [variable]
+        if test_name:
+            query += " AND test_name = ?"
+            params.append(test_name)
+        query += " ORDER BY test_name, run_time, testset"
+        return self.conn.execute(query, params).fetchall()
+
+    def failing(self, test_name=None, label=None):
+        """
+        Every variable that failed the check, in the order the tests ran
+        """
+        query = "SELECT * FROM results WHERE NOT isclose AND NOT all_nan"
+        params = []
+        if test_name:
+            query += " AND test_name = ?"
+            params.append(test_name)
+        if label:
+            query += " AND label = ?"
+            params.append(label)
+        query += " ORDER BY test_name, run_time, testset, variable"
+        return self.conn.execute(query, params).fetchall()
+
+    def testsets(self, test_name=None):
+        """
+        For each testset and test, how many variables were recorded and how many failed
+        """
+        query = (
+            "SELECT testset, label, ctsm_sha, test_name, MAX(run_time) AS run_time,"
+            " COUNT(*) AS n_variables,"
+            " SUM(NOT isclose AND NOT all_nan) AS n_failing"
+            " FROM results"
+        )
+        params = []
+        if test_name:
+            query += " WHERE test_name = ?"
+            params.append(test_name)
+        query += " GROUP BY testset, label, ctsm_sha, test_name ORDER BY test_name, run_time"
+        return self.conn.execute(query, params).fetchall()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,77 @@
+"""
+Class for rendering the per-variable boxplots, in parallel if possible
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+import multiprocessing
+
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Make SVG output compact (text stays text instead of becoming paths) and reproducible (so that
+# identical figures give identical files)
+SVG_RC_PARAMS = {"svg.fonttype": "none", "svg.hashsalt": "fates-refactor-history"}
+
+
+def render_boxplot(boxstats, labels, ylabel, title, fmt="png"):
+    """
+    Render one figure to bytes in the given format (png, svg, or webp). Uses the object-oriented
+    Agg API rather than pyplot, so it doesn't touch any global state and is safe to run in worker
+    processes.
+
+    boxstats: One summary per box, from rfh_compare.get_boxstats()
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.bxp([dict(stats, label=label) for stats, label in zip(boxstats, labels)])
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+    buf = BytesIO()
+    if fmt == "svg":
+        with matplotlib.rc_context(SVG_RC_PARAMS):
+            fig.savefig(buf, format=fmt, metadata={"Date": None})
+    else:
+        fig.savefig(buf, format=fmt)
+    image = buf.getvalue()
+    buf.close()
+    return image
+
+
+class Rfh_Plot:
+    def __init__(self, n_workers, fmt="png"):
+        self.n_workers = n_workers
+        self.fmt = fmt
+        self.executor = None
+
+    def submit(self, boxstats, labels, ylabel, title):
+        """
+        Start rendering a figure. Returns a Future whose result is the image bytes.
+        """
+        if self.n_workers <= 1:
+            future = Future()
+            future.set_result(render_boxplot(boxstats, labels, ylabel, title, self.fmt))
+            return future
+
+        if self.executor is None:
+            # Fork rather than spawn: The main script isn't import-safe, and the workers only
+            # need this module anyway.
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        return self.executor.submit(
+            render_boxplot, boxstats, labels, ylabel, title, self.fmt
+        )
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,174 @@
+"""
+Class for recording how long each stage of the analysis takes, and how much memory it uses
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+import contextlib
+import os
+import resource
+import sys
+import time
+
+from rfh_files import write_json
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def get_peak_rss_mb():
+    """
+    The process's peak RSS so far. On Linux, ru_maxrss is in KiB; on macOS, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def get_rss_mb():
+    """
+    The process's current RSS (Linux only), or None if it's unknown
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 1024**2
+    except OSError:
+        return None
+
+
+def reset_peak_rss():
+    """
+    Restart the kernel's record of peak RSS (VmHWM) from the current RSS, so that the peak within a
+    stage can be measured (Linux only). Returns whether it worked.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_hwm_mb():
+    """
+    Peak RSS since the last reset_peak_rss(), or None if it's unknown
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def stage(profile, name):
+    """
+    Context manager timing a stage if profile is an Rfh_Profile, or doing nothing if it's None.
+    Use like: with stage(ctx.profile, "load"): ...
+    """
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.stage(name)
+
+
+class Rfh_Profile:
+    """
+    Each stage's calls, wall and CPU seconds, and memory: its peak RSS (the highest the process's
+    RSS got during any call of the stage) and RSS growth (the most any call left the process's RSS
+    higher than it found it). Where the peak within a stage can't be measured (anywhere but Linux),
+    the process's peak so far is recorded instead. Also each variable's wall and CPU seconds, and
+    RSS growth, in each stage.
+    """
+
+    def __init__(self):
+        # Stage name: dict of calls, wall and CPU seconds, and peak RSS and RSS growth (MB)
+        self.stages = {}
+        # Variable name: dict of stage name: dict of wall and CPU seconds and RSS growth (MB)
+        self.variables = {}
+        # Peak RSS so far of each stage being timed, innermost last
+        self.open_peaks = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # The peak since the last reset belongs to every stage that's open, and this one starts
+        # afresh
+        hwm = get_hwm_mb()
+        self.open_peaks = [max(x, hwm or 0.0) for x in self.open_peaks]
+        can_reset = reset_peak_rss()
+        self.open_peaks.append(0.0)
+        rss_start = get_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            hwm = get_hwm_mb()
+            self.open_peaks = [max(x, hwm or 0.0) for x in self.open_peaks]
+            peak_rss_mb = self.open_peaks.pop()
+            if not (can_reset and hwm):
+                peak_rss_mb = get_peak_rss_mb()
+            rss_end = get_rss_mb()
+            rss_growth_mb = None if rss_start is None else rss_end - rss_start
+            self.add_stage(name, wall, cpu, peak_rss_mb, rss_growth_mb)
+
+    def add_stage(self, name, wall, cpu, peak_rss_mb, rss_growth_mb=None, calls=1):
+        this_stage = self.stages.setdefault(
+            name,
+            {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_rss_mb": 0.0, "rss_growth_mb": None},
+        )
+        this_stage["calls"] += calls
+        this_stage["wall"] += wall
+        this_stage["cpu"] += cpu
+        this_stage["peak_rss_mb"] = max(this_stage["peak_rss_mb"], peak_rss_mb)
+        if rss_growth_mb is not None:
+            this_stage["rss_growth_mb"] = max(this_stage["rss_growth_mb"] or 0.0, rss_growth_mb)
+
+    def add_variable(self, var, name, wall, cpu, rss_growth_mb=None):
+        this_var = self.variables.setdefault(var, {}).setdefault(
+            name, {"wall": 0.0, "cpu": 0.0, "rss_growth_mb": None}
+        )
+        this_var["wall"] += wall
+        this_var["cpu"] += cpu
+        if rss_growth_mb is not None:
+            this_var["rss_growth_mb"] = (this_var["rss_growth_mb"] or 0.0) + rss_growth_mb
+
+    def merge(self, other):
+        """
+        Add the timings from another profile (e.g., from a worker process, via to_dict())
+        """
+        for name, this_stage in other["stages"].items():
+            self.add_stage(
+                name,
+                this_stage["wall"],
+                this_stage["cpu"],
+                this_stage["peak_rss_mb"],
+                this_stage["rss_growth_mb"],
+                calls=this_stage["calls"],
+            )
+        for var, stages in other["variables"].items():
+            for name, this_var in stages.items():
+                self.add_variable(
+                    var, name, this_var["wall"], this_var["cpu"], this_var["rss_growth_mb"]
+                )
+
+    def get_slowest_variables(self, n):
+        """
+        Get the n variables that took the longest in total, as a list of (variable, total wall
+        seconds, dict of stage name: dict of wall and CPU seconds and RSS growth)
+        """
+        totals = [
+            (var, sum(x["wall"] for x in stages.values()), stages)
+            for var, stages in self.variables.items()
+        ]
+        totals.sort(key=lambda x: x[1], reverse=True)
+        return totals[:n]
+
+    def to_dict(self):
+        return {"stages": self.stages, "variables": self.variables}
+
+    def save(self, path):
+        write_json(path, self.to_dict(), indent=1)
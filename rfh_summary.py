@@ -0,0 +1,136 @@
+"""
+Functions for summarizing a comparison as JSON, to be drawn in the browser by rfh_viewer.js instead
+of being plotted with matplotlib
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-arguments
+# pylint: disable=fixme
+
+import math
+import os
+import shutil
+
+import numpy as np
+
+from rfh_compare import MAX_ABS_DIFF_TOL, MAX_PCT_DIFF_TOL
+from rfh_files import write_json
+
+# Bump when the format changes in a way the viewer needs to know about
+SUMMARY_VERSION = 1
+
+# The viewer script, which is published once, next to the reports that use it
+VIEWER_FILENAME = "rfh_viewer.js"
+VIEWER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), VIEWER_FILENAME)
+
+# Outliers are only needed for drawing, so they're saved with this many significant digits
+FLIER_DIGITS = 6
+
+
+def to_json_value(x):
+    """
+    Convert numpy types to plain Python, and NaN (which isn't valid JSON) to None
+    """
+    if isinstance(x, dict):
+        return {k: to_json_value(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return [to_json_value(v) for v in x]
+    if isinstance(x, np.generic):
+        x = x.item()
+    if isinstance(x, float) and not math.isfinite(x):
+        return None
+    return x
+
+
+def get_boxstats_summary(boxstats):
+    summary = {k: v for k, v in boxstats.items() if k != "fliers"}
+    summary["fliers"] = [float(f"{x:.{FLIER_DIGITS}g}") for x in boxstats["fliers"]]
+    return summary
+
+
+def get_variable_summary(perage_var, var_to_print, non_perage_equiv, this_dict, units):
+    """
+    Summarize one variable's results (as collected by rfh_utils.save_results()): one entry in
+    each list per testset
+    """
+    summary = {
+        "name": perage_var,
+        "label": var_to_print,
+        "non_perage_equiv": non_perage_equiv,
+        "units": units,
+        "isclose": this_dict["isclose"],
+        "max_abs_diff": this_dict["max_abs_diff"],
+        "max_pct_diff": this_dict["max_pct_diff"],
+        "boxstats": [get_boxstats_summary(b) for b in this_dict["boxstats"]],
+        "weights": this_dict["weights"],
+        "wtd_max_abs_diff": this_dict["wtd_max_abs_diff"],
+        "wtd_max_pct_diff": this_dict["wtd_max_pct_diff"],
+        "wtd_isclose": this_dict["wtd_isclose"],
+        "worst": this_dict["worst"],
+        "worst_elsewhere": this_dict.get("worst_elsewhere"),
+    }
+    if "timesteps" in this_dict:
+        summary["timesteps"] = this_dict["timesteps"]
+    return to_json_value(summary)
+
+
+def get_summary(
+    test_name,
+    testsets,
+    variables,
+    all_nan,
+    no_boxdata,
+    nonperage_missing,
+    missing_var_lists,
+):
+    """
+    Put together the summary of a comparison. testsets is a list of dicts with each testset's
+    "dir", "label", and "commit"; variables is a list of get_variable_summary() outputs.
+    """
+    return to_json_value(
+        {
+            "version": SUMMARY_VERSION,
+            "test_name": test_name,
+            "tolerances": {"max_abs_diff": MAX_ABS_DIFF_TOL, "max_pct_diff": MAX_PCT_DIFF_TOL},
+            "testsets": testsets,
+            "variables": variables,
+            "all_nan": all_nan,
+            "no_boxdata": no_boxdata,
+            "nonperage_missing": nonperage_missing,
+            "missing_var_lists": missing_var_lists,
+        }
+    )
+
+
+def save_summary(path, summary):
+    write_json(path, summary, separators=(",", ":"), allow_nan=False)
+
+
+def install_viewer(publish_dir):
+    """
+    Copy the viewer script into publish_dir, unless it's already there and up to date. Returns its
+    path there.
+    """
+    path = os.path.join(publish_dir, VIEWER_FILENAME)
+    with open(VIEWER_SOURCE, "rb") as f:
+        source = f.read()
+    try:
+        with open(path, "rb") as f:
+            if f.read() == source:
+                return path
+    except FileNotFoundError:
+        pass
+    shutil.copyfile(VIEWER_SOURCE, path)
+    return path
+
+
+def get_viewer_html(summary_filename):
+    """
+    HTML that loads a summary (relative to the report) into the viewer. The summary is fetched, so
+    the report has to be served over HTTP (e.g., by GitHub Pages, or python -m http.server).
+    """
+    return (
+        '<hr>\n<div id="rfh-results">Loading results...</div>\n'
+        + f'<script src="{VIEWER_FILENAME}"></script>\n'
+        + f'<script>rfhView("{summary_filename}", "rfh-results");</script>\n'
+    )
@@ -0,0 +1,236 @@
+"""
+Functions for generating synthetic testsets of FATES history files, for benchmarking and trying
+things out away from real CTSM output
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-locals
+# pylint: disable=fixme
+
+import os
+import string
+
+import numpy as np
+import xarray as xr
+
+from rfh_deduplex import DUPLEXED_DIMS
+
+# Lengths of the FATES dimensions that per-age variables use
+FATES_DIM_SIZES = {
+    "fates_levage": 7,
+    "fates_levpft": 12,
+    "fates_levscls": 13,
+    "fates_levfuel": 6,
+}
+
+# Suffix of each kind of per-age variable, the per-age dimension it has, and the suffix and
+# non-age dimension of its non-per-age equivalent (see rfh_manifest.get_non_perage_equiv())
+PERAGE_KINDS = [
+    ("AP", "fates_levage", "", None),
+    ("APPF", "fates_levagepft", "PF", "fates_levpft"),
+    ("SZAP", "fates_levscag", "SZ", "fates_levscls"),
+    ("APFC", "fates_levagefuel", "FC", "fates_levfuel"),
+    ("SZAPPF", "fates_levscagpf", "SZPF", "fates_levscpf"),
+]
+
+# Fraction of gridcells that are land; the rest are NaN, like ocean in CLM output
+LAND_FRACTION = 0.3
+
+# Relative discrepancy given to variables that should fail the check
+BAD_DISCREPANCY = 1e-3
+
+# Area weights are multiples of 1/this that sum to exactly 1 across age classes, so that weighted
+# means of values on a grid of 1/256 are exact in float32
+WEIGHTS_DENOMINATOR = 64
+
+
+def get_var_stem(i):
+    """
+    Get a unique name stem for the i'th synthetic variable, e.g., FATES_SYNAB. Letters only, so
+    that the per-age names match rfh_manifest.PERAGE_PATTERN.
+    """
+    letters = string.ascii_uppercase
+    return "FATES_SYN" + letters[(i // 26) % 26] + letters[i % 26]
+
+
+def get_component_shape(dim):
+    """
+    Get the shape of a (possibly duplexed) FATES dimension once deduplexed
+    """
+    if dim in DUPLEXED_DIMS:
+        return [FATES_DIM_SIZES[d] for d in DUPLEXED_DIMS[dim]]
+    return [FATES_DIM_SIZES[dim]]
+
+
+def make_area_weights(rng, n_times, land):
+    """
+    Make patch- or canopy-area weights: for each gridcell, the fraction of area in each age class
+    """
+    n_age = FATES_DIM_SIZES["fates_levage"]
+    n_lat, n_lon = land.shape
+    counts = rng.multinomial(
+        WEIGHTS_DENOMINATOR, np.full(n_age, 1 / n_age), size=(n_times, n_lat, n_lon)
+    )
+    area = (np.moveaxis(counts, -1, 1) / WEIGHTS_DENOMINATOR).astype(np.float32)
+    area[..., ~land] = np.nan
+    return area
+
+
+def make_variable_pair(rng, kind, n_times, land, bad, weights=None):
+    """
+    Make data for a per-age variable and its non-per-age equivalent: float32, like FATES output.
+    Values are on a grid of 1/256, so the non-per-age equivalent is exactly the sum of the per-age
+    variable across age classes, unless bad. If weights (from make_area_weights()) are given, the
+    per-age variable instead holds each age class's own value, so the non-per-age equivalent is
+    exactly its weighted mean across age classes.
+    """
+    _, perage_dim, _, non_age_dim = kind
+    component_shape = get_component_shape(perage_dim)
+    age_axis = 1 + DUPLEXED_DIMS.get(perage_dim, ("fates_levage",)).index("fates_levage")
+    n_lat, n_lon = land.shape
+
+    shape = [n_times] + component_shape + [n_lat, n_lon]
+    ap = (np.round(rng.gamma(2.0, 1.0, size=shape) * 256) / 256).astype(np.float32)
+    ap[..., ~land] = np.nan
+    if weights is None:
+        non_ap = ap.astype(np.float64).sum(axis=age_axis)
+    else:
+        # Broadcast the weights along the other components of a duplexed dimension
+        weights_shape = [n_times] + [1] * len(component_shape) + [n_lat, n_lon]
+        weights_shape[age_axis] = FATES_DIM_SIZES["fates_levage"]
+        non_ap = (ap.astype(np.float64) * weights.reshape(weights_shape)).sum(axis=age_axis)
+    if bad:
+        non_ap *= 1 + BAD_DISCREPANCY
+    non_ap = non_ap.astype(np.float32)
+
+    # Fold the components back into the (duplexed) dimensions
+    ap = ap.reshape([n_times, -1, n_lat, n_lon])
+    ap_dims = ("time", perage_dim, "lat", "lon")
+    if non_age_dim is None:
+        non_ap_dims = ("time", "lat", "lon")
+    else:
+        non_ap = non_ap.reshape([n_times, -1, n_lat, n_lon])
+        non_ap_dims = ("time", non_age_dim, "lat", "lon")
+    return (ap_dims, ap), (non_ap_dims, non_ap)
+
+
+def make_history_dataset(
+    n_lat, n_lon, n_vars, n_times=1, n_bad_vars=0, n_mean_vars=0, time_start=0, seed=0
+):
+    """
+    Make a Dataset like a CLM history file with FATES per-age variables: n_vars per-age variables
+    (cycling through the kinds in PERAGE_KINDS) and their non-per-age equivalents, plus patch- and
+    canopy-area weights. The first n_bad_vars variables fail the check. The next n_mean_vars are
+    saved as each age class's own value, so they fail the check of the sum across age classes but
+    pass the check of the patch-area-weighted mean.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Same land mask for every file and testset
+    land = np.random.default_rng(0).random((n_lat, n_lon)) < LAND_FRACTION
+
+    # Weights variables, which have no non-per-age equivalents. Made with their own random
+    # numbers, so the other variables are the same however many are weighted means.
+    weights_rng = np.random.default_rng([seed, 1])
+    data_vars = {}
+    for weights_var in ["FATES_PATCHAREA_AP", "FATES_CANOPYAREA_AP"]:
+        data_vars[weights_var] = (
+            ("time", "fates_levage", "lat", "lon"),
+            make_area_weights(weights_rng, n_times, land),
+            {"units": "m2 m-2"},
+        )
+
+    for i in range(n_vars):
+        kind = PERAGE_KINDS[i % len(PERAGE_KINDS)]
+        suffix, _, non_suffix, _ = kind
+        stem = get_var_stem(i)
+        weights = None
+        if n_bad_vars <= i < n_bad_vars + n_mean_vars:
+            weights = data_vars["FATES_PATCHAREA_AP"][1]
+        ap, non_ap = make_variable_pair(
+            rng, kind, n_times, land, bad=i < n_bad_vars, weights=weights
+        )
+        data_vars[f"{stem}_{suffix}"] = ap + ({"units": "kg m-2"},)
+        non_name = f"{stem}_{non_suffix}" if non_suffix else stem
+        data_vars[non_name] = non_ap + ({"units": "kg m-2"},)
+
+    coords = {
+        "time": (
+            "time",
+            np.arange(time_start, time_start + n_times, dtype=np.float64) * 30 + 30,
+            {"units": "days since 2000-01-01", "calendar": "noleap"},
+        ),
+        "lat": ("lat", np.linspace(-90, 90, n_lat), {"units": "degrees_north"}),
+        "lon": ("lon", np.linspace(0, 360, n_lon, endpoint=False), {"units": "degrees_east"}),
+    }
+    for dim, size in FATES_DIM_SIZES.items():
+        coords[dim] = (dim, np.arange(1, size + 1, dtype=np.int32))
+    data_vars["landfrac"] = (("lat", "lon"), land.astype(np.float32))
+
+    return xr.Dataset(data_vars, coords=coords)
+
+
+def write_srcroot_git_status(top_testset_dir, ctsm_sha, fates_sha):
+    """
+    Write a SRCROOT_GIT_STATUS file like the one CIME saves in each testset
+    """
+    with open(os.path.join(top_testset_dir, "SRCROOT_GIT_STATUS"), "w") as f:
+        f.write(f"Current hash: {ctsm_sha} (HEAD -> synthetic)\n")
+        f.write("Submodules:\n")
+        f.write(f"    fates at {fates_sha}\n")
+
+
+def write_test_status(test_dir, test_name, run_status):
+    """
+    Write a TestStatus file like the one CIME keeps in each test's directory, with the given
+    status (e.g., "PEND", "PASS", or "FAIL") for its RUN phase
+    """
+    with open(os.path.join(test_dir, "TestStatus"), "w") as f:
+        for phase in ["CREATE_NEWCASE", "XML", "SETUP", "SHAREDLIB_BUILD", "MODEL_BUILD", "SUBMIT"]:
+            f.write(f"PASS {test_name} {phase}\n")
+        f.write(f"{run_status} {test_name} RUN\n")
+
+
+def make_testset(
+    top_testset_dir,
+    test_name,
+    n_lat=46,
+    n_lon=72,
+    n_vars=40,
+    n_files=1,
+    n_times=1,
+    n_bad_vars=0,
+    n_mean_vars=0,
+    ctsm_sha="0123456789",
+    fates_sha="abcdef0123",
+    seed=0,
+    run_status="PASS",
+):
+    """
+    Make a synthetic testset containing one test, laid out like a real one:
+    top_testset_dir/test_name.<id>/run/*.clm2.h0.*.nc, plus SRCROOT_GIT_STATUS and the test's
+    TestStatus (with run_status for its RUN phase). Returns the list of history files.
+    """
+    test_dir = os.path.join(top_testset_dir, test_name + ".synthetic")
+    run_dir = os.path.join(test_dir, "run")
+    os.makedirs(run_dir, exist_ok=True)
+    write_srcroot_git_status(top_testset_dir, ctsm_sha, fates_sha)
+    write_test_status(test_dir, test_name, run_status)
+
+    file_list = []
+    for f in range(n_files):
+        ds = make_history_dataset(
+            n_lat,
+            n_lon,
+            n_vars,
+            n_times=n_times,
+            n_bad_vars=n_bad_vars,
+            n_mean_vars=n_mean_vars,
+            time_start=f * n_times,
+            seed=seed * 1000 + f,
+        )
+        this_file = os.path.join(run_dir, f"{test_name}.clm2.h0.{2000 + f:04d}-01.nc")
+        ds.to_netcdf(this_file, unlimited_dims=["time"])
+        file_list.append(this_file)
+    return file_list
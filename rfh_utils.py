@@ -6,154 +6,105 @@ Useful functions for this module
 # pylint: disable=too-many-arguments
 # pylint: disable=fixme
 
-import glob
 import os
-import re
-from socket import gethostname
-import matplotlib.pyplot as plt
+import time
 import numpy as np
 import xarray as xr
 
-from options import PUBLISH_DIR, TEST_NAME, TESTSET_DIR_LIST
-from rfh_git import Rfh_Git
-from rfh_write import Rfh_Write
-
-THISREPO_URL = "https://github.com/samsrabin/fates-refactor-history"
-PUBLISH_DIR = os.path.realpath(PUBLISH_DIR)
-
-# What machine are we on?
-hostname = gethostname()
-if any(x in hostname for x in ["derecho", "casper"]) or "crhtc" in hostname:
-    machine = "glade"
-    # Only possible because I have export PYTHONPATH=$HOME in my .bash_profile
-    from ctsm_python_gallery_myfork.ctsm_py import fates_xarray_funcs as fates_utils
-else:
-    raise NotImplementedError(f"Hostname not recognized: {hostname}")
-
-if not isinstance(TESTSET_DIR_LIST, list):
-    TESTSET_DIR_LIST = [TESTSET_DIR_LIST]
-TESTSET_DIR_BASENAME_LIST = [os.path.basename(x) for x in TESTSET_DIR_LIST]
-
-LOGFILE = os.path.join(
-    PUBLISH_DIR,
-    ".".join(["NONwtd"] + TESTSET_DIR_BASENAME_LIST + [TEST_NAME, "html.tmp"]),
-)
-if os.path.exists(LOGFILE):
-    os.remove(LOGFILE)
-print(f"Log file: {LOGFILE}")
-
-N_TESTS = len(TESTSET_DIR_LIST)
-COMPARING_2 = N_TESTS > 1
-if COMPARING_2 and N_TESTS > 2:
-    raise RuntimeError("Max # runs to compare is 2")
-
-git = Rfh_Git(PUBLISH_DIR, LOGFILE)
-write = Rfh_Write(LOGFILE, TESTSET_DIR_BASENAME_LIST, THISREPO_URL)
-write.write_front_matter(TEST_NAME, COMPARING_2)
-
-
-def ctsm_sha_to_fates(ctsm_sha, srcroot_git_status_file):
-    if ctsm_sha == "8e7a1d85f":
-        sha = "fates-ff87ce15"
-    elif ctsm_sha == "a6ccdf3ec":
-        sha = "fates-66cc4f81"
-    elif ctsm_sha == "7680fc6e8":
-        sha = "fates-1ec6d6eb"
-    elif ctsm_sha == "41a4cb47b":
-        sha = "fates-103fdc96"
-    elif ctsm_sha == "fe9ed7376":
-        sha = "fates-a0881c536"
-    elif ctsm_sha == "a807670c1":
-        sha = "fates-f21fa95b"
-    else:
-        sha = fates_sha_from_git_status_file(ctsm_sha, srcroot_git_status_file)
-    return sha
-
-
-def fates_sha_from_git_status_file(ctsm_sha, srcroot_git_status_file):
-    try:
-        pattern = re.compile(".*    fates .*")
-        match = None
-        for line in open(srcroot_git_status_file):
-            matches = pattern.match(line)
-            if matches:
-                match = matches[0]
-                break
-        if match is None:
-            raise EOFError(f"FATES line not found in {srcroot_git_status_file}")
-        if "is out of sync with .gitmodules" in match:
-            x = 3
-        else:
-            x = -1
-        sha = re.split(r"\s+", match)[x]
-        if len(sha) > 8:
-            sha = sha[:8]
-        sha = "fates-" + sha
-    except (FileNotFoundError, EOFError):
-        print(f"Unable to get FATES SHA for CTSM SHA {ctsm_sha}")
-        sha = "ctsm-" + ctsm_sha
-    except:  # pylint: disable=try-except-raise
-        raise
-    return sha
-
-
-def make_boxplots(datasets, perage_var, this_dict, var_to_print):
-    boxdatas = []
+import rfh_compare
+from rfh_catalog import HISTORY_GLOB, TEST_DIR_GLOBS, glob_history_files, read_git_status
+from rfh_deduplex import get_deduplexed_dims
+from rfh_incremental import get_fingerprint
+from rfh_manifest import Rfh_Manifest
+from rfh_profile import Rfh_Profile, get_rss_mb, stage
+import rfh_metrics
+import rfh_summary
+from rfh_write import SECTION_RESULTS, SECTION_TESTSETS
+
+# Everything here that needs settings or state takes an Rfh_Context (see rfh_context.py) as its
+# first argument. Importing this module has no side effects, and the git publisher, HTML writer,
+# and plotter (with matplotlib) are only set up when first used.
+
+
+def make_boxplots(ctx, datasets, perage_var, this_dict, var_to_print):
+    """
+    Start rendering the boxplots for a variable. Returns a Future; pass it to log_plot() when it's
+    time for the figure to go into the report.
+    """
     labels = []
-    for i, boxdata in enumerate(this_dict["boxdata"]):
-        boxdatas.append(boxdata)
+    for i in range(len(this_dict["boxstats"])):
         label = datasets[i].attrs["label"]
         if label is None:
-            if i == 0:
+            if ctx.n_tests == 2 and i == 0:
                 label = "before"
-            elif i == 1:
+            elif ctx.n_tests == 2 and i == 1:
                 label = "after"
             else:
                 label = str(i)
         emoji = this_dict["isclose_glyph"][i]
         labels.append(f"{label} {emoji}")
-    try:
-        # pylint: disable=unexpected-keyword-arg
-        plt.boxplot(boxdatas, tick_labels=labels)
-    except TypeError:
-        plt.boxplot(boxdatas, labels=labels)
-    except:  # pylint: disable=try-except-raise
-        raise
-    plt.ylabel(f"discrepancy ({datasets[0][perage_var].attrs['units']})")
-    plt.title(var_to_print)
-    write.log_plot()
-
-
-def compare_results(this_dict, da, da_ap_sum):
-    da_diff = da_ap_sum - da
-    this_dict["da_diffs"].append(da_diff)
-    max_abs_diff = np.nanmax(np.abs(da_diff).values)
-    this_dict["max_abs_diff"].append(max_abs_diff)
-    max_rel_diff = 100 * np.nanmax(np.abs(da_diff / da).values)
-    this_dict["max_pct_diff"].append(max_rel_diff)
+    units = datasets[0].attrs["manifest"].variables[perage_var]["units"]
+    ylabel = f"discrepancy ({units})"
+    return ctx.plot.submit(this_dict["boxstats"], labels, ylabel, var_to_print)
+
+
+def log_plot(ctx, plot_future, index):
+    ctx.write.begin_section(SECTION_RESULTS, index)
+    ctx.write.log_plot(plot_future.result())
+
 
-    is_close = max_abs_diff < 1e-9 and (max_rel_diff < 1e-6 or np.isnan(max_rel_diff))
+def save_results(
+    this_dict,
+    all_nan,
+    max_abs_diff,
+    max_pct_diff,
+    is_close,
+    boxstats,
+    wtd_max_abs_diff,
+    wtd_max_pct_diff,
+    wtd_is_close,
+    worst,
+):
+    this_dict["all_nan"].append(all_nan)
+    this_dict["max_abs_diff"].append(max_abs_diff)
+    this_dict["max_pct_diff"].append(max_pct_diff)
     this_dict["isclose"].append(is_close)
     this_dict["isclose_emoji"].append("✅" if is_close else "❌")
     this_dict["isclose_glyph"].append("✓" if is_close else "X")
-
-    this_dict["boxdata"].append(da_diff.values[np.where(np.abs(da_diff) >= 0)])
+    this_dict["boxstats"].append(boxstats)
+    this_dict["wtd_max_abs_diff"].append(wtd_max_abs_diff)
+    this_dict["wtd_max_pct_diff"].append(wtd_max_pct_diff)
+    this_dict["wtd_isclose"].append(wtd_is_close)
+    this_dict["wtd_isclose_emoji"].append("✅" if wtd_is_close else "❌")
+    this_dict["worst"].append(worst)
     return this_dict
 
 
 def add_result_text(
+    ctx,
     non_perage_equiv,
     perage_var,
     this_dict,
     var_to_print,
+    index,
 ):
-    write.add_result_text(
+    ctx.write.begin_section(SECTION_RESULTS, index)
+    ctx.write.add_result_text(
         non_perage_equiv,
         perage_var,
         this_dict,
         var_to_print,
-        COMPARING_2,
+        ctx.comparing,
     )
+    if not all(this_dict["isclose"]):
+        ctx.write.add_worst_text(
+            this_dict["worst"],
+            this_dict["isclose"],
+            ctx.testset_dir_basename_list,
+            this_dict.get("worst_elsewhere"),
+        )
+    if "timesteps" in this_dict:
+        ctx.write.add_timesteps_text(this_dict["timesteps"], ctx.testset_dir_basename_list)
 
 
 def get_variable_info(dict_perage_to_non_equiv, perage_var):
@@ -171,123 +122,166 @@ def get_variable_info(dict_perage_to_non_equiv, perage_var):
 
 
 def add_end_text(
+    ctx,
     nonperage_missing,
-    too_many_duplexed,
     missing_var_lists,
     all_nan,
     no_boxdata,
 ):
-    write.add_end_text(
+    ctx.write.add_end_text(
         nonperage_missing,
-        too_many_duplexed,
         missing_var_lists,
         all_nan,
         no_boxdata,
         )
 
 
-def deduplex(ds, suffix, too_many_duplexed, perage_var, var_to_print):
-    n_duplexed_dims = len(suffix) / 2
-    if n_duplexed_dims > 2:
-        too_many_duplexed.append(var_to_print)
-        return None, too_many_duplexed
-    if suffix == "APFC":
-        da_ap = fates_utils.agefuel_to_age_by_fuel(perage_var, ds)
-    elif suffix == "APPF":
-        da_ap = fates_utils.deduplex(ds, perage_var, "age", "pft")
-    elif suffix == "SZAP":
-        da_ap = fates_utils.deduplex(ds, perage_var, "scls", "age")
-    elif suffix == "SZAPPF":
-        raise RuntimeError("This requires more testing")
-        # pylint: disable=unreachable
-        da_ap = fates_utils.scappf_to_scls_by_age_by_pft(perage_var, ds)
-    else:
-        raise NotImplementedError(f"Unrecognized suffix: _{suffix}")
-    return da_ap, too_many_duplexed
+def get_sha(top_testset_dir, ds):
+    srcroot_git_status_file = os.path.join(top_testset_dir, "SRCROOT_GIT_STATUS")
+    ds.attrs["this_commit"], ds.attrs["label"] = read_git_status(srcroot_git_status_file)
+    return ds
 
 
-def get_sha(testset_dir, top_testset_dir, ds):
-    srcroot_git_status_file = os.path.join(top_testset_dir, "SRCROOT_GIT_STATUS")
-    this_commit = None
-    sha = None
-    pattern = re.compile("^Current hash:.*$")
-    try:
-        for line in open(srcroot_git_status_file):
-            for match in re.finditer(pattern, line):
-                this_commit = match.group()
-                sha = this_commit.split(" ")[2]
-        ds.attrs["this_commit"] = this_commit.replace(
-            "Current hash", "Current CTSM hash"
-        )
-        ds.attrs["label"] = ctsm_sha_to_fates(sha, srcroot_git_status_file)
-        with open(LOGFILE, "a") as f:
-            f.write(f"<h3>{testset_dir}</h3>\n")
-        write.log_br(ds.attrs["this_commit"])
-    except FileNotFoundError:
-        ds.attrs["this_commit"] = "unknown"
-        ds.attrs["label"] = "unknown"
-    except:  # pylint: disable=try-except-raise
-        raise
+def open_history_file(ctx, this_file):
+    """
+    Lazily open a history file. Nothing is read from disk until it's needed, and then only the
+    hyperslab of the variable in question.
+    """
+    manifest = Rfh_Manifest.from_file(this_file, ctx.config.manifest_cache_dir)
+    drop_variables = None
+    if ctx.config.load_only_needed_vars:
+        needed_vars = manifest.get_needed_vars()
+        drop_variables = [v for v in manifest.variables if v not in needed_vars]
+    ds = xr.open_dataset(
+        this_file, drop_variables=drop_variables, chunks=ctx.config.open_dataset_chunks
+    )
+
+    # Remember everything that was in the file, for planning the analysis
+    ds.attrs["manifest"] = manifest
     return ds
 
 
-def get_datasets():
-    datasets = []
-    for i, testset_dir in enumerate(TESTSET_DIR_BASENAME_LIST):
-        top_testset_dir = TESTSET_DIR_LIST[i]
-        top_testset_dir = os.path.realpath(top_testset_dir)
-        test_run_dir = os.path.join(top_testset_dir, TEST_NAME + "*", "run")
-        test_run_dir = os.path.join(test_run_dir, "*.clm2.h0.*nc")
+def open_last_timestep(ctx, this_file):
+    ds = open_history_file(ctx, this_file)
+    if "time" in ds.dims:
+        ds = ds.isel(time=-1)
+    return ds
+
 
-        file_list = glob.glob(test_run_dir)
+def iter_timesteps(ctx, file_list):
+    """
+    Yield each timestep of each history file, in time order, one at a time
+    """
+    for this_file in file_list:
+        with open_history_file(ctx, this_file) as ds:
+            if "time" not in ds.dims:
+                yield ds
+                continue
+            for t in range(ds.sizes["time"]):
+                yield ds.isel(time=t)
+
+
+def find_history_files(ctx, top_testset_dir, test_name):
+    """
+    Get the sorted history files of a test in a testset: from the catalog or extract store if
+    they're enabled and up to date, otherwise by searching. Empty if there are none (yet).
+    """
+    top_testset_dir = os.path.realpath(top_testset_dir)
+    catalog = ctx.catalog
+    store = ctx.extract_store
+    file_list = None
+    if catalog:
+        file_list = catalog.get_history_files(top_testset_dir, test_name)
+    if file_list is None and store:
+        file_list = store.get_file_list(top_testset_dir, test_name)
+    if file_list is None:
+        file_list = glob_history_files(top_testset_dir, test_name)
+        if store and file_list:
+            store.put_file_list(top_testset_dir, test_name, file_list)
+    return file_list
+
+
+def load_testset(ctx, top_testset_dir, test_name):
+    """
+    Lazily open the last timestep of a test in a testset, noting its code version in ds.attrs.
+
+    If ctx.config.catalog_file is set, the history files and code version are looked up there
+    first (see rfh_catalog.py). If ctx.config.extract_dir is set, the timestep is read from a local
+    extract of it instead, which is made the first time (see rfh_extract.py).
+    """
+    top_testset_dir = os.path.realpath(top_testset_dir)
+
+    catalog = ctx.catalog
+    store = ctx.extract_store
+    with stage(ctx.profile, "load"):
+        file_list = find_history_files(ctx, top_testset_dir, test_name)
         if len(file_list) == 0:
-            raise FileNotFoundError(f"No files found matching {test_run_dir}")
-        file_list.sort()
+            test_run_dirs = [
+                os.path.join(top_testset_dir, g.format(test_name), HISTORY_GLOB)
+                for g in TEST_DIR_GLOBS
+            ]
+            raise FileNotFoundError(f"No files found matching {' or '.join(test_run_dirs)}")
 
         # Only examine the last timestep, for efficiency
         this_file = file_list[-1]
-        ds = xr.open_dataset(this_file)
-        if "time" in ds.dims:
-            ds = ds.isel(time=-1)
+        ds = store.open(this_file) if store else None
+        if ds is None:
+            ds = open_last_timestep(ctx, this_file)
+            if store:
+                with stage(ctx.profile, "extract"):
+                    store.put(this_file, ds)
+                ds.close()
+                ds = store.open(this_file)
+        ds.attrs["history_files"] = file_list
+        ds.attrs["testset_dir"] = os.path.basename(top_testset_dir)
 
         # Get SHA
-        ds = get_sha(testset_dir, top_testset_dir, ds)
+        entry = catalog.get_testset(top_testset_dir) if catalog else None
+        if entry is None:
+            ds = get_sha(top_testset_dir, ds)
+        else:
+            ds.attrs["this_commit"] = entry["this_commit"]
+            ds.attrs["label"] = entry["label"]
+    return ds
+
 
-        datasets.append(ds)
+def get_datasets(ctx):
+    datasets = []
+    for top_testset_dir in ctx.testset_dir_list:
+        datasets.append(load_testset(ctx, top_testset_dir, ctx.test_name))
     return datasets
 
 
+def log_testsets(ctx, datasets):
+    ctx.write.begin_section(SECTION_TESTSETS)
+    for ds in datasets:
+        if ds.attrs["this_commit"] == "unknown":
+            continue
+        ctx.write.write(f"<h3>{ds.attrs['testset_dir']}</h3>\n")
+        ctx.write.log_br(ds.attrs["this_commit"])
+
+
 # Get per-ageclass variables and their equivalents
-def get_dict_perage_to_non_equiv(datasets):
-    pattern = "FATES_[A-Z_]+_[A-Z]*AP[A-Z]*"
-    p = re.compile(pattern)
+def get_dict_perage_to_non_equiv(manifests):
+    """
+    Plan the analysis from the manifest of each Dataset's history file (ds.attrs["manifest"]), so
+    no data needs to be loaded
+    """
     dict_perage_to_non_equiv = {}
 
     # Get variables missing from each dataset
-    all_vars = []
-    for ds in datasets:
-        all_vars += list(ds.variables)
-    unique_vars = np.unique(all_vars)
+    var_sets = [set(manifest.variables) for manifest in manifests]
+    unique_vars = sorted(set.union(*var_sets))
     missing_var_lists = []
-    for ds in datasets:
-        missing_var_lists.append([v for v in unique_vars if v not in ds])
+    for var_set in var_sets:
+        missing_var_lists.append([v for v in unique_vars if v not in var_set])
 
-    # Loop through variables present on both datasets
-    var_list = [v for v in datasets[0] if v in datasets[1]]
-    var_list.sort()
+    # Loop through per-age variables present on all datasets
+    common_vars = set.intersection(*var_sets)
+    var_list = sorted(v for v in manifests[0].perage_to_non_equiv if v in common_vars)
     for this_var in var_list:
-        match = p.match(this_var)
-        if match is None:
-            continue
-        if this_var == "FATES_NPATCH_AP":
-            non_perage_equiv = "FATES_NPATCHES"
-        else:
-            suffix = this_var.split("_")[-1]
-            suffix2 = suffix.replace("AP", "")
-            non_perage_equiv = "_".join(this_var.split("_")[:-1])
-            if suffix2:
-                non_perage_equiv += "_" + suffix2
-        if all(non_perage_equiv in ds for ds in datasets):
+        non_perage_equiv = manifests[0].perage_to_non_equiv[this_var]
+        if non_perage_equiv in common_vars:
             dict_perage_to_non_equiv[this_var] = {
                 "non_perage_equiv": non_perage_equiv,
                 "isclose": [],
@@ -295,13 +289,15 @@ def get_dict_perage_to_non_equiv(datasets):
                 "isclose_glyph": [],
                 "max_abs_diff": [],
                 "max_pct_diff": [],
-                "da_diffs": [],
-                "boxdata": [],
+                "all_nan": [],
+                "boxstats": [],
+                "wtd_max_abs_diff": [],
+                "wtd_max_pct_diff": [],
+                "wtd_isclose": [],
+                "wtd_isclose_emoji": [],
+                "worst": [],
+                "weights": manifests[0].perage_to_weights[this_var],
             }
-            if this_var in ["FATES_STOMATAL_COND_AP", "FATES_LBLAYER_COND_AP"]:
-                dict_perage_to_non_equiv[this_var]["weights"] = "FATES_CANOPYAREA_AP"
-            else:
-                dict_perage_to_non_equiv[this_var]["weights"] = "FATES_PATCHAREA_AP"
         else:
             dict_perage_to_non_equiv[this_var] = {
                 "non_perage_equiv": None,
@@ -310,20 +306,635 @@ def get_dict_perage_to_non_equiv(datasets):
     return dict_perage_to_non_equiv, missing_var_lists
 
 
-def get_unweighted_sum(suffix, da, da_ap):
-    da_ap_sum = da_ap.sum(dim="fates_levage")
-    if suffix == "SZAPPF":
-        raise RuntimeError("This requires more testing")
-        # pylint: disable=unreachable
-        da_ap_sum = da_ap_sum.stack(fates_levscpf=("fates_levscls", "fates_levpft"))
-        da_ap_sum = da_ap_sum.transpose("fates_levscpf", "lat", "lon")
-    if da.dims != da_ap_sum.dims:
+def check_summed_dims(dims, ap_dims):
+    summed_dims = tuple(d for d in ap_dims if d != "fates_levage")
+    if dims != summed_dims:
         raise RuntimeError(
-            f"Dimensions of da_ap_sum ({da_ap_sum.dims}) don't match those of da ({da.dims})"
+            f"Dimensions of da_ap_sum ({summed_dims}) don't match those of da ({dims})"
         )
 
-    return da_ap_sum
 
+def get_comparison_groups(ds, dict_perage_to_non_equiv, nonperage_missing):
+    """
+    Get the DataArrays to compare for each variable, grouped by dimension signature (i.e., the
+    dimensions and shape of the de-duplexed per-age variable) and weights variable (None if it's
+    not in ds). All members of a group can be stacked into one array. Nothing is read here;
+    deduplexing happens when a batch is stacked.
+    """
+    groups = {}
+    for perage_var in dict_perage_to_non_equiv:
+        (
+            non_perage_equiv,
+            suffix,
+            this_dict,
+            do_deduplex,
+            var_to_print,
+        ) = get_variable_info(dict_perage_to_non_equiv, perage_var)
+
+        if non_perage_equiv is None:
+            if var_to_print not in nonperage_missing:
+                nonperage_missing.append(var_to_print)
+            continue
+
+        # Get DataArrays to work with, and their dimensions once deduplexed
+        da = ds[non_perage_equiv]
+        da_ap = ds[perage_var]
+        dims, shape = get_deduplexed_dims(da, ds.sizes)
+        ap_dims, ap_shape = get_deduplexed_dims(da_ap, ds.sizes)
+        if do_deduplex and ap_dims == da_ap.dims:
+            raise NotImplementedError(f"Unrecognized suffix: _{suffix}")
+        check_summed_dims(dims, ap_dims)
+
+        weights_var = this_dict["weights"] if this_dict["weights"] in ds else None
+        signature = (ap_dims, ap_shape, weights_var)
+        groups.setdefault(signature, []).append((perage_var, da, da_ap, shape))
+    return groups, nonperage_missing
+
+
+def get_broadcast_weights(da_w, ap_dims):
+    """
+    Get the values of a weights variable shaped to broadcast against a stack of per-age variables
+    with (deduplexed) dimensions ap_dims, or None if it has dimensions they don't
+    """
+    if not set(da_w.dims) <= set(ap_dims):
+        return None
+    values = da_w.transpose(*[d for d in ap_dims if d in da_w.dims]).values
+    shape = [1] + [da_w.sizes[d] if d in da_w.dims else 1 for d in ap_dims]
+    return values.reshape(shape)
+
+
+def add_variable_usage(profile, perage_var, name, start, share=1):
+    """
+    Record the wall time, CPU time, and RSS growth of a variable in a stage, given the wall and
+    CPU times and RSS at the start, shared with share - 1 other variables
+    """
+    wall_start, cpu_start, rss_start = start
+    rss_growth_mb = None
+    if rss_start is not None:
+        rss_growth_mb = (get_rss_mb() - rss_start) / share
+    profile.add_variable(
+        perage_var,
+        name,
+        (time.perf_counter() - wall_start) / share,
+        (time.process_time() - cpu_start) / share,
+        rss_growth_mb,
+    )
+
+
+def stack_batch(batch, ap_shape, profile=None):
+    """
+    Read a batch of variables from a group made by get_comparison_groups(), unfolding their
+    duplexed dimensions, and stack the per-age variables and their non-per-age equivalents for
+    rfh_compare.compare_group(). If profiling, each variable's reading is recorded.
+    """
+    # Deduplexing is just a reshape, so these are views, not copies, of what was read
+    ap_arrays = []
+    ref_arrays = []
+    for perage_var, da, da_ap, shape in batch:
+        if profile:
+            start = (time.perf_counter(), time.process_time(), get_rss_mb())
+        ap_arrays.append(da_ap.values.reshape(ap_shape))
+        ref_arrays.append(da.values.reshape(shape))
+        if profile:
+            add_variable_usage(profile, perage_var, "read", start)
+    return np.stack(ap_arrays), np.stack(ref_arrays)
+
+
+def iter_batch_results(ctx, ds, groups, top_k=None):
+    """
+    Compare each group of variables from get_comparison_groups(ds), in batches of at most
+    ctx.config.batch_max_vars variables. Yields each batch along with its results from
+    rfh_compare.compare_group() (given top_k). Each weights variable is read from ds only once, and
+    shared by every variable that uses it.
+
+    If profiling, the wall and CPU time taken to read each variable, and how much it grew RSS, are
+    recorded, as is its share of those for comparing its batch.
+    """
+    profile = ctx.profile
+    weights_cache = {}
+    for (ap_dims, ap_shape, weights_var), members in groups.items():
+        age_axis = ap_dims.index("fates_levage") + 1
+        weights = None
+        if weights_var is not None:
+            key = (weights_var, ap_dims)
+            if key not in weights_cache:
+                with stage(profile, "read"):
+                    weights_cache[key] = get_broadcast_weights(ds[weights_var], ap_dims)
+            weights = weights_cache[key]
+        batch_size = ctx.config.batch_max_vars or len(members)
+        for b in range(0, len(members), batch_size):
+            batch = members[b : b + batch_size]
+
+            with stage(profile, "read"):
+                ap_stack, ref_stack = stack_batch(batch, ap_shape, profile)
+
+            if profile:
+                start = (time.perf_counter(), time.process_time(), get_rss_mb())
+            with stage(profile, "compare"):
+                results = rfh_compare.compare_group(
+                    ap_stack,
+                    ref_stack,
+                    age_axis,
+                    ctx.config.max_boxplot_fliers,
+                    weights,
+                    top_k,
+                )
+            if profile:
+                for perage_var, _, _, _ in batch:
+                    add_variable_usage(profile, perage_var, "compare", start, len(batch))
+            del ap_stack, ref_stack
+            yield batch, results
+
+
+def locate_worst_points(ds, da, worst):
+    """
+    Add the coordinates of a variable's worst discrepancies (from rfh_compare.compare_group()) to
+    them: "dims" lists the dimensions of its non-per-age equivalent once deduplexed, and "coords"
+    has an array of coordinates for each. Dimensions without a coordinate variable (e.g., FATES
+    classes) get 1-based indices. "index" keeps their flat indices, for finding the same points in
+    other testsets (see add_worst_elsewhere()).
+    """
+    if worst is None:
+        return None
+    dims, shape = get_deduplexed_dims(da, ds.sizes)
+    coords = {}
+    for dim, index in zip(dims, np.unravel_index(worst["index"], shape)):
+        if dim in ds.variables and ds[dim].dims == (dim,):
+            coords[dim] = ds[dim].values[index]
+        else:
+            coords[dim] = index + 1
+    return {
+        "dims": list(dims),
+        "coords": coords,
+        "diff": worst["diff"],
+        "sum": worst["sum"],
+        "ref": worst["ref"],
+        "index": worst["index"],
+    }
+
+
+def get_diffs_at(ds, perage_var, non_perage_equiv, index):
+    """
+    Get a variable's discrepancies (sum across age classes minus non-per-age equivalent) at some
+    flat indices of its deduplexed non-per-age equivalent, or None if the grid doesn't match
+    """
+    da = ds[non_perage_equiv]
+    da_ap = ds[perage_var]
+    _, shape = get_deduplexed_dims(da, ds.sizes)
+    ap_dims, ap_shape = get_deduplexed_dims(da_ap, ds.sizes)
+    if index.size and index.max() >= np.prod(shape):
+        return None
+    ap_sum = da_ap.values.reshape(ap_shape).sum(axis=ap_dims.index("fates_levage"))
+    return ap_sum.reshape(-1)[index] - da.values.reshape(-1)[index]
+
+
+def add_worst_elsewhere(ctx, datasets, to_report):
+    """
+    Wherever a variable failed the check in one testset, get its discrepancies in each of the
+    other testsets at that testset's worst points, so that a new discrepancy can be told apart
+    from one that was already there. Saved in this_dict["worst_elsewhere"][i][j]: testset j's
+    discrepancies at testset i's worst points (None if not needed).
+
+    Each testset's discrepancies are looked up in the results cache, which keeps them from when
+    the testset was compared (see compare_dataset()). Only if they aren't there is its history
+    file opened, once, and only the variables still needed read from it.
+    """
+    n_tests = len(datasets)
+    needed = []
+    for _, perage_var, this_dict, _ in to_report:
+        failing = [
+            i
+            for i, (worst, isclose) in enumerate(zip(this_dict["worst"], this_dict["isclose"]))
+            if not isclose and worst is not None and len(worst["diff"])
+        ]
+        if n_tests > 1 and failing:
+            this_dict["worst_elsewhere"] = [[None] * n_tests for _ in range(n_tests)]
+            needed.append((perage_var, this_dict, failing))
+    if not needed:
+        return
+
+    cache = ctx.cache
+    store = ctx.extract_store
+    for j, ds_header in enumerate(datasets):
+        history_file = ds_header.attrs["history_files"][-1]
+        lookups = [
+            (perage_var, this_dict, i)
+            for perage_var, this_dict, failing in needed
+            for i in failing
+            if i != j
+        ]
+        diffs_at = [None] * len(lookups)
+        if cache:
+            with stage(ctx.profile, "cache"):
+                diffs_at = cache.get_diffs_at(
+                    history_file,
+                    [
+                        (perage_var, this_dict["worst"][i]["index"])
+                        for perage_var, this_dict, i in lookups
+                    ],
+                )
+        if any(x is None for x in diffs_at):
+            with stage(ctx.profile, "read"):
+                ds = store.open(history_file) if store else None
+                if ds is None:
+                    ds = open_last_timestep(ctx, history_file)
+                with ds:
+                    for k, (perage_var, this_dict, i) in enumerate(lookups):
+                        if diffs_at[k] is None:
+                            diffs_at[k] = get_diffs_at(
+                                ds,
+                                perage_var,
+                                this_dict["non_perage_equiv"],
+                                this_dict["worst"][i]["index"],
+                            )
+        for (_, this_dict, i), x in zip(lookups, diffs_at):
+            this_dict["worst_elsewhere"][i][j] = x
+
+
+def compare_dataset(ctx, ds, dict_perage_to_non_equiv, nonperage_missing):
+    """
+    Compare every per-age variable with its non-per-age equivalent in one Dataset. Rather than
+    going variable by variable, this stacks all variables with the same dimension signature into
+    one array and does the comparison for the whole group at once. Groups are split into batches
+    of at most ctx.config.batch_max_vars variables, which bounds memory use: Datasets are opened
+    lazily, so only one batch is in memory at a time.
+
+    If the cache is enabled, variables with cached results for the Dataset's history file aren't
+    read or compared again. Each variable's discrepancies at every point are cached along with its
+    results, so that the other testsets' worst points can be looked up without reading the file
+    again (see add_worst_elsewhere()).
+
+    Returns a dict of variable name: results, in the order expected by save_results().
+    """
+    history_file = ds.attrs["history_files"][-1]
+    cache = ctx.cache
+    with stage(ctx.profile, "cache"):
+        ds_results = cache.get(history_file) if cache else {}
+    to_compare = {k: v for k, v in dict_perage_to_non_equiv.items() if k not in ds_results}
+
+    groups, nonperage_missing = get_comparison_groups(ds, to_compare, nonperage_missing)
+    diffs = {}
+    for batch, results in iter_batch_results(ctx, ds, groups, ctx.config.top_k_worst):
+        for i, (perage_var, da, _, _) in enumerate(batch):
+            if cache:
+                # A copy, so the rest of the batch can be freed
+                diffs[perage_var] = results["diffs"][i].reshape(-1).copy()
+            worst = results["worst"][i] if results["worst"] is not None else None
+            ds_results[perage_var] = (
+                bool(results["all_nan"][i]),
+                results["max_abs_diff"][i],
+                results["max_pct_diff"][i],
+                bool(results["isclose"][i]),
+                results["boxstats"][i],
+                results["wtd_max_abs_diff"][i],
+                results["wtd_max_pct_diff"][i],
+                bool(results["wtd_isclose"][i]),
+                locate_worst_points(ds, da, worst),
+            )
+
+    if cache and groups:
+        with stage(ctx.profile, "cache"):
+            cache.put(history_file, ds_results, diffs)
+    return ds_results, nonperage_missing
+
+
+def save_dataset_results(dict_perage_to_non_equiv, ds_results):
+    for perage_var, var_results in ds_results.items():
+        if perage_var in dict_perage_to_non_equiv:
+            dict_perage_to_non_equiv[perage_var] = save_results(
+                dict_perage_to_non_equiv[perage_var], *var_results
+            )
+    return dict_perage_to_non_equiv
+
+
+def compare_all(ctx, datasets, dict_perage_to_non_equiv, nonperage_missing):
+    """
+    Compare every per-age variable with its non-per-age equivalent in each Dataset. See
+    compare_dataset().
+    """
+    for ds in datasets:
+        ds_results, nonperage_missing = compare_dataset(
+            ctx, ds, dict_perage_to_non_equiv, nonperage_missing
+        )
+        dict_perage_to_non_equiv = save_dataset_results(
+            dict_perage_to_non_equiv, ds_results
+        )
+
+    return dict_perage_to_non_equiv, nonperage_missing
+
+
+def stream_all_timesteps(ctx, datasets, dict_perage_to_non_equiv, nonperage_missing):
+    """
+    Check every timestep of every history file, one timestep at a time. Each variable's results
+    are reduced to running statistics (see rfh_compare.update_running_stats()), so memory use is
+    about the same as for checking just the last timestep.
+    """
+    for i, ds in enumerate(datasets):
+        for this_dict in dict_perage_to_non_equiv.values():
+            if this_dict["non_perage_equiv"] is not None:
+                this_dict.setdefault("timesteps", []).append(
+                    rfh_compare.new_running_stats()
+                )
+        for ds_t in iter_timesteps(ctx, ds.attrs["history_files"]):
+            timestep = str(ds_t["time"].values) if "time" in ds_t.coords else None
+            groups, nonperage_missing = get_comparison_groups(
+                ds_t, dict_perage_to_non_equiv, nonperage_missing
+            )
+            for batch, results in iter_batch_results(ctx, ds_t, groups):
+                for j, (perage_var, _, _, _) in enumerate(batch):
+                    rfh_compare.update_running_stats(
+                        dict_perage_to_non_equiv[perage_var]["timesteps"][i],
+                        results["max_abs_diff"][j],
+                        results["max_pct_diff"][j],
+                        results["isclose"][j],
+                        timestep,
+                    )
+
+    return dict_perage_to_non_equiv, nonperage_missing
+
+
+def analyze_testset(ctx, top_testset_dir, test_name):
+    """
+    Load and analyze one test in one testset, independent of any comparison. Returns a header-only
+    Dataset (just its attrs, which are all that's needed for the report), the results from
+    compare_dataset(), and (if ctx.config.all_timesteps) each variable's running statistics over
+    all timesteps. Combine the output for several testsets with combine_analyses().
+
+    If profiling, this analysis gets its own profile, saved in the header's attrs so that it
+    survives being sent back from a worker process.
+    """
+    outer_profile = ctx.profile
+    ctx.profile = Rfh_Profile() if ctx.config.profile else None
+    try:
+        ds = load_testset(ctx, top_testset_dir, test_name)
+        dict_perage_to_non_equiv, _ = get_dict_perage_to_non_equiv([ds.attrs["manifest"]])
+        ds_results, _ = compare_dataset(ctx, ds, dict_perage_to_non_equiv, [])
+
+        ds_timesteps = {}
+        if ctx.config.all_timesteps:
+            dict_perage_to_non_equiv, _ = stream_all_timesteps(
+                ctx, [ds], dict_perage_to_non_equiv, []
+            )
+            for perage_var, this_dict in dict_perage_to_non_equiv.items():
+                if "timesteps" in this_dict:
+                    ds_timesteps[perage_var] = this_dict["timesteps"][0]
+
+        ds_header = xr.Dataset(attrs=ds.attrs)
+        ds.close()
+        if ctx.profile:
+            ds_header.attrs["profile"] = ctx.profile.to_dict()
+    finally:
+        ctx.profile = outer_profile
+    return ds_header, ds_results, ds_timesteps
+
+
+def combine_analyses(ctx, analyses):
+    """
+    Given the output of analyze_testset() for each testset in a comparison, get what's needed for
+    write_report()
+    """
+    datasets = [ds_header for ds_header, _, _ in analyses]
+    if ctx.profile:
+        for ds in datasets:
+            if "profile" in ds.attrs:
+                ctx.profile.merge(ds.attrs["profile"])
+    dict_perage_to_non_equiv, missing_var_lists = get_dict_perage_to_non_equiv(
+        [ds.attrs["manifest"] for ds in datasets]
+    )
+    for _, ds_results, ds_timesteps in analyses:
+        dict_perage_to_non_equiv = save_dataset_results(
+            dict_perage_to_non_equiv, ds_results
+        )
+        for perage_var, stats in ds_timesteps.items():
+            if perage_var in dict_perage_to_non_equiv:
+                this_dict = dict_perage_to_non_equiv[perage_var]
+                this_dict.setdefault("timesteps", []).append(stats)
+
+    nonperage_missing = []
+    for perage_var in dict_perage_to_non_equiv:
+        non_perage_equiv, _, _, _, var_to_print = get_variable_info(
+            dict_perage_to_non_equiv, perage_var
+        )
+        if non_perage_equiv is None:
+            nonperage_missing.append(var_to_print)
+
+    return datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing
+
+
+def get_section_fingerprint(ctx, datasets, perage_var, this_dict):
+    """
+    Fingerprint everything that goes into a variable's section of the report. The discrepancies
+    at other testsets' worst points (see add_worst_elsewhere()) are only looked up for sections
+    that aren't reused, so they're left out: They're determined by the worst points and the
+    history files, which are included, as are the results from the files' contents.
+    """
+    return get_fingerprint(
+        perage_var,
+        ctx.n_tests,
+        ctx.testset_dir_basename_list,
+        ctx.config.plot_format,
+        ctx.config.plot_assets_subdir,
+        [ds.attrs["label"] for ds in datasets],
+        [ds.attrs["history_files"][-1] for ds in datasets],
+        datasets[0].attrs["manifest"].variables[perage_var]["units"],
+        {k: v for k, v in this_dict.items() if k != "worst_elsewhere"},
+    )
+
+
+def classify_variables(dict_perage_to_non_equiv):
+    """
+    Sort out which variables can be reported. Returns a list of (non_perage_equiv, perage_var,
+    this_dict, var_to_print) for each, plus lists of the variables that are all NaN and that have
+    no data to plot.
+    """
+    all_nan = []
+    no_boxdata = []
+    to_report = []
+    for perage_var in dict_perage_to_non_equiv:
+        (
+            non_perage_equiv,
+            _,
+            this_dict,
+            _,
+            var_to_print,
+        ) = get_variable_info(dict_perage_to_non_equiv, perage_var)
+
+        if non_perage_equiv is None:
+            continue
 
-def publish():
-    git.publish()
+        # Check for data that won't be plotted
+        if all(this_dict["all_nan"]):
+            all_nan.append(var_to_print)
+            continue
+        if all(boxstats["n"] == 0 for boxstats in this_dict["boxstats"]):
+            no_boxdata.append(var_to_print)
+            continue
+        to_report.append((non_perage_equiv, perage_var, this_dict, var_to_print))
+    return to_report, all_nan, no_boxdata
+
+
+def write_summary(
+    ctx, datasets, to_report, all_nan, no_boxdata, missing_var_lists, nonperage_missing
+):
+    """
+    Save the results for the current comparison as JSON (ctx.summary_file), and add the viewer
+    that draws them to the report in place of the per-variable sections
+    """
+    units = datasets[0].attrs["manifest"].variables
+    variables = [
+        rfh_summary.get_variable_summary(
+            perage_var, var_to_print, non_perage_equiv, this_dict, units[perage_var]["units"]
+        )
+        for non_perage_equiv, perage_var, this_dict, var_to_print in to_report
+    ]
+    testsets = [
+        {
+            "dir": ds.attrs["testset_dir"],
+            "label": ds.attrs["label"],
+            "commit": ds.attrs["this_commit"],
+        }
+        for ds in datasets
+    ]
+    summary = rfh_summary.get_summary(
+        ctx.test_name,
+        testsets,
+        variables,
+        all_nan,
+        no_boxdata,
+        nonperage_missing,
+        missing_var_lists,
+    )
+    rfh_summary.save_summary(ctx.summary_file, summary)
+    summary_filename = os.path.basename(ctx.summary_file)
+    ctx.write.add_section(SECTION_RESULTS, 0, rfh_summary.get_viewer_html(summary_filename))
+
+
+def record_metrics(ctx, datasets, dict_perage_to_non_equiv):
+    """
+    Record each testset's results for every variable in ctx.metrics, for querying trends later
+    (see query_metrics.py)
+    """
+    rows = []
+    for i, ds in enumerate(datasets):
+        rows += rfh_metrics.get_rows(ctx.test_name, ds.attrs, dict_perage_to_non_equiv, i)
+    ctx.metrics.record(rows)
+
+
+def write_report(ctx, datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing):
+    """
+    Write the report for the current comparison (see Rfh_Context.start_comparison()), given the
+    results of compare_all()
+
+    If ctx.config.incremental, each variable's section is reused from the last run of this report
+    if nothing that goes into it has changed; only the other sections are written and plotted. If
+    ctx.config.report_format is "json", the results are saved as JSON instead, to be drawn by the
+    browser (see write_summary()). If ctx.config.metrics_db is set, the results are also recorded
+    there (see record_metrics()).
+    """
+    log_testsets(ctx, datasets)
+    to_report, all_nan, no_boxdata = classify_variables(dict_perage_to_non_equiv)
+    if ctx.metrics:
+        with stage(ctx.profile, "write"):
+            record_metrics(ctx, datasets, dict_perage_to_non_equiv)
+
+    if ctx.config.report_format == "json":
+        add_worst_elsewhere(ctx, datasets, to_report)
+        with stage(ctx.profile, "write"):
+            write_summary(
+                ctx,
+                datasets,
+                to_report,
+                all_nan,
+                no_boxdata,
+                missing_var_lists,
+                nonperage_missing,
+            )
+            add_end_text(ctx, nonperage_missing, missing_var_lists, all_nan, no_boxdata)
+        return
+
+    # Reuse each variable's section from the last run, if possible, and start rendering the
+    # boxplots of the rest
+    report_manifest = ctx.report_manifest
+    sections = []
+    for non_perage_equiv, perage_var, this_dict, var_to_print in to_report:
+        fingerprint = None
+        html = None
+        if report_manifest:
+            fingerprint = get_section_fingerprint(ctx, datasets, perage_var, this_dict)
+            html = report_manifest.get(perage_var, fingerprint)
+
+        # Make boxplots
+        plot_future = None
+        if html is None:
+            with stage(ctx.profile, "plot"):
+                plot_future = make_boxplots(ctx, datasets, perage_var, this_dict, var_to_print)
+        sections.append((plot_future, fingerprint, html))
+    add_worst_elsewhere(
+        ctx,
+        datasets,
+        [report for report, (_, _, html) in zip(to_report, sections) if html is None],
+    )
+
+    # Report, in the original order, as the boxplots finish rendering
+    n_reused = 0
+    for i, (
+        (non_perage_equiv, perage_var, this_dict, var_to_print),
+        (plot_future, fingerprint, html),
+    ) in enumerate(zip(to_report, sections)):
+        if html is not None:
+            ctx.write.add_section(SECTION_RESULTS, i, html)
+            n_reused += 1
+            continue
+        with stage(ctx.profile, "write"):
+            add_result_text(
+                ctx,
+                non_perage_equiv,
+                perage_var,
+                this_dict,
+                var_to_print,
+                i,
+            )
+        with stage(ctx.profile, "plot"):
+            log_plot(ctx, plot_future, i)
+        if report_manifest:
+            report_manifest.put(
+                perage_var, fingerprint, ctx.write.get_section(SECTION_RESULTS, i)
+            )
+    if report_manifest:
+        print(f"\nReused {n_reused}/{len(to_report)} unchanged sections from the last run")
+
+    with stage(ctx.profile, "write"):
+        add_end_text(ctx, nonperage_missing, missing_var_lists, all_nan, no_boxdata)
+
+
+def finish_report(ctx):
+    """
+    Write out the report for the current comparison and stage it for publishing. If profiling,
+    the report gets a performance section, and the full profile is saved (and staged) next to it.
+    """
+    with stage(ctx.profile, "plot"):
+        ctx.close()
+    if ctx.profile:
+        ctx.write.add_performance_text(ctx.profile)
+    with stage(ctx.profile, "flush"):
+        ctx.write.flush()
+    ctx.git.stage_report(ctx.logfile)
+    if ctx.config.report_format == "json":
+        ctx.git.stage_file(ctx.summary_file)
+        ctx.git.stage_file(rfh_summary.install_viewer(ctx.config.publish_dir))
+    if ctx.report_manifest:
+        ctx.report_manifest.save()
+
+    if ctx.profile:
+        ctx.profile.save(ctx.profile_file)
+        ctx.git.stage_file(ctx.profile_file)
+
+
+def publish(ctx, push=True, background=False):
+    """
+    Publish every report staged since the last call, in one commit
+    """
+    start = time.perf_counter()
+    ctx.git.publish_staged(push=push, background=background)
+    if ctx.profile:
+        print(f"Publishing took {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,297 @@
+// Viewer for the JSON summaries written when REPORT_FORMAT = "json" (see rfh_summary.py). Draws
+// each variable's boxplots as SVG in the browser, and lets variables be filtered and sorted.
+"use strict";
+
+const SVG_NS = "http://www.w3.org/2000/svg";
+const PLOT = { width: 520, height: 300, left: 80, right: 16, top: 28, bottom: 44 };
+const MEDIAN_COLOR = "#ff7f0e";
+
+function rfhView(summaryUrl, containerId) {
+  const container = document.getElementById(containerId);
+  fetch(summaryUrl)
+    .then((response) => {
+      if (!response.ok) {
+        throw new Error(`${response.status} ${response.statusText}`);
+      }
+      return response.json();
+    })
+    .then((summary) => rfhRender(container, summary))
+    .catch((err) => {
+      container.textContent = `Couldn't load ${summaryUrl}: ${err}`;
+    });
+}
+
+function fmt(x, digits) {
+  return x === null ? "NaN" : Number(x).toPrecision(digits);
+}
+
+function fmtPct(x) {
+  return x === null ? "NaN" : `${Number(x).toFixed(1)}%`;
+}
+
+function isFailing(v) {
+  return v.isclose.some((ok) => !ok);
+}
+
+// Largest of a variable's values across testsets, ignoring NaN (null)
+function worstOf(values) {
+  const finite = values.filter((x) => x !== null);
+  return finite.length ? Math.max(...finite) : -Infinity;
+}
+
+function el(tag, attrs, text) {
+  const node = document.createElement(tag);
+  Object.entries(attrs || {}).forEach(([k, v]) => node.setAttribute(k, v));
+  if (text !== undefined) {
+    node.textContent = text;
+  }
+  return node;
+}
+
+function svgEl(tag, attrs, text) {
+  const node = document.createElementNS(SVG_NS, tag);
+  Object.entries(attrs || {}).forEach(([k, v]) => node.setAttribute(k, v));
+  if (text !== undefined) {
+    node.textContent = text;
+  }
+  return node;
+}
+
+// Same layout as matplotlib's bxp(): boxes from q1 to q3, a line at the median, whiskers to
+// whislo and whishi, and the outliers as circles
+function drawBoxplots(v, labels) {
+  const svg = svgEl("svg", {
+    width: PLOT.width,
+    height: PLOT.height,
+    viewBox: `0 0 ${PLOT.width} ${PLOT.height}`,
+  });
+  const innerWidth = PLOT.width - PLOT.left - PLOT.right;
+  const innerHeight = PLOT.height - PLOT.top - PLOT.bottom;
+
+  let lo = Infinity;
+  let hi = -Infinity;
+  v.boxstats.forEach((b) => {
+    if (b.n === 0) {
+      return;
+    }
+    lo = Math.min(lo, b.whislo, ...b.fliers);
+    hi = Math.max(hi, b.whishi, ...b.fliers);
+  });
+  if (lo === hi) {
+    const pad = lo === 0 ? 1 : Math.abs(lo) * 0.1;
+    lo -= pad;
+    hi += pad;
+  }
+  const margin = (hi - lo) * 0.05;
+  lo -= margin;
+  hi += margin;
+  const y = (value) => PLOT.top + ((hi - value) / (hi - lo)) * innerHeight;
+
+  svg.appendChild(svgEl("text", { x: PLOT.width / 2, y: 16, "text-anchor": "middle" }, v.label));
+
+  // Y axis, with ticks
+  const axis = svgEl("g", { stroke: "black", "font-size": "11" });
+  axis.appendChild(
+    svgEl("line", { x1: PLOT.left, x2: PLOT.left, y1: PLOT.top, y2: PLOT.top + innerHeight })
+  );
+  for (let t = 0; t <= 4; t++) {
+    const value = lo + ((hi - lo) * t) / 4;
+    axis.appendChild(
+      svgEl("line", { x1: PLOT.left - 4, x2: PLOT.left, y1: y(value), y2: y(value) })
+    );
+    axis.appendChild(
+      svgEl(
+        "text",
+        { x: PLOT.left - 6, y: y(value) + 4, "text-anchor": "end", stroke: "none" },
+        Number(value.toPrecision(3)).toString()
+      )
+    );
+  }
+  svg.appendChild(axis);
+  const yMid = PLOT.top + innerHeight / 2;
+  svg.appendChild(
+    svgEl(
+      "text",
+      {
+        x: 14,
+        y: yMid,
+        transform: `rotate(-90 14 ${yMid})`,
+        "text-anchor": "middle",
+        "font-size": "12",
+      },
+      `discrepancy (${v.units})`
+    )
+  );
+
+  const slot = innerWidth / v.boxstats.length;
+  v.boxstats.forEach((b, i) => {
+    const x = PLOT.left + slot * (i + 0.5);
+    const half = slot * 0.25;
+    svg.appendChild(
+      svgEl(
+        "text",
+        { x, y: PLOT.height - 16, "text-anchor": "middle", "font-size": "12" },
+        labels[i]
+      )
+    );
+    if (b.n === 0) {
+      return;
+    }
+    const g = svgEl("g", { stroke: "black", fill: "none" });
+    const title = `n = ${b.n} (${b.n_nan} NaN), median = ${fmt(b.med, 4)}, ` +
+      `IQR = [${fmt(b.q1, 4)}, ${fmt(b.q3, 4)}], ${b.n_fliers} outliers`;
+    g.appendChild(svgEl("title", {}, title));
+    g.appendChild(
+      svgEl("rect", {
+        x: x - half,
+        y: y(b.q3),
+        width: 2 * half,
+        height: Math.max(y(b.q1) - y(b.q3), 0.5),
+      })
+    );
+    g.appendChild(svgEl("line", { x1: x, x2: x, y1: y(b.q3), y2: y(b.whishi) }));
+    g.appendChild(svgEl("line", { x1: x, x2: x, y1: y(b.q1), y2: y(b.whislo) }));
+    [b.whislo, b.whishi].forEach((w) => {
+      g.appendChild(
+        svgEl("line", { x1: x - half / 2, x2: x + half / 2, y1: y(w), y2: y(w) })
+      );
+    });
+    g.appendChild(
+      svgEl("line", {
+        x1: x - half,
+        x2: x + half,
+        y1: y(b.med),
+        y2: y(b.med),
+        stroke: MEDIAN_COLOR,
+      })
+    );
+    b.fliers.forEach((f) => {
+      g.appendChild(svgEl("circle", { cx: x, cy: y(f), r: 2.5 }));
+    });
+    svg.appendChild(g);
+  });
+  return svg;
+}
+
+function makeCard(v, summary) {
+  const card = el("div", { class: "rfh-variable" });
+  const emojis = v.isclose.map((ok) => (ok ? "✅" : "❌")).join(" → ");
+  card.appendChild(el("hr"));
+  card.appendChild(el("h2", {}, `${emojis} ${v.label}`));
+
+  const lines = [];
+  lines.push(`max abs diff = ${v.max_abs_diff.map((x) => fmt(x, 3)).join(" → ")}`);
+  lines.push(`max rel diff = ${v.max_pct_diff.map(fmtPct).join(" → ")}`);
+  if (v.wtd_max_abs_diff.every((x) => x === null)) {
+    lines.push(`${v.weights}-weighted mean: not checked`);
+  } else {
+    const wtdEmojis = v.wtd_isclose.map((ok) => (ok ? "✅" : "❌")).join(" → ");
+    lines.push(
+      `${wtdEmojis} ${v.weights}-weighted mean: ` +
+        `max abs diff = ${v.wtd_max_abs_diff.map((x) => fmt(x, 3)).join(" → ")}, ` +
+        `max rel diff = ${v.wtd_max_pct_diff.map(fmtPct).join(" → ")}`
+    );
+  }
+  lines.forEach((line) => card.appendChild(el("div", {}, line)));
+
+  // Where the worst discrepancies are, for testsets where the check failed
+  v.worst.forEach((worst, i) => {
+    if (v.isclose[i] || worst === null || worst.diff.length === 0) {
+      return;
+    }
+    // The other testsets' discrepancies at the same points
+    const elsewhere = [];
+    if (v.worst_elsewhere) {
+      v.worst_elsewhere[i].forEach((diffs, k) => {
+        if (diffs !== null) {
+          elsewhere.push({ dir: summary.testsets[k].dir, diffs });
+        }
+      });
+    }
+    const details = el("details");
+    details.appendChild(
+      el("summary", {}, `Worst ${worst.diff.length} points in ${summary.testsets[i].dir}`)
+    );
+    const table = el("table");
+    const header = el("tr");
+    worst.dims
+      .concat(["sum", "non-per-age", "diff"], elsewhere.map((e) => `diff in ${e.dir}`))
+      .forEach((h) => {
+        header.appendChild(el("th", {}, h));
+      });
+    table.appendChild(header);
+    worst.diff.forEach((diff, j) => {
+      const row = el("tr");
+      worst.dims.forEach((dim) => row.appendChild(el("td", {}, fmt(worst.coords[dim][j], 4))));
+      row.appendChild(el("td", {}, fmt(worst.sum[j], 6)));
+      row.appendChild(el("td", {}, fmt(worst.ref[j], 6)));
+      row.appendChild(el("td", {}, fmt(diff, 3)));
+      elsewhere.forEach((e) => row.appendChild(el("td", {}, fmt(e.diffs[j], 3))));
+      table.appendChild(row);
+    });
+    details.appendChild(table);
+    card.appendChild(details);
+  });
+
+  const labels = summary.testsets.map(
+    (t, i) => `${t.label === null ? String(i) : t.label} ${v.isclose[i] ? "✓" : "X"}`
+  );
+  card.appendChild(drawBoxplots(v, labels));
+  return card;
+}
+
+const COMPARATORS = {
+  order: (a, b) => a.index - b.index,
+  failing: (a, b) => isFailing(b.v) - isFailing(a.v) || a.index - b.index,
+  max_abs_diff: (a, b) => worstOf(b.v.max_abs_diff) - worstOf(a.v.max_abs_diff),
+  max_pct_diff: (a, b) => worstOf(b.v.max_pct_diff) - worstOf(a.v.max_pct_diff),
+  name: (a, b) => a.v.name.localeCompare(b.v.name),
+};
+
+function rfhRender(container, summary) {
+  const controls = el("div", { class: "rfh-controls" });
+  const filter = el("input", { type: "search", placeholder: "Filter variables" });
+  const failingOnly = el("input", { type: "checkbox" });
+  const sort = el("select");
+  [
+    ["order", "file order"],
+    ["failing", "failing first"],
+    ["max_abs_diff", "max abs diff"],
+    ["max_pct_diff", "max rel diff"],
+    ["name", "name"],
+  ].forEach(([value, text]) => sort.appendChild(el("option", { value }, text)));
+  const count = el("span");
+  const failingLabel = el("label");
+  failingLabel.append(failingOnly, " Failing only");
+  const sortLabel = el("label");
+  sortLabel.append("Sort by ", sort);
+  controls.append(filter, " ", failingLabel, " ", sortLabel, " ", count);
+
+  // Cards are only drawn when first shown
+  const entries = summary.variables.map((v, index) => ({ v, index, card: null }));
+  const list = el("div");
+  container.replaceChildren(controls, list);
+
+  function update() {
+    const text = filter.value.toUpperCase();
+    const shown = entries.filter(
+      (e) =>
+        e.v.name.toUpperCase().includes(text) && (!failingOnly.checked || isFailing(e.v))
+    );
+    shown.sort(COMPARATORS[sort.value]);
+    list.replaceChildren(
+      ...shown.map((e) => {
+        if (e.card === null) {
+          e.card = makeCard(e.v, summary);
+        }
+        return e.card;
+      })
+    );
+    const nFailing = entries.filter((e) => isFailing(e.v)).length;
+    count.textContent = `${shown.length} of ${entries.length} variables shown; ${nFailing} failing`;
+  }
+  filter.addEventListener("input", update);
+  failingOnly.addEventListener("change", update);
+  sort.addEventListener("change", update);
+  update();
+}
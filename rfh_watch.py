@@ -0,0 +1,171 @@
+"""
+Class for watching testsets and checking each test once its history files are done being written
+"""
+# pylint: disable=invalid-name
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=fixme
+
+import os
+import time
+import traceback
+
+import rfh_utils
+
+# Statuses of a CIME test phase that mean it's over
+DONE_STATUSES = ("PASS", "FAIL")
+
+
+def get_run_status(test_dir):
+    """
+    Get the status (e.g., "PEND", "PASS", or "FAIL") of the RUN phase from the TestStatus file
+    CIME keeps in a test's directory: None if the phase isn't listed yet, or "unknown" if there's
+    no TestStatus (e.g., a copy of a test's outputs made outside of CIME)
+    """
+    try:
+        with open(os.path.join(test_dir, "TestStatus")) as f:
+            for line in f:
+                words = line.split()
+                if len(words) >= 3 and words[2] == "RUN":
+                    return words[0]
+    except FileNotFoundError:
+        return "unknown"
+    return None
+
+
+class Rfh_Watch:
+    """
+    Polls every test in a set of comparisons (each a test name and a list of testset directories,
+    as in check_AP_batch.py). A test is analyzed once it has finished: once the RUN phase in its
+    TestStatus has passed or failed, so that reports never show a partial run. (Tests without a
+    TestStatus are analyzed once their last history file has stopped changing for
+    ctx.config.watch_settle_seconds.) A test is analyzed again if its last history file changes
+    after that, e.g., because it was rerun. Analyses stay in memory, so a baseline testset is only
+    loaded and analyzed once, however many comparisons it's in and however long the watch runs.
+    Whenever a comparison has a new analysis and all of its testsets have been analyzed, its
+    report is rewritten, and then published with any others rewritten in the same poll.
+
+    Errors analyzing a test or writing a report are logged, and the watch carries on; a test that
+    failed to analyze is retried once its last history file changes.
+    """
+
+    def __init__(self, ctx, comparisons):
+        self.ctx = ctx
+        self.comparisons = comparisons
+
+        # (test name, testset directory): (last history file, size, mtime) that was analyzed, and
+        # the output of rfh_utils.analyze_testset()
+        self.analyzed = {}
+
+        # (test name, testset directory): (last history file, size, mtime) that failed to analyze
+        self.failed = {}
+
+    def get_keys(self):
+        keys = []
+        for test_name, testset_dir_list in self.comparisons:
+            for testset_dir in testset_dir_list:
+                if (test_name, testset_dir) not in keys:
+                    keys.append((test_name, testset_dir))
+        return keys
+
+    def get_last_file_state(self, test_name, testset_dir):
+        file_list = rfh_utils.find_history_files(self.ctx, testset_dir, test_name)
+        if not file_list:
+            return None
+        try:
+            stat = os.stat(file_list[-1])
+        except FileNotFoundError:
+            return None
+        return (file_list[-1], stat.st_size, stat.st_mtime_ns)
+
+    def is_done(self, state, now):
+        """
+        Whether a test whose last history file is in the given state has finished running
+        """
+        history_file, _, mtime_ns = state
+        run_status = get_run_status(os.path.dirname(os.path.dirname(history_file)))
+        if run_status == "unknown":
+            return now - mtime_ns / 1e9 >= self.ctx.config.watch_settle_seconds
+        return run_status in DONE_STATUSES
+
+    def poll(self):
+        """
+        Check every test once, analyzing any that are ready and writing any reports that need it.
+        Returns how many reports were written.
+        """
+        now = time.time()
+        updated = set()
+        for key in self.get_keys():
+            state = self.get_last_file_state(*key)
+            if state is None or (key in self.analyzed and self.analyzed[key][0] == state):
+                continue
+            if self.failed.get(key) == state or not self.is_done(state, now):
+                continue
+
+            test_name, testset_dir = key
+            print(f"Analyzing {test_name} in {testset_dir} ({os.path.basename(state[0])})")
+            try:
+                analysis = rfh_utils.analyze_testset(self.ctx, testset_dir, test_name)
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
+                print(f"Failed to analyze {test_name} in {testset_dir}; will retry if it changes")
+                self.failed[key] = state
+                continue
+            self.failed.pop(key, None)
+            self.analyzed[key] = (state, analysis)
+            updated.add(key)
+
+        n_reports = 0
+        for test_name, testset_dir_list in self.comparisons:
+            keys = [(test_name, testset_dir) for testset_dir in testset_dir_list]
+            if not updated.intersection(keys) or not all(k in self.analyzed for k in keys):
+                continue
+            self.ctx.start_comparison(test_name, testset_dir_list)
+            analyses = [self.analyzed[k][1] for k in keys]
+            try:
+                (
+                    datasets,
+                    dict_perage_to_non_equiv,
+                    missing_var_lists,
+                    nonperage_missing,
+                ) = rfh_utils.combine_analyses(self.ctx, analyses)
+                rfh_utils.write_report(
+                    self.ctx,
+                    datasets,
+                    dict_perage_to_non_equiv,
+                    missing_var_lists,
+                    nonperage_missing,
+                )
+                rfh_utils.finish_report(self.ctx)
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
+                print(f"Failed to write the report for {test_name} in {testset_dir_list}")
+                self.ctx.close()
+
+                # Don't leave a partial report where it would block publishing the others
+                if os.path.exists(self.ctx.logfile):
+                    os.remove(self.ctx.logfile)
+                continue
+            n_reports += 1
+        return n_reports
+
+    def run(self, max_polls=None, push=True):
+        """
+        Poll every ctx.config.watch_poll_seconds, publishing after any poll that wrote reports.
+        Runs until interrupted, or for max_polls polls if given.
+        """
+        n_polls = 0
+        while True:
+            start = time.monotonic()
+            if self.poll():
+                try:
+                    rfh_utils.publish(
+                        self.ctx, push=push, background=self.ctx.config.push_in_background
+                    )
+                except Exception:  # pylint: disable=broad-exception-caught
+                    traceback.print_exc()
+                    print("Failed to publish; will try again after the next report")
+            n_polls += 1
+            if max_polls is not None and n_polls >= max_polls:
+                break
+            time.sleep(max(0, self.ctx.config.watch_poll_seconds - (time.monotonic() - start)))
@@ -8,8 +8,12 @@ Functions useful for writing to HTML file
 # pylint: disable=fixme
 
 import base64
-from io import BytesIO
-import matplotlib.pyplot as plt
+import hashlib
+import math
+import os
+import threading
+
+from rfh_files import open_atomic
 
 # Per-age variables that I added for diagnostic purposes
 MY_ADDED_DIAGNOSTICS = [
@@ -32,26 +36,115 @@ MY_ADDED_DIAGNOSTICS_NONPERAGE = [
     "FATES_ZSTAR",
 ]
 
+SPARKLINE_CHARS = "▁▂▃▄▅▆▇█"
+
+MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml", "webp": "image/webp"}
+
+# The report's sections, in order. Each section's content is ordered by an index within it.
+SECTION_FRONT_MATTER = 0
+SECTION_TESTSETS = 1
+SECTION_RESULTS = 2
+SECTION_END = 3
+SECTION_PERFORMANCE = 4
+
+# How many of the slowest variables to list in the performance section
+N_SLOWEST_VARIABLES = 20
+
+
+def sparkline(values):
+    """
+    Unicode sparkline of some values, on a log scale. Zeros get the lowest bar; NaNs get a space.
+    """
+    logs = [math.log10(v) if v > 0 else None for v in values]
+    finite_logs = [x for x in logs if x is not None]
+    lo = min(finite_logs, default=0)
+    span = max(finite_logs, default=0) - lo
+    chars = []
+    for v, x in zip(values, logs):
+        if math.isnan(v):
+            chars.append(" ")
+        elif x is None or span == 0:
+            chars.append(SPARKLINE_CHARS[0 if x is None else -1])
+        else:
+            i = round((x - lo) / span * (len(SPARKLINE_CHARS) - 1))
+            chars.append(SPARKLINE_CHARS[i])
+    return "".join(chars)
+
+
+def fmt_mb(mb, spec=".0f"):
+    """
+    Format an amount of memory in MB, or "?" if it's unknown (e.g., not on Linux)
+    """
+    return "?" if mb is None else format(mb, spec)
+
 
 class Rfh_Write:
-    def __init__(self, logfile, testset_dir_basename_list, thisrepo_url):
+    def __init__(
+        self,
+        logfile,
+        testset_dir_basename_list,
+        thisrepo_url,
+        plot_format="png",
+        plot_assets_subdir=None,
+    ):
         self.logfile = logfile
         self.testset_dir_basename_list = testset_dir_basename_list
         self.thisrepo_url = thisrepo_url
 
+        # If plot_assets_subdir is given, plots are saved there (relative to the log file) instead
+        # of being embedded in the HTML
+        self.plot_format = plot_format
+        self.plot_assets_subdir = plot_assets_subdir
+
+        # The document is built in memory and only written to logfile by flush(). It's a dict of
+        # (section, index): list of HTML strings, so content can be added in any order.
+        self.chunks = {}
+        self.current_key = (SECTION_FRONT_MATTER, 0)
+        self.lock = threading.Lock()
+
+    def begin_section(self, section, index=0):
+        """
+        Direct subsequent writes to the given section (one of the SECTION_* constants) at the
+        given index within it
+        """
+        self.current_key = (section, index)
+
+    def add_section(self, section, index, html):
+        """
+        Add HTML to a section at the given index, regardless of the current section. Safe to call
+        from multiple threads.
+        """
+        with self.lock:
+            self.chunks.setdefault((section, index), []).append(html)
+
+    def get_section(self, section, index=0):
+        with self.lock:
+            return "".join(self.chunks.get((section, index), []))
+
+    def write(self, html):
+        self.add_section(*self.current_key, html)
+
+    def flush(self):
+        """
+        Write the whole document to logfile in one go. Atomic: The file either has the complete
+        document or is unchanged.
+        """
+        with self.lock:
+            document = "".join("".join(self.chunks[key]) for key in sorted(self.chunks))
+        with open_atomic(self.logfile) as f:
+            f.write(document)
+
     def add_end_text(
         self,
         nonperage_missing,
-        too_many_duplexed,
         missing_var_lists,
         all_nan,
         no_boxdata,
     ):
-        with open(self.logfile, "a") as f:
-            f.write("<hr>\n")
-            f.write("<h2>Other</h2>\n")
+        self.begin_section(SECTION_END)
+        self.write("<hr>\n")
+        self.write("<h2>Other</h2>\n")
         self.log_ul("🤷 Non-per-age equivalent not in Dataset", nonperage_missing)
-        self.log_ul("🤷 Too many (> 2) duplexed dimensions", too_many_duplexed)
         self.log_ul("🤷 All data NaN", all_nan)
         self.log_ul("🤷 No included data", no_boxdata)
         for i, missing_var_list in enumerate(missing_var_lists):
@@ -66,13 +159,12 @@ class Rfh_Write:
         perage_var,
         this_dict,
         var_to_print,
-        comparing_2,
+        comparing,
     ):
         emojis = " → ".join(this_dict["isclose_emoji"])
 
-        with open(self.logfile, "a") as f:
-            f.write("<hr>\n")
-            f.write(f"<h2>{emojis} {var_to_print}</h2>\n")
+        self.write("<hr>\n")
+        self.write(f"<h2>{emojis} {var_to_print}</h2>\n")
         print(f"{emojis} {var_to_print}:")
 
         # Note variables that I added for diagnostic purposes
@@ -85,26 +177,132 @@ class Rfh_Write:
 
         max_abs_diff = this_dict["max_abs_diff"]
         max_pct_diff = this_dict["max_pct_diff"]
-        if not comparing_2 or (
-            max_abs_diff[0] == max_abs_diff[1] and max_pct_diff[0] == max_pct_diff[1]
+        if not comparing or (
+            all(x == max_abs_diff[0] for x in max_abs_diff)
+            and all(x == max_pct_diff[0] for x in max_pct_diff)
         ):
             self.log_br(f"     max abs diff = {max_abs_diff[0]:.3g}")
             self.log_br(f"     max rel diff = {max_pct_diff[0]:.1f}%")
         else:
             self.log_br(
-                f"     max abs diff = {max_abs_diff[0]:.3g} → {max_abs_diff[1]:.3g}",
+                "     max abs diff = " + " → ".join(f"{x:.3g}" for x in max_abs_diff),
             )
             self.log_br(
-                f"     max rel diff = {max_pct_diff[0]:.1f}% → {max_pct_diff[1]:.1f}%",
+                "     max rel diff = " + " → ".join(f"{x:.1f}%" for x in max_pct_diff),
             )
 
+        # The same check, but with the area-weighted mean across age classes instead of the sum.
+        # Only passes for variables saved as each age class's own value (see front matter).
+        wtd_max_abs_diff = this_dict["wtd_max_abs_diff"]
+        wtd_max_pct_diff = this_dict["wtd_max_pct_diff"]
+        if all(math.isnan(x) for x in wtd_max_abs_diff):
+            self.log_br(f"     {this_dict['weights']}-weighted mean: not checked")
+            return
+        wtd_emojis = " → ".join(this_dict["wtd_isclose_emoji"])
+        self.log_br(
+            f"     {wtd_emojis} {this_dict['weights']}-weighted mean"
+            + " (expected to fail if the sum passes):"
+        )
+        self.log_br(
+            "          max abs diff = " + " → ".join(f"{x:.3g}" for x in wtd_max_abs_diff),
+        )
+        self.log_br(
+            "          max rel diff = " + " → ".join(f"{x:.1f}%" for x in wtd_max_pct_diff),
+        )
+
+    def add_performance_text(self, profile):
+        """
+        Add a collapsed section with the time and memory each stage took, and the slowest
+        variables. Not printed to the terminal.
+        """
+        html = ["<hr>\n<details>\n<summary><b>Performance</b></summary>\n"]
+        html.append("<table>\n")
+        html.append(
+            "<tr><th>Stage</th><th>Calls</th><th>Wall (s)</th><th>CPU (s)</th>"
+            + "<th>Peak RSS (MB)</th><th>RSS growth (MB)</th></tr>\n"
+        )
+        for name, this_stage in profile.stages.items():
+            html.append(
+                f"<tr><td>{name}</td><td>{this_stage['calls']}</td>"
+                + f"<td>{this_stage['wall']:.3f}</td><td>{this_stage['cpu']:.3f}</td>"
+                + f"<td>{this_stage['peak_rss_mb']:.0f}</td>"
+                + f"<td>{fmt_mb(this_stage['rss_growth_mb'])}</td></tr>\n"
+            )
+        html.append("</table>\n")
+        html.append(
+            "<p>Peak RSS is the highest the RSS got during the stage, and RSS growth the most any"
+            + " call of the stage left the RSS higher than it found it.</p>\n"
+        )
+
+        slowest = profile.get_slowest_variables(N_SLOWEST_VARIABLES)
+        if slowest:
+            html.append(
+                f"<p>Slowest {len(slowest)} variables (wall seconds; then for each stage, wall"
+                + " and CPU seconds and RSS growth):\n<ol>\n"
+            )
+            for var, total, stages in slowest:
+                details = ", ".join(
+                    f"{name} {x['wall']:.3f} s / {x['cpu']:.3f} s CPU / "
+                    + f"{fmt_mb(x['rss_growth_mb'], '.1f')} MB"
+                    for name, x in stages.items()
+                )
+                html.append(f"<li>{var}: {total:.3f} ({details})</li>\n")
+            html.append("</ol>\n")
+        html.append("</details>\n")
+        self.add_section(SECTION_PERFORMANCE, 0, "".join(html))
+
+    def add_worst_text(self, worst, isclose, labels, worst_elsewhere=None):
+        """
+        List where a variable's largest discrepancies are (see rfh_utils.locate_worst_points()),
+        for each testset where it failed the check, along with the discrepancies of the other
+        testsets at the same points (see rfh_utils.add_worst_elsewhere())
+        """
+        for i, (this_worst, this_isclose, label) in enumerate(zip(worst, isclose, labels)):
+            if this_isclose or this_worst is None or len(this_worst["diff"]) == 0:
+                continue
+            elsewhere = []
+            if worst_elsewhere is not None:
+                elsewhere = [
+                    (other_label, diffs)
+                    for other_label, diffs in zip(labels, worst_elsewhere[i])
+                    if diffs is not None
+                ]
+            self.log_br(f"     Worst {len(this_worst['diff'])} points in {label}:")
+            for j, diff in enumerate(this_worst["diff"]):
+                where = ", ".join(
+                    f"{dim}={this_worst['coords'][dim][j]:.4g}" for dim in this_worst["dims"]
+                )
+                msg = (
+                    f"          {where}: sum = {this_worst['sum'][j]:.6g},"
+                    + f" non-per-age = {this_worst['ref'][j]:.6g}, diff = {diff:.3g}"
+                )
+                for other_label, diffs in elsewhere:
+                    msg += f"; diff in {other_label} = {diffs[j]:.3g}"
+                self.log_br(msg)
+
+    def add_timesteps_text(self, timesteps, labels):
+        """
+        Summarize a variable's running statistics over all timesteps, one line per testset
+        """
+        self.log_br("     All timesteps:")
+        for stats, label in zip(timesteps, labels):
+            msg = (
+                f"          {label}: max abs diff = {stats['max_abs_diff']:.3g},"
+                + f" max rel diff = {stats['max_pct_diff']:.1f}%,"
+                + f" {stats['n_over_tol']}/{stats['n_timesteps']} timesteps over tolerance"
+            )
+            if stats["first_over_tol"] is not None:
+                msg += f" (first: {stats['first_over_tol']})"
+            self.log_br(msg)
+            series = sparkline(stats["max_abs_diff_series"])
+            self.log_br(f'          <code title="max abs diff per timestep">{series}</code>')
+
     def log_br(self, msg):
         if "img src" not in msg:
             print(msg.replace("<p>", ""))
 
         msg += "<br>\n"
-        with open(self.logfile, "a") as f:
-            f.write(msg)
+        self.write(msg)
 
     def log_ul(self, title, items):
         if not items:
@@ -112,51 +310,66 @@ class Rfh_Write:
 
         print("\n     ".join([f"\n{title}"] + items))
 
-        with open(self.logfile, "a") as f:
-            f.write("<p>\n")
-            f.write(f"{title}:<br>\n")
-            f.write("<ul>\n")
-            for i in items:
-                f.write(f"<li>{i}</li>\n")
-            f.write("</ul>\n")
-
-    def log_plot(self):
-        # Convert plot to base64 string
-        buf = BytesIO()
-        plt.gcf().savefig(buf, format="png")
-        buf.seek(0)
-        plot_data = base64.b64encode(buf.read()).decode("utf8")
-        plt.close()
-
-        # Embed plot in HTML log message
-        plot_html = '<p><img src="data:image/png;base64,{}">'.format(plot_data)
+        self.write("<p>\n")
+        self.write(f"{title}:<br>\n")
+        self.write("<ul>\n")
+        for i in items:
+            self.write(f"<li>{i}</li>\n")
+        self.write("</ul>\n")
+
+    def log_plot(self, image):
+        if self.plot_assets_subdir is None:
+            # Convert plot to base64 string
+            plot_data = base64.b64encode(image).decode("utf8")
+
+            # Embed plot in HTML log message
+            mime_type = MIME_TYPES[self.plot_format]
+            plot_html = f'<p><img src="data:{mime_type};base64,{plot_data}">'
+        else:
+            plot_path = self.save_plot_asset(image)
+            plot_html = f'<p><img src="{plot_path}" loading="lazy">'
         self.log_br(plot_html)
-        buf.close()
-
-    def write_front_matter(self, test_name, comparing_2):
-        with open(self.logfile, "a") as f:
-            a = self.testset_dir_basename_list[0]
-            if comparing_2:
-                b = self.testset_dir_basename_list[1]
-                msg = f"<h1>Comparing NONwtd {a} and {b}</h1>\n"
-            else:
-                msg = f"<h1>{a}</h1>\n"
-            f.write(msg)
+
+    def save_plot_asset(self, image):
+        """
+        Save a plot in the assets directory, named by a hash of its contents, and return its path
+        relative to the log file. Identical plots (e.g., from other reports) are only saved once.
+        """
+        filename = hashlib.sha256(image).hexdigest()[:20] + "." + self.plot_format
+        relpath = os.path.join(self.plot_assets_subdir, filename)
+        path = os.path.join(os.path.dirname(self.logfile), relpath)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open_atomic(path, "wb") as f:
+                f.write(image)
+        return relpath
+
+    def write_front_matter(self, test_name, comparing):
+        self.begin_section(SECTION_FRONT_MATTER)
+        a = self.testset_dir_basename_list[0]
+        if comparing:
+            *others, b = self.testset_dir_basename_list
+            msg = f"<h1>Comparing NONwtd {', '.join(others)} and {b}</h1>\n"
+        else:
+            msg = f"<h1>{a}</h1>\n"
+        self.write(msg)
         self.log_br(f"Test: {test_name} <br>")
-        with open(self.logfile, "a") as f:
-            # pylint: disable=line-too-long
-            f.write("<b>How to read these plots</b><br>")
-            f.write(
-                "This webpage compares two runs of the above test, with different code versions noted below. Figures contain one boxplot for each test. The boxplots represent the difference between a per-ageclass variable (e.g., FATES_BURNFRAC_AP)---AFTER summing across the age-class axis---and its non-per-ageclass equivalent (e.g., FATES_BURNFRAC). Each data point in the boxplots represent one member of the non-per-ageclass array in the last saved timestep of the test. So for FATES_BURNFRAC each datapoint is a gridcell, whereas for FATES_VEGC_PF each is a PFT in a gridcell.<br><br>"
-            )
-            f.write(
-                "If a code version is behaving as expected, ideally all data points should be zero. In practice, because of rounding errors, this can't usually be achieved. Instead, we expect that the data points should be grouped more or less symmetrically around zero, with small absolute and relative differences. Here, ✅ indicates boxplots with all absolute values of absolute differences < 1e-9 and relative differences < 1e-8. Boxplots that do not meet those criteria are marked with ❌.<br><br>"
-            )
-            f.write(
-                "Yes, we really want the SUM across the age-class axis to match, even though in most cases what users want of the variable is each age-class's actual value. (If we were saving that, then in order to make the comparison, we would need to take the area-weighted mean across age classes.) We have this behavior because it allows for better preservation of numerical accuracy. <br><br>"
-            )
-            thisrepo_link = f'<a href="{self.thisrepo_url}">this repo</a>.'
-            f.write(
-                "This analysis was performed (and this webpage was published) using the code in "
-                + thisrepo_link
-            )
+        # pylint: disable=line-too-long
+        self.write("<b>How to read these plots</b><br>")
+        self.write(
+            "This webpage compares runs of the above test, with different code versions noted below. Figures contain one boxplot for each test. The boxplots represent the difference between a per-ageclass variable (e.g., FATES_BURNFRAC_AP)---AFTER summing across the age-class axis---and its non-per-ageclass equivalent (e.g., FATES_BURNFRAC). Each data point in the boxplots represent one member of the non-per-ageclass array in the last saved timestep of the test. So for FATES_BURNFRAC each datapoint is a gridcell, whereas for FATES_VEGC_PF each is a PFT in a gridcell.<br><br>"
+        )
+        self.write(
+            "If a code version is behaving as expected, ideally all data points should be zero. In practice, because of rounding errors, this can't usually be achieved. Instead, we expect that the data points should be grouped more or less symmetrically around zero, with small absolute and relative differences. Here, ✅ indicates boxplots with all absolute values of absolute differences < 1e-9 and relative differences < 1e-8. Boxplots that do not meet those criteria are marked with ❌.<br><br>"
+        )
+        self.write(
+            "Yes, we really want the SUM across the age-class axis to match, even though in most cases what users want of the variable is each age-class's actual value. (If we were saving that, then in order to make the comparison, we would need to take the area-weighted mean across age classes.) We have this behavior because it allows for better preservation of numerical accuracy. <br><br>"
+        )
+        self.write(
+            "Each variable also gets a second check, of the area-weighted mean across the age-class axis (weighted by FATES_PATCHAREA_AP, or FATES_CANOPYAREA_AP for the canopy conductances) instead of the sum. This check only passes for a variable that saves each age-class's actual value, so for variables saved as intended (passing the sum check above), ❌ on the weighted-mean check is expected. A variable that fails the sum check but passes the weighted-mean check has probably been saved as each age-class's actual value by mistake.<br><br>"
+        )
+        thisrepo_link = f'<a href="{self.thisrepo_url}">this repo</a>.'
+        self.write(
+            "This analysis was performed (and this webpage was published) using the code in "
+            + thisrepo_link
+        )
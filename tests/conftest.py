@@ -0,0 +1,122 @@
+"""
+Fixtures shared by the tests. The modules being tested live at the top of the repo, alongside the
+scripts that use them.
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from rfh_context import Rfh_Config, Rfh_Context  # noqa: E402
+import rfh_synthetic  # noqa: E402
+import rfh_utils  # noqa: E402
+
+TEST_NAME = "TEST"
+
+# Small enough that analyzing a testset takes a fraction of a second
+TESTSET_DEFAULTS = {"n_lat": 12, "n_lon": 16, "n_vars": 8}
+
+
+@pytest.fixture(name="test_name")
+def fixture_test_name():
+    return TEST_NAME
+
+
+@pytest.fixture(name="make_testset")
+def fixture_make_testset(tmp_path):
+    """
+    Function making (or remaking) synthetic testset i in tmp_path/testset<i>, with TEST_NAME
+    in it. Arguments are passed to rfh_synthetic.make_testset(), on top of TESTSET_DEFAULTS and a
+    seed of i. Returns the testset's directory.
+    """
+
+    def make_testset(i, **kwargs):
+        testset_dir = str(tmp_path / f"testset{i}")
+        rfh_synthetic.make_testset(
+            testset_dir, TEST_NAME, **{**TESTSET_DEFAULTS, "seed": i, **kwargs}
+        )
+        return testset_dir
+
+    return make_testset
+
+
+@pytest.fixture(name="make_testsets")
+def fixture_make_testsets(make_testset):
+    """
+    Function making a synthetic testset for each dict of arguments to make_testset. Returns their
+    directories.
+    """
+
+    def make_testsets(*kwargs_list):
+        return [make_testset(i, **kwargs) for i, kwargs in enumerate(kwargs_list)]
+
+    return make_testsets
+
+
+@pytest.fixture(name="publish_dir")
+def fixture_publish_dir(tmp_path):
+    publish_dir = str(tmp_path / "publish")
+    os.makedirs(publish_dir)
+    return publish_dir
+
+
+@pytest.fixture(name="make_config")
+def fixture_make_config(publish_dir):
+    """
+    Function making an Rfh_Config that publishes to publish_dir and plots in this process, with
+    any other settings given
+    """
+
+    def make_config(**kwargs):
+        return Rfh_Config(**{"publish_dir": publish_dir, "n_plot_workers": 1, **kwargs})
+
+    return make_config
+
+
+@pytest.fixture(name="analyze")
+def fixture_analyze(make_config):
+    """
+    Function analyzing TEST_NAME in a testset with the given settings. Returns the output of
+    rfh_utils.analyze_testset().
+    """
+
+    def analyze(testset_dir, **kwargs):
+        ctx = Rfh_Context(make_config(**kwargs))
+        return rfh_utils.analyze_testset(ctx, testset_dir, TEST_NAME)
+
+    return analyze
+
+
+@pytest.fixture(name="write_report")
+def fixture_write_report(make_config):
+    """
+    Function analyzing TEST_NAME in some testsets and writing out their comparison's report, with
+    the given settings. Returns the path of the finished report, and the results as given to
+    rfh_utils.write_report().
+    """
+
+    def write_report(testset_dir_list, **kwargs):
+        ctx = Rfh_Context(make_config(**kwargs))
+        ctx.start_comparison(TEST_NAME, testset_dir_list)
+        analyses = [
+            rfh_utils.analyze_testset(ctx, testset_dir, TEST_NAME)
+            for testset_dir in testset_dir_list
+        ]
+        datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing = (
+            rfh_utils.combine_analyses(ctx, analyses)
+        )
+        rfh_utils.write_report(
+            ctx, datasets, dict_perage_to_non_equiv, missing_var_lists, nonperage_missing
+        )
+        rfh_utils.finish_report(ctx)
+        report = os.path.join(
+            ctx.config.publish_dir, os.path.basename(ctx.logfile).replace("html.tmp", "html")
+        )
+        return report, dict_perage_to_non_equiv
+
+    return write_report
@@ -0,0 +1,41 @@
+"""
+Tests that cached results come back as they were computed, and are only reused when they match the
+current settings
+"""
+# pylint: disable=missing-function-docstring
+
+import pytest
+
+from rfh_incremental import get_fingerprint
+
+
+@pytest.fixture(name="testset_dir")
+def fixture_testset_dir(make_testset):
+    return make_testset(0, n_bad_vars=4)
+
+
+def test_cached_results_match(analyze, testset_dir, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    _, fresh, _ = analyze(testset_dir, cache_dir=cache_dir)
+    _, cached, _ = analyze(testset_dir, cache_dir=cache_dir)
+    assert sorted(cached) == sorted(fresh)
+    for perage_var, results in fresh.items():
+        assert get_fingerprint(cached[perage_var]) == get_fingerprint(results), perage_var
+
+
+def test_max_boxplot_fliers_not_reused(analyze, testset_dir, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    _, all_fliers, _ = analyze(testset_dir, cache_dir=cache_dir, max_boxplot_fliers=None)
+    _, capped, _ = analyze(testset_dir, cache_dir=cache_dir, max_boxplot_fliers=2)
+    n_fliers = [results[4]["fliers"].size for results in all_fliers.values()]
+    assert max(n_fliers) > 2
+    assert all(results[4]["fliers"].size <= 2 for results in capped.values())
+
+
+def test_top_k_worst_not_reused(analyze, testset_dir, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    analyze(testset_dir, cache_dir=cache_dir, top_k_worst=0)
+    _, results, _ = analyze(testset_dir, cache_dir=cache_dir, top_k_worst=3)
+    worst = [r[8] for r in results.values() if not r[3]]
+    assert worst
+    assert all(w is not None and w["diff"].size == 3 for w in worst)
@@ -0,0 +1,63 @@
+"""
+Tests of looking up testsets and history files in the catalog
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+import shutil
+
+import pytest
+
+from rfh_catalog import Rfh_Catalog
+from rfh_context import Rfh_Context
+import rfh_synthetic
+import rfh_utils
+
+
+@pytest.fixture(name="catalog_file")
+def fixture_catalog_file(make_testset, tmp_path):
+    """
+    Catalog of a campaign directory with one testset (testset0), saved and ready to be reloaded
+    """
+    make_testset(0, n_files=2)
+    catalog_file = str(tmp_path / "catalog.json")
+    catalog = Rfh_Catalog(catalog_file)
+    assert catalog.scan([str(tmp_path)]) == 1
+    catalog.save()
+    return catalog_file
+
+
+def test_lookup(catalog_file, tmp_path, test_name):
+    testset_dir = str(tmp_path / "testset0")
+    catalog = Rfh_Catalog(catalog_file)
+    assert catalog.get_testset(testset_dir)["label"] == "fates-abcdef01"
+    file_list = catalog.get_history_files(testset_dir, test_name)
+    assert [os.path.basename(f) for f in file_list] == [
+        f"{test_name}.clm2.h0.2000-01.nc",
+        f"{test_name}.clm2.h0.2001-01.nc",
+    ]
+    assert catalog.get_history_files(testset_dir, "OTHER") is None
+
+
+def test_new_history_file(catalog_file, make_config, tmp_path, test_name):
+    testset_dir = str(tmp_path / "testset0")
+    file_list = Rfh_Catalog(catalog_file).get_history_files(testset_dir, test_name)
+    new_file = file_list[-1].replace("2001-01", "2002-01")
+    shutil.copy(file_list[-1], new_file)
+
+    # The testset is still up to date, but its test isn't: searching finds the new file
+    catalog = Rfh_Catalog(catalog_file)
+    assert catalog.get_testset(testset_dir) is not None
+    assert catalog.get_history_files(testset_dir, test_name) is None
+    ctx = Rfh_Context(make_config(catalog_file=catalog_file))
+    assert rfh_utils.find_history_files(ctx, testset_dir, test_name) == file_list + [new_file]
+
+
+def test_new_test(catalog_file, tmp_path, test_name):
+    testset_dir = str(tmp_path / "testset0")
+    rfh_synthetic.make_testset(testset_dir, "OTHER", n_lat=4, n_lon=4, n_vars=2)
+
+    # The new test's history files could be any test's
+    catalog = Rfh_Catalog(catalog_file)
+    assert catalog.get_testset(testset_dir) is None
+    assert catalog.get_history_files(testset_dir, test_name) is None
@@ -0,0 +1,27 @@
+"""
+Tests of the checks of the sum and the area-weighted mean across age classes
+"""
+# pylint: disable=missing-function-docstring
+
+N_VARS = 12
+N_BAD_VARS = 2
+N_MEAN_VARS = 5
+
+
+def test_sum_and_weighted_mean(make_testset, analyze):
+    # Cycles through every kind of per-age variable, for each of which some are weighted means
+    testset_dir = make_testset(0, n_vars=N_VARS, n_bad_vars=N_BAD_VARS, n_mean_vars=N_MEAN_VARS)
+    _, results, _ = analyze(testset_dir)
+    assert len(results) == N_VARS
+
+    for i, perage_var in enumerate(sorted(results)):
+        _, max_abs, _, isclose, _, wtd_max_abs, _, wtd_isclose, _ = results[perage_var]
+        if i < N_BAD_VARS:
+            # Neither the sum nor the weighted mean matches
+            assert not isclose and not wtd_isclose, perage_var
+        elif i < N_BAD_VARS + N_MEAN_VARS:
+            # Saved as each age class's own value
+            assert not isclose and wtd_isclose and wtd_max_abs == 0, perage_var
+        else:
+            # Saved as intended
+            assert isclose and max_abs == 0 and not wtd_isclose, perage_var
@@ -0,0 +1,114 @@
+"""
+Tests that duplexed dimensions are unfolded the way FATES folds them
+"""
+# pylint: disable=missing-function-docstring
+
+import itertools
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from rfh_compare import compare_group
+from rfh_deduplex import DUPLEXED_DIMS, get_deduplexed_dims
+import rfh_utils
+
+# Distinct lengths, so that mixing up two components can't go unnoticed
+SIZES = {"fates_levage": 3, "fates_levscls": 4, "fates_levpft": 2, "fates_levfuel": 5}
+
+# FATES's own formulas (see FatesHistoryInterfaceMod and FatesInterfaceTypesMod) for the 1-based
+# index along each duplexed dimension, given 1-based indices along its components. Written out
+# here rather than derived from DUPLEXED_DIMS, so that the table is checked against them.
+NAGE = SIZES["fates_levage"]
+NSCLS = SIZES["fates_levscls"]
+FATES_INDEX = {
+    "fates_levagefuel": lambda c: c["fates_levage"] + (c["fates_levfuel"] - 1) * NAGE,
+    "fates_levagepft": lambda c: c["fates_levage"] + (c["fates_levpft"] - 1) * NAGE,
+    "fates_levscag": lambda c: c["fates_levscls"] + (c["fates_levage"] - 1) * NSCLS,
+    "fates_levscagpf": lambda c: (
+        c["fates_levscls"]
+        + (c["fates_levage"] - 1) * NSCLS
+        + (c["fates_levpft"] - 1) * NSCLS * NAGE
+    ),
+    "fates_levscpf": lambda c: c["fates_levscls"] + (c["fates_levpft"] - 1) * NSCLS,
+}
+
+# The components of each duplexed dimension, from their names rather than from DUPLEXED_DIMS
+COMPONENTS = {
+    "fates_levagefuel": ["fates_levage", "fates_levfuel"],
+    "fates_levagepft": ["fates_levage", "fates_levpft"],
+    "fates_levscag": ["fates_levscls", "fates_levage"],
+    "fates_levscagpf": ["fates_levscls", "fates_levage", "fates_levpft"],
+    "fates_levscpf": ["fates_levscls", "fates_levpft"],
+}
+
+# Each per-age dimension and the dimension of its variables' non-per-age equivalents
+PERAGE_TO_NON_AGE_DIM = {
+    "fates_levagefuel": "fates_levfuel",
+    "fates_levagepft": "fates_levpft",
+    "fates_levscag": "fates_levscls",
+    "fates_levscagpf": "fates_levscpf",
+}
+
+
+def get_components(dim):
+    """
+    Every combination of 1-based indices along a (possibly duplexed) dimension's components, as
+    dicts of component dimension: index
+    """
+    components = COMPONENTS.get(dim, [dim])
+    for indices in itertools.product(*[range(1, SIZES[d] + 1) for d in components]):
+        yield dict(zip(components, indices))
+
+
+def fill_fates_style(dim, value):
+    """
+    Make an array along a (possibly duplexed) dimension, putting value(components) where FATES
+    would put it
+    """
+    n = int(np.prod([SIZES[d] for d in COMPONENTS.get(dim, [dim])]))
+    values = np.full(n, np.nan)
+    for c in get_components(dim):
+        index = FATES_INDEX[dim](c) if dim in FATES_INDEX else c[dim]
+        values[index - 1] = value(c)
+    assert not np.isnan(values).any()
+    return values
+
+
+def make_dataset(perage_dim, non_age_dim):
+    # A value unique to each point, so that any misplaced point changes the sums
+    def value(c):
+        return sum(10 ** (3 * i) * c.get(d, 0) for i, d in enumerate(sorted(SIZES)))
+
+    def summed(c):
+        return sum(value({**c, "fates_levage": age}) for age in range(1, NAGE + 1))
+
+    coords = {d: (d, np.arange(1, n + 1)) for d, n in SIZES.items()}
+    return xr.Dataset(
+        {
+            "FATES_X_AP": ((perage_dim,), fill_fates_style(perage_dim, value)),
+            "FATES_X": ((non_age_dim,), fill_fates_style(non_age_dim, summed)),
+        },
+        coords=coords,
+    )
+
+
+def test_every_duplexed_dim_checked():
+    assert set(FATES_INDEX) == set(COMPONENTS) == set(DUPLEXED_DIMS)
+    for dim, components in DUPLEXED_DIMS.items():
+        assert sorted(components) == sorted(COMPONENTS[dim])
+
+
+@pytest.mark.parametrize("perage_dim", PERAGE_TO_NON_AGE_DIM)
+def test_unfolded_sums(perage_dim):
+    ds = make_dataset(perage_dim, PERAGE_TO_NON_AGE_DIM[perage_dim])
+    da_ap = ds["FATES_X_AP"]
+    da = ds["FATES_X"]
+    ap_dims, ap_shape = get_deduplexed_dims(da_ap, ds.sizes)
+    _, shape = get_deduplexed_dims(da, ds.sizes)
+
+    # Unfold and sum across age classes the way the analysis does
+    ap_stack, ref_stack = rfh_utils.stack_batch([("FATES_X_AP", da, da_ap, shape)], ap_shape)
+    results = compare_group(ap_stack, ref_stack, ap_dims.index("fates_levage") + 1)
+    assert results["max_abs_diff"][0] == 0
+    assert results["isclose"][0]
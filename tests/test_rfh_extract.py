@@ -0,0 +1,49 @@
+"""
+Tests of keeping local extracts of history files
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+
+import numpy as np
+import xarray as xr
+
+from rfh_catalog import glob_history_files
+from rfh_extract import Rfh_Extract_Store
+
+
+def test_extract_matches_history_file(make_testset, analyze, tmp_path, test_name):
+    extract_dir = str(tmp_path / "extracts")
+    testset_dir = os.path.realpath(make_testset(0))
+    analyze(testset_dir, extract_dir=extract_dir)
+
+    history_file = glob_history_files(testset_dir, test_name)[-1]
+    with xr.open_dataset(history_file) as ds:
+        ds = ds.isel(time=-1)
+        with Rfh_Extract_Store(extract_dir).open(history_file) as extract:
+            assert sorted(extract.data_vars) == sorted(ds.data_vars)
+            for name, da in extract.data_vars.items():
+                np.testing.assert_array_equal(da.values, ds[name].values, err_msg=name)
+
+
+def test_changed_history_file_extracted_again(make_testset, analyze, tmp_path, test_name):
+    extract_dir = str(tmp_path / "extracts")
+    testset_dir = os.path.realpath(make_testset(0))
+    _, results, _ = analyze(testset_dir, extract_dir=extract_dir)
+    assert all(r[3] for r in results.values())
+
+    store = Rfh_Extract_Store(extract_dir)
+    history_file = glob_history_files(testset_dir, test_name)[-1]
+    assert store.open(history_file) is not None
+    old_extract_dir = store.get_extract_dir(history_file)
+
+    # Rewritten in place, now with discrepancies: the old extract mustn't be used
+    make_testset(0, n_bad_vars=2)
+    assert store.open(history_file) is None
+    _, results, _ = analyze(testset_dir, extract_dir=extract_dir)
+    assert sum(not r[3] for r in results.values()) == 2
+
+    # Only the new extract is kept
+    assert not os.path.exists(old_extract_dir)
+    new_extract_dir = store.get_extract_dir(history_file)
+    assert os.listdir(store.extracts_dir) == [os.path.basename(new_extract_dir)]
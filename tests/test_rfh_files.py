@@ -0,0 +1,34 @@
+"""
+Tests of keying saved data on files, and of writing files atomically
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+
+import pytest
+
+from rfh_files import TMP_SUFFIX, get_file_key, open_atomic, write_json
+
+
+def test_file_key_changes_with_file(tmp_path):
+    path = str(tmp_path / "file.nc")
+    write_json(path, [1])
+    key = get_file_key(path)
+    assert get_file_key(path) == key
+    assert get_file_key(path, "settings") != key
+
+    # Same path, but a new size and modification time
+    write_json(path, [1, 2])
+    assert get_file_key(path) != key
+
+
+def test_failed_write_leaves_file_unchanged(tmp_path):
+    path = str(tmp_path / "file.json")
+    write_json(path, {"a": 1})
+    with pytest.raises(RuntimeError):
+        with open_atomic(path) as f:
+            f.write("partial")
+            raise RuntimeError("interrupted")
+    with open(path) as f:
+        assert f.read() == '{"a": 1}'
+    assert not os.path.exists(path + TMP_SUFFIX)
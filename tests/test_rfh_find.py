@@ -0,0 +1,49 @@
+"""
+Tests of finding a test's history files in a testset
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+
+import pytest
+
+from rfh_catalog import Rfh_Catalog, glob_history_files
+from rfh_context import Rfh_Config, Rfh_Context
+import rfh_synthetic
+import rfh_utils
+
+TEST_NAME = "SMS_Lm49.f10_f10_mg37.I2000Clm60Fates.derecho_intel.clm-FatesColdAllVars"
+
+
+@pytest.fixture(name="testset_dir")
+def fixture_testset_dir(tmp_path):
+    # Another test whose name starts with TEST_NAME, and whose history files sort after it
+    testset_dir = str(tmp_path / "testset")
+    rfh_synthetic.make_testset(testset_dir, TEST_NAME + "Monthly", n_lat=4, n_lon=4, n_vars=2)
+    rfh_synthetic.make_testset(testset_dir, TEST_NAME, n_lat=4, n_lon=4, n_vars=2)
+    return testset_dir
+
+
+def get_test_dirs(file_list):
+    return {os.path.basename(os.path.dirname(os.path.dirname(f))) for f in file_list}
+
+
+@pytest.mark.parametrize("source", ["search", "catalog", "extract store"])
+def test_only_this_test(tmp_path, testset_dir, source):
+    config = Rfh_Config(publish_dir=str(tmp_path))
+    if source == "catalog":
+        config.catalog_file = str(tmp_path / "catalog.json")
+        catalog = Rfh_Catalog(config.catalog_file)
+        catalog.scan([str(tmp_path)])
+        catalog.save()
+    elif source == "extract store":
+        config.extract_dir = str(tmp_path / "extracts")
+        # Saved by an older version, which also found the other test's files
+        file_list = glob_history_files(testset_dir, TEST_NAME)
+        file_list += glob_history_files(testset_dir, TEST_NAME + "Monthly")
+        Rfh_Context(config).extract_store.put_file_list(testset_dir, TEST_NAME, file_list)
+
+    for test_name in [TEST_NAME, TEST_NAME + "Monthly"]:
+        for _ in range(2):
+            file_list = rfh_utils.find_history_files(Rfh_Context(config), testset_dir, test_name)
+            assert get_test_dirs(file_list) == {test_name + ".synthetic"}
@@ -0,0 +1,96 @@
+"""
+Tests of publishing reports to a git repo, using a local bare repo as its remote
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+import shutil
+
+import pytest
+
+from benchmark_AP import make_publish_repo
+from rfh_git import Rfh_Git, parse_status_porcelain_z, run_git_cmd
+
+
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def get_remote_files(workdir):
+    remote_dir = os.path.join(workdir, "remote.git")
+    return run_git_cmd(["git", "--git-dir", remote_dir, "ls-tree", "-r", "--name-only", "HEAD"])
+
+
+def test_parse_status_porcelain_z():
+    status = "\0".join(
+        [
+            " M report.html",
+            "D  old.html",
+            "R  new name.html",
+            "old name.html",
+            "?? plots/ab.png",
+            "?? with space.html",
+            "",
+        ]
+    )
+    modified_files, new_files = parse_status_porcelain_z(status)
+    assert modified_files == ["report.html", "old.html", "new name.html"]
+    assert new_files == ["plots/ab.png", "with space.html"]
+
+
+def test_parse_status_porcelain_z_empty():
+    assert parse_status_porcelain_z("") == ([], [])
+
+
+def test_publish_staged(tmp_path):
+    publish_dir = make_publish_repo(str(tmp_path))
+    git = Rfh_Git(publish_dir, asset_subdirs=["plots"], publish_url="file://" + publish_dir + "/")
+
+    # A report, staged the way rfh_utils.finish_report() does, plus a plot asset
+    logfile = os.path.join(publish_dir, "NONwtd.a.b.TEST.html.tmp")
+    write_file(logfile, "<html></html>")
+    git.stage_report(logfile)
+    write_file(os.path.join(publish_dir, "plots", "ab.png"), "png")
+    git.publish_staged()
+
+    assert git.staged_reports == []
+    assert get_remote_files(str(tmp_path)) == [
+        "NONwtd.a.b.TEST.html",
+        "README.md",
+        "plots/ab.png",
+    ]
+    assert git.get_changed_files() == ([], [])
+
+
+def test_publish_staged_unexpected_change(tmp_path):
+    publish_dir = make_publish_repo(str(tmp_path))
+    git = Rfh_Git(publish_dir, publish_url="file://" + publish_dir + "/")
+    write_file(os.path.join(publish_dir, "README.md"), "Edited by hand\n")
+    with pytest.raises(RuntimeError, match="not clean"):
+        git.publish_staged()
+
+
+def test_publish_staged_background(tmp_path):
+    publish_dir = make_publish_repo(str(tmp_path))
+    git = Rfh_Git(publish_dir, publish_url="file://" + publish_dir + "/")
+    logfile = os.path.join(publish_dir, "NONwtd.a.b.TEST.html.tmp")
+    write_file(logfile, "<html></html>")
+    git.stage_report(logfile)
+    git.publish_staged(background=True)
+    git.wait_for_push()
+    assert git.push_process is None
+    assert "NONwtd.a.b.TEST.html" in get_remote_files(str(tmp_path))
+
+
+def test_failed_background_push_is_reported(tmp_path):
+    publish_dir = make_publish_repo(str(tmp_path))
+    git = Rfh_Git(publish_dir, publish_url="file://" + publish_dir + "/")
+    shutil.rmtree(os.path.join(str(tmp_path), "remote.git"))
+    logfile = os.path.join(publish_dir, "NONwtd.a.b.TEST.html.tmp")
+    write_file(logfile, "<html></html>")
+    git.stage_report(logfile)
+    git.publish_staged(background=True)
+    with pytest.raises(RuntimeError, match="Background push failed"):
+        git.wait_for_push()
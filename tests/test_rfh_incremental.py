@@ -0,0 +1,65 @@
+"""
+Tests that rerunning a comparison reuses every section of its report that hasn't changed
+"""
+# pylint: disable=missing-function-docstring
+
+import pytest
+import xarray as xr
+
+import rfh_utils
+
+
+@pytest.fixture(name="testset_dir_list")
+def fixture_testset_dir_list(make_testsets):
+    # Half the variables fail in the second testset
+    return make_testsets({}, {"n_bad_vars": 4})
+
+
+@pytest.fixture(name="count_report_opens")
+def fixture_count_report_opens(monkeypatch):
+    """
+    List to which every history file opened while writing a report (but not while analyzing the
+    testsets) is appended
+    """
+    opened = []
+    open_dataset = xr.open_dataset
+    write_report = rfh_utils.write_report
+
+    def counting_open_dataset(*args, **kwargs):
+        opened.append(args[0])
+        return open_dataset(*args, **kwargs)
+
+    def counting_write_report(*args, **kwargs):
+        with monkeypatch.context() as m:
+            m.setattr(xr, "open_dataset", counting_open_dataset)
+            return write_report(*args, **kwargs)
+
+    monkeypatch.setattr(rfh_utils, "write_report", counting_write_report)
+    return opened
+
+
+def test_rerun_reuses_all_sections(testset_dir_list, write_report, tmp_path, capsys):
+    # The first run fills the results cache; the rerun gets everything from it
+    cache_dir = str(tmp_path / "cache")
+    write_report(testset_dir_list, cache_dir=cache_dir, incremental=True)
+    assert "Reused 0/8 unchanged sections" in capsys.readouterr().out
+    write_report(testset_dir_list, cache_dir=cache_dir, incremental=True)
+    assert "Reused 8/8 unchanged sections" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_report_reads_nothing_with_cache(
+    testset_dir_list, write_report, count_report_opens, tmp_path, incremental
+):
+    # Variables fail in the second testset, so the first one's discrepancies at their worst points
+    # are needed. They come from the results cache, not from the first testset's history file.
+    cache_dir = str(tmp_path / "cache")
+    for _ in range(2):
+        report, _ = write_report(testset_dir_list, cache_dir=cache_dir, incremental=incremental)
+        assert not count_report_opens
+        with open(report) as f:
+            assert f.read().count("; diff in testset0 = 0<br>") == 4 * 5
+
+    # Without the cache, the first testset has to be read again
+    write_report(testset_dir_list)
+    assert len(count_report_opens) == 1
@@ -0,0 +1,52 @@
+"""
+Tests of reading (and caching) the variables in a history file
+"""
+# pylint: disable=missing-function-docstring
+
+import pytest
+
+from rfh_catalog import glob_history_files
+import rfh_manifest
+from rfh_manifest import Rfh_Manifest
+
+
+@pytest.fixture(name="count_reads")
+def fixture_count_reads(monkeypatch):
+    """
+    List to which every history file whose header is read is appended
+    """
+    read = []
+    read_header = rfh_manifest.read_header
+
+    def counting_read_header(history_file):
+        read.append(history_file)
+        return read_header(history_file)
+
+    monkeypatch.setattr(rfh_manifest, "read_header", counting_read_header)
+    return read
+
+
+def test_manifest(make_testset, test_name):
+    history_file = glob_history_files(make_testset(0, n_vars=4), test_name)[-1]
+    manifest = Rfh_Manifest.from_file(history_file)
+    synthetic = [v for v in manifest.perage_to_non_equiv if v.startswith("FATES_SYN")]
+    assert len(synthetic) == 4
+    for perage_var in synthetic:
+        assert manifest.perage_to_non_equiv[perage_var] in manifest.variables, perage_var
+        assert manifest.perage_to_weights[perage_var] in manifest.variables, perage_var
+    assert manifest.get_needed_vars() <= set(manifest.variables)
+
+
+def test_cached_until_changed(make_testset, count_reads, tmp_path, test_name):
+    cache_dir = str(tmp_path / "manifests")
+    history_file = glob_history_files(make_testset(0, n_vars=4), test_name)[-1]
+    fresh = Rfh_Manifest.from_file(history_file, cache_dir)
+    cached = Rfh_Manifest.from_file(history_file, cache_dir)
+    assert len(count_reads) == 1
+    assert cached.variables == fresh.variables
+
+    # Rewritten with more variables
+    make_testset(0, n_vars=6)
+    changed = Rfh_Manifest.from_file(history_file, cache_dir)
+    assert len(count_reads) == 2
+    assert len(changed.perage_to_non_equiv) == len(fresh.perage_to_non_equiv) + 2
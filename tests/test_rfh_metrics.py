@@ -0,0 +1,23 @@
+"""
+Tests of the SQLite database of per-variable results
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+import sqlite3
+
+from rfh_metrics import Rfh_Metrics
+
+
+def test_rollback_journal(tmp_path):
+    # Made by an older version, with a write-ahead log
+    path = str(tmp_path / "metrics.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    metrics = Rfh_Metrics(path)
+    assert metrics.conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    metrics.record([])
+    metrics.close()
+    assert os.listdir(tmp_path) == ["metrics.db"]
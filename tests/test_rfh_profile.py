@@ -0,0 +1,43 @@
+"""
+Tests of recording the time and memory each stage and variable takes
+"""
+# pylint: disable=missing-function-docstring
+
+import numpy as np
+import pytest
+
+from rfh_profile import Rfh_Profile, reset_peak_rss
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="Needs Linux's /proc/self/clear_refs")
+def test_peak_rss_per_stage():
+    profile = Rfh_Profile()
+    with profile.stage("big"):
+        x = np.ones(2**25)  # 256 MiB
+        x += 1
+        del x
+    with profile.stage("small"):
+        x = np.ones(2**10)
+    with profile.stage("outer"):
+        with profile.stage("inner"):
+            x = np.ones(2**24)  # 128 MiB, kept
+            x += 1
+    stages = profile.stages
+
+    # Only the stages that used the memory are charged with it
+    assert stages["big"]["peak_rss_mb"] > stages["small"]["peak_rss_mb"] + 200
+    assert stages["big"]["rss_growth_mb"] < 10
+    assert stages["inner"]["rss_growth_mb"] > 100
+    assert stages["outer"]["peak_rss_mb"] == stages["inner"]["peak_rss_mb"]
+
+
+def test_variables_profiled(make_testset, analyze):
+    ds_header, _, _ = analyze(make_testset(0, n_vars=4), profile=True)
+
+    variables = ds_header.attrs["profile"]["variables"]
+    assert len(variables) == 4
+    for stages in variables.values():
+        assert set(stages) == {"read", "compare"}
+        for usage in stages.values():
+            assert usage["wall"] >= 0 and usage["cpu"] >= 0
+            assert "rss_growth_mb" in usage
@@ -0,0 +1,35 @@
+"""
+Tests of checking every timestep of every history file, one timestep at a time
+"""
+# pylint: disable=missing-function-docstring
+
+import numpy as np
+
+N_FILES = 3
+N_TIMES = 2
+N_BAD_VARS = 2
+
+# Of the first history file, as formatted by rfh_utils.stream_all_timesteps()
+FIRST_TIMESTEP = "2000-01-31 00:00:00"
+
+
+def test_running_stats_cover_every_timestep(make_testset, analyze):
+    testset_dir = make_testset(0, n_files=N_FILES, n_times=N_TIMES, n_bad_vars=N_BAD_VARS)
+    _, results, timesteps = analyze(testset_dir, all_timesteps=True)
+    assert sorted(timesteps) == sorted(results)
+
+    for i, perage_var in enumerate(sorted(timesteps)):
+        stats = timesteps[perage_var]
+        series = stats["max_abs_diff_series"]
+        assert stats["n_timesteps"] == len(series) == N_FILES * N_TIMES, perage_var
+        assert stats["max_abs_diff"] == max(series), perage_var
+
+        # The last timestep is the one that's checked without streaming
+        np.testing.assert_allclose(series[-1], results[perage_var][1], err_msg=perage_var)
+
+        if i < N_BAD_VARS:
+            assert stats["n_over_tol"] == N_FILES * N_TIMES, perage_var
+            assert stats["first_over_tol"] == FIRST_TIMESTEP, perage_var
+        else:
+            assert stats["n_over_tol"] == 0 and stats["first_over_tol"] is None, perage_var
+            assert stats["max_abs_diff"] == 0, perage_var
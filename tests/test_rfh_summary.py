@@ -0,0 +1,42 @@
+"""
+Tests of summarizing a comparison as JSON for the viewer
+"""
+# pylint: disable=missing-function-docstring
+
+import json
+import os
+
+import pytest
+
+from rfh_summary import SUMMARY_VERSION, VIEWER_FILENAME
+
+
+def reject_constant(name):
+    raise ValueError(f"Not valid JSON: {name}")
+
+
+def test_json_report(make_testsets, write_report, publish_dir, test_name):
+    # The first two variables fail only in the second testset
+    testset_dir_list = make_testsets({"n_vars": 4}, {"n_vars": 4, "n_bad_vars": 2})
+    report, _ = write_report(testset_dir_list, report_format="json", top_k_worst=3)
+
+    summary_file = report.replace(".html", ".json")
+    with open(summary_file) as f:
+        # No NaN or infinities, which browsers can't parse
+        summary = json.load(f, parse_constant=reject_constant)
+    assert summary["version"] == SUMMARY_VERSION
+    assert summary["test_name"] == test_name
+    assert len(summary["testsets"]) == 2
+
+    variables = sorted(summary["variables"], key=lambda v: v["name"])
+    assert len(variables) == 4
+    for i, variable in enumerate(variables):
+        assert variable["isclose"] == [True, i >= 2], variable["name"]
+        if i < 2:
+            assert len(variable["worst"][1]["diff"]) == 3, variable["name"]
+            assert variable["worst_elsewhere"][1][0] == pytest.approx([0, 0, 0])
+
+    # The report loads the summary into the viewer, which is published next to it
+    with open(report) as f:
+        assert os.path.basename(summary_file) in f.read()
+    assert os.path.exists(os.path.join(publish_dir, VIEWER_FILENAME))
@@ -0,0 +1,84 @@
+"""
+Tests of watching testsets for tests to finish
+"""
+# pylint: disable=missing-function-docstring
+
+import os
+
+import pytest
+
+from rfh_context import Rfh_Context
+import rfh_synthetic
+from rfh_watch import Rfh_Watch
+
+# Smaller still, since some tests analyze a testset more than once
+TESTSET_SIZE = {"n_lat": 6, "n_lon": 8, "n_vars": 4}
+
+
+@pytest.fixture(name="make_watch")
+def fixture_make_watch(make_testsets, make_config, test_name):
+    """
+    Function making a testset for each run status given, and a watch of test_name in all of them.
+    Returns the watch and the testsets' directories.
+    """
+
+    def make_watch(run_statuses):
+        testset_dir_list = make_testsets(
+            *[{**TESTSET_SIZE, "run_status": run_status} for run_status in run_statuses]
+        )
+        ctx = Rfh_Context(make_config())
+        return Rfh_Watch(ctx, [(test_name, testset_dir_list)]), testset_dir_list
+
+    return make_watch
+
+
+@pytest.fixture(name="get_test_dir")
+def fixture_get_test_dir(test_name):
+    def get_test_dir(testset_dir):
+        return os.path.join(testset_dir, test_name + ".synthetic")
+
+    return get_test_dir
+
+
+def test_waits_for_run_to_finish(make_watch, get_test_dir, test_name):
+    watch, testset_dir_list = make_watch(["PASS", "PEND"])
+
+    # History files that are still being added to don't count, however long they've sat there
+    assert watch.poll() == 0
+    assert len(watch.analyzed) == 1
+
+    rfh_synthetic.write_test_status(get_test_dir(testset_dir_list[1]), test_name, "PASS")
+    assert watch.poll() == 1
+    assert len(watch.analyzed) == 2
+
+    # Nothing new
+    assert watch.poll() == 0
+
+
+def test_failed_run_is_analyzed(make_watch):
+    watch, _ = make_watch(["PASS", "FAIL"])
+    assert watch.poll() == 1
+
+
+def test_no_test_status_waits_to_settle(make_watch, get_test_dir):
+    watch, testset_dir_list = make_watch(["PASS", "PASS"])
+    os.remove(os.path.join(get_test_dir(testset_dir_list[1]), "TestStatus"))
+    watch.ctx.config.watch_settle_seconds = 3600
+    assert watch.poll() == 0
+    watch.ctx.config.watch_settle_seconds = 0
+    assert watch.poll() == 1
+
+
+def test_error_doesnt_stop_watch(make_watch, make_testset, test_name):
+    watch, testset_dir_list = make_watch(["PASS", "PASS"])
+    history_file = watch.get_last_file_state(test_name, testset_dir_list[1])[0]
+    with open(history_file, "wb") as f:
+        f.write(b"not netCDF")
+    assert watch.poll() == 0
+    assert len(watch.failed) == 1
+
+    # Not retried until the file changes
+    assert watch.poll() == 0
+    make_testset(1, **TESTSET_SIZE)
+    assert watch.poll() == 1
+    assert not watch.failed
@@ -0,0 +1,24 @@
+"""
+Tests of listing where each failing variable's worst discrepancies are
+"""
+# pylint: disable=missing-function-docstring
+
+import numpy as np
+
+
+def test_worst_elsewhere(make_testsets, write_report):
+    # The first two variables fail only in the second testset
+    testset_dir_list = make_testsets({"n_vars": 4}, {"n_vars": 4, "n_bad_vars": 2})
+    report, dict_perage_to_non_equiv = write_report(testset_dir_list, top_k_worst=3)
+
+    failing = [d for d in dict_perage_to_non_equiv.values() if d.get("isclose") == [True, False]]
+    assert len(failing) == 2
+    for this_dict in failing:
+        # The first testset is fine at the second's worst points
+        worst_elsewhere = this_dict["worst_elsewhere"]
+        assert worst_elsewhere[0] == [None, None]
+        assert worst_elsewhere[1][1] is None
+        np.testing.assert_array_equal(worst_elsewhere[1][0], np.zeros(3))
+
+    with open(report) as f:
+        assert f.read().count("; diff in testset0 = 0<br>") == 2 * 3
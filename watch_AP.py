@@ -0,0 +1,43 @@
+"""
+Like check_AP_batch.py, but keeps running: watches the testsets in BATCH_TESTSET_DIR_LISTS for
+history files of the tests in BATCH_TEST_NAMES (both set in options.py), and checks and publishes
+each comparison as soon as its tests are done. Testsets that were already there are analyzed once,
+at startup, and kept in memory. Stop with Ctrl-C. Run with --help for options.
+"""
+# pylint: disable=invalid-name
+# pylint: disable=fixme
+
+import argparse
+
+from options import BATCH_TEST_NAMES, BATCH_TESTSET_DIR_LISTS
+from rfh_context import Rfh_Config, Rfh_Context
+from rfh_watch import Rfh_Watch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--max-polls",
+        type=int,
+        default=None,
+        help="Stop after this many polls (default: run until interrupted)",
+    )
+    parser.add_argument("--no-push", action="store_true", help="Commit reports but don't push")
+    return parser.parse_args()
+
+
+args = parse_args()
+ctx = Rfh_Context(Rfh_Config.from_options())
+comparisons = [
+    (test_name, testset_dir_list)
+    for test_name in BATCH_TEST_NAMES
+    for testset_dir_list in BATCH_TESTSET_DIR_LISTS
+]
+watch = Rfh_Watch(ctx, comparisons)
+try:
+    watch.run(max_polls=args.max_polls, push=not args.no_push)
+except KeyboardInterrupt:
+    print("Stopped watching")
+finally:
+    ctx.close()
+    ctx.git.wait_for_push()